@@ -1,38 +1,91 @@
 from psychopy import visual, event, core # import the bits of PsychoPy we'll need for this walkthrough
+import os
+import sys
+import random
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.scene import Scene, Layer, SpriteLayer
+from lab_utils.mouse_tracking import MouseTracker, TrajectoryWriter
+from lab_utils.input_bus import InputBus
+from lab_utils.stimuli import StimulusStore
 
 #open a window
 win = visual.Window([800,800],color="grey", units='pix', checkTiming=False) 
 
+#images are looked up by name in the shared stimulus store (see lab_utils/stimuli.py), decoded once for every task
+stimulus_store = StimulusStore()
+
 #grassy field
-field = visual.ImageStim(win,image="stimuli/images/GrassyField.png",size=[800,800])
+field = visual.ImageStim(win,image=stimulus_store.image("images/GrassyField"),size=[800,800])
+
+#create the images: bulbie in the middle, plus more pokemon scattered around if num_sprites > 1 (try 50)
+num_sprites = 1
+sprite_size = 200
+pokemon = ["bulbasaur","charmander","dratini","mew","phanpy","pikachu","squirtle","togepi","zorua"]
+sprite_images = [stimulus_store.image("images/"+pokemon[i % len(pokemon)]) for i in range(num_sprites)]
+sprite_positions = [(0,0)]+[(random.uniform(-300,300),random.uniform(-300,300)) for i in range(num_sprites-1)]
 
-#create an image
-bulbie = visual.ImageStim(win,image="stimuli/images/bulbasaur.png",size=[200,200])
+#the field and the pokemon that are not being dragged are drawn once into a cached background image;
+#each frame then only draws that image plus the pokemon being dragged
+scene = Scene(win)
+scene.add(Layer([field]))
+sprites = scene.add(SpriteLayer(win,sprite_images,sprite_positions,size=sprite_size))
 
 # create a mouse
 mouse = event.Mouse(win=win)
+# record the mouse's path from the input bus's read of it after every flip (below); each drag is saved as one trajectory
+mouse_tracker = MouseTracker()
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+if not os.path.isdir(os.path.join(cur_dir,'data')):
+    os.makedirs(os.path.join(cur_dir,'data'))
+trajectory_file = TrajectoryWriter(os.path.join(cur_dir,'data','drag_trajectories.csv'))
 
-#show the image
-field.draw()
-bulbie.draw()
+#show the images
+scene.draw()
 win.flip()
 
-#make bulbie draggable
+#make the pokemon draggable: the input bus reads the mouse after every flip and calls these on presses, moves and
+#releases, so the loop below only draws
+drag = {'sprite':None,'count':0}
+
+def pick_up(mouse_event):
+    #pick up the top-most pokemon under the mouse
+    if mouse_event.name == 0 and drag['sprite'] is None:
+        drag['sprite'] = sprites.sprite_at(mouse_event.pos)
+        if drag['sprite'] is not None:
+            sprites.lift(drag['sprite'])
+            #the trajectory starts with the sample the press was seen in
+            mouse_tracker.start_trial(since=mouse_event.time)
+
+def move(mouse_event):
+    if drag['sprite'] is not None:
+        sprites.move(drag['sprite'],mouse_event.pos)
+
+def drop(mouse_event):
+    #put it back into the background where it was dropped
+    if mouse_event.name == 0 and drag['sprite'] is not None:
+        sprites.move(drag['sprite'],mouse_event.pos)
+        sprites.drop(drag['sprite'])
+        drag['sprite'] = None
+        trajectory_file.write(drag['count'], mouse_tracker.end_trial())
+        drag['count'] += 1
+
+input_bus = InputBus(mouse=mouse, keyboard=False).install(win)
+input_bus.on_sample(mouse_tracker.record)
+input_bus.on_press(pick_up)
+input_bus.on_move(move)
+input_bus.on_release(drop)
+
 max_time = 10
 dragging_timer = core.Clock()
 dragging_timer.reset()
-
 while dragging_timer.getTime() <= max_time:
-    while mouse.isPressedIn(bulbie):
-        bulbie.pos = mouse.getPos()
-        field.draw()
-        bulbie.draw()
-        win.flip()
-        if dragging_timer.getTime() > max_time:
-            break
+    scene.draw()
+    win.flip()
 
 print(dragging_timer.getTime())
+print(scene.compositions, 'background compositions')
+print(drag['count'], 'drags', input_bus.summary())
+trajectory_file.close()
 
 win.close() #close the window
 core.quit() #quit out of the program
-
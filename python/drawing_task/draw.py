@@ -1,5 +1,8 @@
 from psychopy import visual, event, core # import the bits of PsychoPy we'll need for this walkthrough
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.paint import PaintLayer
 
 #open a window
 win = visual.Window([600,600],color="white", units='pix', checkTiming=False) 
@@ -20,25 +23,23 @@ mouse = event.Mouse(win=win)
 max_time = 10
 dragging_timer = core.Clock()
 dragging_timer.reset()
-paint_circle_list = []
+#all the paint goes into one layer that is drawn in a single batch, instead of one Circle per mouse sample
+#(which made every frame slower the longer you painted)
+paint_layer = PaintLayer(win,size=10,color="red",opacity=0.5,autoDraw=True)
 
 while dragging_timer.getTime() <= max_time:
     while mouse.isPressedIn(circle):
-        paint_circle = visual.Circle(win,lineColor=None,fillColor="red",size=[10,10],opacity=0.5,autoDraw=True)
-        paint_circle.pos = mouse.getPos()
-        paint_circle.draw()
+        paint_layer.add(mouse.getPos())
         win.flip()
-        paint_circle_list.append(paint_circle)
 
-print(paint_circle_list)
+print(len(paint_layer), 'paint dabs')
 #take a screenshot and save it
 win.getMovieFrame()
 cur_dir = os.path.dirname(os.path.abspath(__file__))
 win.saveMovieFrames(os.path.join(cur_dir,'frames','drawing.png'))
 
 #showing how to turn off autodraw and clear the screen
-for cur_circle in paint_circle_list:
-    cur_circle.autoDraw = False
+paint_layer.autoDraw = False
 win.flip()
 core.wait(2.0)
 
@@ -0,0 +1 @@
+#shared tools for the psychopy activities; scripts add the python/ folder to sys.path to import them
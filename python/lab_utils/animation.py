@@ -0,0 +1,274 @@
+import numpy as np
+from lab_utils.flip_hooks import flip_hooks, measured_frame_rate
+
+#Animation driven by the flip timestamps instead of by counting flips, so stimuli move at the same speed on a 60, 120
+#or 144 Hz display and a dropped frame doesn't slow them down:
+#
+#    animator = Animator(win).install()                   #reads the time of every flip (see flip_hooks.py)
+#    spin = animator.spin([left_square], 360)             #ori, in degrees per second
+#    animator.tween(dots, 'pos', end_positions, 2.0, ease='in_out')
+#    animator.keyframes(squares, 'color', [0, .5, 1], [red, blue, red], loop=True)
+#    while running:
+#        animator.update()                                #sets every animated property for the coming flip
+#        ...draw...; win.flip()
+#    animator.pause(spin); animator.resume(spin)
+#    print(animator.summary())                            #achieved vs target motion
+#
+#A track animates one property of many stimuli at once: its values for all of them come from one NumPy expression
+#per frame. Give it an ElementArrayStim to animate hundreds of elements (oris, xys, sizes, colors, opacities) with
+#one assignment and one draw call; a list of stimuli gets a setattr per stimulus.
+#Values are computed for the time the coming flip is expected to land (the last flip plus one frame), and after the
+#flip the animator compares them with the values for the time it really landed. The frame period comes from
+#Animator(win, frame_rate=...) if given, otherwise from measured_frame_rate(win), which times the display only once
+#per window however many animators and recorders ask.
+
+#vectorized easing curves, f(0) = 0 and f(1) = 1
+easings = {
+    'linear': lambda f: f,
+    'in': lambda f: f*f,
+    'out': lambda f: f*(2-f),
+    'in_out': lambda f: f*f*(3-2*f),
+    'step': lambda f: np.floor(f),
+}
+
+#property -> (ElementArrayStim attribute, dimensions)
+_properties = {'ori':('oris',1),'pos':('xys',2),'size':('sizes',2),'color':('colors',3),'opacity':('opacities',1)}
+
+def _is_element_array(stims):
+    return type(stims).__name__ == 'ElementArrayStim'
+
+def current_values(stims, prop):
+    """The property's current value for each stimulus, as an (n, dimensions) array (zeros where it isn't set)"""
+    attr,dims = _properties[prop]
+    if _is_element_array(stims):
+        values = getattr(stims, attr)
+        count = len(getattr(stims, 'xys'))
+        return np.zeros((count,dims)) if values is None else np.broadcast_to(np.asarray(values, dtype=float).reshape(
+            count,-1), (count,dims)).copy()
+    rows = []
+    for stim in stims:
+        value = getattr(stim, prop)
+        rows.append(np.broadcast_to(np.asarray(0.0 if value is None else value, dtype=float).ravel()[:dims], (dims,)))
+    return np.array(rows, dtype=float).reshape(-1,dims)
+
+class Track(object):
+    """One property of a group of stimuli as a function of time. Subclasses give values(local_time) -> (n, dims);
+    local time runs from start, minus any time spent paused."""
+    def __init__(self, stims, prop):
+        if prop not in _properties:
+            raise ValueError('can only animate %s, not %r' % (', '.join(sorted(_properties)), prop))
+        self.stims = stims if _is_element_array(stims) else list(stims)
+        self.prop = prop
+        self.dims = _properties[prop][1]
+        self.start = None
+        self.paused_at = None
+        self.paused_for = 0.0
+        self.shown = None #the values set for the coming flip
+        self.errors = [] #largest difference per flip between the values shown and the values for the real flip time
+
+    def local_time(self, t):
+        if self.paused_at is not None:
+            t = self.paused_at
+        return t-self.start-self.paused_for
+
+    def pause(self, t):
+        if self.paused_at is None:
+            self.paused_at = t
+
+    def resume(self, t):
+        if self.paused_at is not None:
+            self.paused_for += t-self.paused_at
+            self.paused_at = None
+
+    def apply(self, t):
+        values = self.values(self.local_time(t))
+        if self.prop == 'ori':
+            #(same as % 360, which is several times slower on float arrays)
+            values = values-360*np.floor(values/360)
+        self.shown = values
+        if _is_element_array(self.stims):
+            setattr(self.stims, _properties[self.prop][0], values[:,0] if self.dims == 1 else values)
+        elif self.dims == 1:
+            for stim,value in zip(self.stims, values[:,0].tolist()):
+                setattr(stim, self.prop, value)
+        else:
+            for stim,value in zip(self.stims, values):
+                setattr(stim, self.prop, value)
+
+    def measure(self, t):
+        """How far the values shown are from the ones for the time the flip really happened"""
+        if self.shown is None or self.paused_at is not None:
+            return
+        values = self.values(self.local_time(t))
+        if self.prop == 'ori':
+            difference = np.abs((values-self.shown+180) % 360-180)
+        else:
+            difference = np.abs(values-self.shown)
+        self.errors.append(float(difference.max()) if difference.size else 0.0)
+
+class Velocity(Track):
+    """Constant change per second from the values at the start: rate is a number or one per stimulus (n, dims).
+    With step, the values only move in whole steps (e.g. 45 degree jumps), still on the flip clock."""
+    def __init__(self, stims, prop, rate, start_values=None, step=None):
+        Track.__init__(self, stims, prop)
+        if start_values is None:
+            start_values = current_values(self.stims, prop)
+        self.start_values = np.asarray(start_values, dtype=float).reshape(-1,self.dims)
+        self.rate = np.broadcast_to(np.asarray(rate, dtype=float).reshape(-1,self.dims) if np.ndim(rate) else rate,
+            self.start_values.shape)
+        self.step = step
+
+    def values(self, local_time):
+        change = self.rate*local_time
+        if self.step:
+            change = np.trunc(change/self.step)*self.step
+        return self.start_values+change
+
+class Keyframes(Track):
+    """Values at keyframe times (k,), eased between them: (k,) or (k, dims) for all stimuli, or (n, k, dims) for each;
+    loop starts over after the last one.
+    offsets (one per stimulus, s) shift each stimulus's timeline, e.g. to stagger a wave through many elements."""
+    def __init__(self, stims, prop, times, values, ease='linear', loop=False, offsets=None):
+        Track.__init__(self, stims, prop)
+        self.times = np.asarray(times, dtype=float)
+        count = len(self.stims.xys) if _is_element_array(self.stims) else len(self.stims)
+        values = np.asarray(values, dtype=float)
+        if values.ndim < 3:
+            #the same keyframes for every stimulus: (k,) or (k, dims)
+            values = np.broadcast_to(values.reshape(1,len(self.times),-1), (count,len(self.times),self.dims))
+        self.keyframe_values = values
+        self.ease = easings[ease]
+        self.loop = loop
+        self.offsets = None if offsets is None else np.asarray(offsets, dtype=float)
+        self.rows = np.arange(count)
+
+    def values(self, local_time):
+        times = self.times
+        if self.offsets is not None:
+            local_time = local_time-self.offsets
+        if self.loop:
+            cycles = (local_time-times[0])/(times[-1]-times[0])
+            local_time = times[0]+(cycles-np.floor(cycles))*(times[-1]-times[0])
+        #one segment for all stimuli, or one each when they are offset
+        segment = np.clip(np.searchsorted(times, local_time, side='right')-1, 0, len(times)-2)
+        fraction = np.clip((local_time-times[segment])/(times[segment+1]-times[segment]), 0, 1)
+        fraction = self.ease(fraction)
+        if np.ndim(segment) == 0:
+            before,after = self.keyframe_values[:,segment],self.keyframe_values[:,segment+1]
+        else:
+            before,after = self.keyframe_values[self.rows,segment],self.keyframe_values[self.rows,segment+1]
+            fraction = fraction[:,None]
+        return before+(after-before)*fraction
+
+class Animator(object):
+    """Runs tracks on the flip clock: update() sets every property for the coming flip, and (once installed) each flip's
+    real timestamp is recorded to compare what was shown with what was meant to be"""
+    def __init__(self, win, frame_rate=None, capacity=100000):
+        self.win = win
+        if frame_rate is None:
+            frame_rate = measured_frame_rate(win)
+        self.frame_period = 1.0/frame_rate
+        self.tracks = []
+        self.last_flip = None
+        self.target = None #the flip time update() last computed values for
+        self.targets = np.zeros(capacity)
+        self.flips = np.zeros(capacity)
+        self.count = 0
+        self.capacity = capacity
+
+    def install(self):
+        """Record the time of every flip of the window from now on"""
+        flip_hooks(self.win).add(self.flipped)
+        return self
+
+    def uninstall(self):
+        flip_hooks(self.win).remove(self.flipped)
+
+    def flipped(self, flip_time):
+        """Record a flip (install() does this; call it yourself with the flip's time if not installed)"""
+        #the first flip has no flip before it to predict it from
+        if self.target is not None and self.last_flip is not None:
+            i = self.count % self.capacity
+            self.targets[i] = self.target
+            self.flips[i] = flip_time
+            self.count += 1
+            for track in self.tracks:
+                track.measure(flip_time)
+        self.target = None
+        self.last_flip = flip_time
+
+    def now(self):
+        """When the coming flip should land: a frame after the last one (or right away, before the first)"""
+        if self.last_flip is None:
+            from psychopy import core
+            return core.getTime()
+        return self.last_flip+self.frame_period
+
+    def add(self, track):
+        """Start a track; its time 0 is the coming flip unless track.start is already set"""
+        if track.start is None:
+            track.start = self.now()
+        self.tracks.append(track)
+        return track
+
+    def remove(self, track):
+        self.tracks.remove(track)
+
+    def spin(self, stims, rate, step=None):
+        """Rotate stims at rate degrees per second (clockwise, like ori)"""
+        return self.add(Velocity(stims, 'ori', rate, step=step))
+
+    def move(self, stims, prop, rate, step=None):
+        """Change prop by rate per second (e.g. 'pos' in units per second)"""
+        return self.add(Velocity(stims, prop, rate, step=step))
+
+    def tween(self, stims, prop, end, duration, start=None, ease='linear', repeat=None, offsets=None):
+        """From start (default: the current values) to end over duration seconds; repeat=None, 'loop' or 'pingpong'"""
+        count = len(stims.xys) if _is_element_array(stims) else len(stims)
+        dims = _properties[prop][1]
+        if start is None:
+            start = current_values(stims, prop)
+        start = np.broadcast_to(np.asarray(start, dtype=float).reshape(-1,dims), (count,dims))
+        end = np.broadcast_to(np.asarray(end, dtype=float).reshape(-1,dims), (count,dims))
+        if repeat == 'pingpong':
+            return self.add(Keyframes(stims, prop, [0,duration,2*duration], np.stack([start,end,start], axis=1), ease,
+                loop=True, offsets=offsets))
+        return self.add(Keyframes(stims, prop, [0,duration], np.stack([start,end], axis=1), ease, loop=repeat == 'loop',
+            offsets=offsets))
+
+    def keyframes(self, stims, prop, times, values, ease='linear', loop=False, offsets=None):
+        return self.add(Keyframes(stims, prop, times, values, ease, loop, offsets))
+
+    def pause(self, track):
+        track.pause(self.now())
+
+    def resume(self, track):
+        track.resume(self.now())
+
+    def update(self, t=None):
+        """Set every track's property for time t (default: when the coming flip should land)"""
+        self.target = self.now() if t is None else t
+        for track in self.tracks:
+            track.apply(self.target)
+        return self.target
+
+    def summary(self):
+        """How far the flips landed from when they were meant to (ms, and frames that landed late by over half a
+        frame), and for each track the largest and mean difference between the values shown and the values for the
+        real flip times (degrees, units or color values), next to the target rate of constant-rate tracks"""
+        count = min(self.count, self.capacity)
+        errors = (self.flips[:count]-self.targets[:count])*1000
+        summary = {'frames':self.count,'late_frames':int(np.sum(errors > self.frame_period*500))}
+        if count:
+            summary.update({'flip_error_mean_ms':round(float(np.mean(np.abs(errors))),3),
+                'flip_error_max_ms':round(float(np.max(np.abs(errors))),3)})
+        summary['tracks'] = []
+        for track in self.tracks:
+            row = {'prop':track.prop,'elements':len(track.shown) if track.shown is not None else 0}
+            if track.errors:
+                row['error_max'] = round(max(track.errors), 4)
+                row['error_mean'] = round(float(np.mean(track.errors)), 4)
+            if isinstance(track, Velocity):
+                row['target_rate'] = float(track.rate.flat[0])
+            summary['tracks'].append(row)
+        return summary
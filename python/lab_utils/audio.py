@@ -0,0 +1,227 @@
+import os
+import wave
+import threading
+import numpy as np
+
+#Feedback sounds that start on a flip:
+#
+#    feedback_sounds = FeedbackSounds({'correct':'stimuli/sounds/bleep.wav','incorrect':'stimuli/sounds/buzz.wav'})
+#    (or FeedbackSounds({'correct':'sounds/bleep','incorrect':'sounds/buzz'}, store=StimulusStore()), see stimuli.py)
+#    correct_feedback.draw()
+#    feedback_sounds.play_on_flip('correct', win)      #before the flip that shows the feedback
+#    win.flip()
+#    ...
+#    feedback_sounds.asynchrony_ms()                   #audio onset - visual onset of the last sound, once it started
+#
+#Each wav is decoded once into a float32 array shared by everyone who loads it. Output goes through one stream
+#opened up front: sounddevice if it is installed (sounds are scheduled for the next flip's predicted time and the
+#audio onset is read from the stream's DAC timestamps), otherwise psychopy.sound (started from the flip callback;
+#the onset can't be measured). Set LAB_AUDIO=null for a silent output that reports onsets at the requested time
+#plus LAB_AUDIO_LATENCY seconds, for running without a sound card (the headless runner does this).
+
+_pcm_cache = {}
+
+def decode_wav(path):
+    """(samples, sample_rate) of a PCM wav file as float32 frames x channels in [-1, 1], decoded once per path"""
+    path = os.path.abspath(path)
+    if path not in _pcm_cache:
+        with wave.open(path, 'rb') as wav_file:
+            channels = wav_file.getnchannels()
+            width = wav_file.getsampwidth()
+            rate = wav_file.getframerate()
+            data = wav_file.readframes(wav_file.getnframes())
+        if width == 1:
+            samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32)-128)/128
+        elif width in (2,4):
+            dtype = np.int16 if width == 2 else np.int32
+            samples = np.frombuffer(data, dtype=dtype).astype(np.float32)/float(np.iinfo(dtype).max+1)
+        else:
+            raise ValueError('%s: %d-byte samples are not supported' % (path, width))
+        samples = samples.reshape(-1, channels)
+        samples.flags.writeable = False
+        _pcm_cache[path] = (samples, rate)
+    return _pcm_cache[path]
+
+class NullOutput(object):
+    """No sound at all: every sound 'starts' at its requested time (or when play is called) plus `latency`"""
+    schedules = True
+    def __init__(self, sample_rate=44100, channels=2, latency=0.0, clock=None):
+        if clock is None:
+            from psychopy import core
+            clock = core.getTime
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.latency = latency
+        self.clock = clock
+
+    def play(self, name, samples, when, record):
+        record['audio_onset'] = (when if when is not None else self.clock())+self.latency
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+class SoundDeviceOutput(object):
+    """One sounddevice output stream, opened once and kept running; sounds are mixed in its callback.
+    A sound given a start time begins on the exact sample the DAC plays at that time, and its real onset
+    (from the stream's outputBufferDacTime) is written into its record."""
+    schedules = True
+    def __init__(self, sample_rate=44100, channels=2, latency='low', clock=None):
+        import sounddevice
+        if clock is None:
+            from psychopy import core
+            clock = core.getTime
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.clock = clock
+        self.voices = [] #[samples, position, start (stream time) or None, record]
+        self.lock = threading.Lock()
+        self.stream = sounddevice.OutputStream(samplerate=sample_rate, channels=channels, dtype='float32',
+            latency=latency, callback=self._callback)
+        self.stream.start()
+        #stream time -> our clock
+        self.clock_offset = min(self.clock()-self.stream.time for _ in range(5))
+
+    def _callback(self, outdata, frames, time_info, status):
+        outdata.fill(0)
+        dac_time = time_info.outputBufferDacTime
+        with self.lock:
+            for voice in self.voices:
+                samples,position,start,record = voice
+                offset = 0
+                if position == 0:
+                    if start is not None:
+                        offset = int(round((start-dac_time)*self.sample_rate))
+                        if offset >= frames:
+                            continue
+                        offset = max(0, offset)
+                    record['audio_onset'] = dac_time+offset/float(self.sample_rate)+self.clock_offset
+                count = min(frames-offset, len(samples)-position)
+                outdata[offset:offset+count] += samples[position:position+count]
+                voice[1] = position+count
+            self.voices = [voice for voice in self.voices if voice[1] < len(voice[0])]
+
+    def play(self, name, samples, when, record):
+        start = None if when is None else when-self.clock_offset
+        with self.lock:
+            self.voices.append([samples, 0, start, record])
+
+    def stop(self):
+        with self.lock:
+            self.voices = []
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+class PsychopyOutput(object):
+    """psychopy.sound, one Sound per decoded buffer made up front; sounds start when play is called
+    (FeedbackSounds calls it from the flip), and their real onset is unknown"""
+    schedules = False
+    def __init__(self, sample_rate=44100, channels=2):
+        from psychopy import sound
+        self.sound = sound
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sounds = {}
+        self.playing = []
+
+    def prepare(self, name, samples):
+        self.sounds[name] = self.sound.Sound(value=np.asarray(samples), sampleRate=self.sample_rate,
+            stereo=self.channels == 2)
+
+    def play(self, name, samples, when, record):
+        self.sounds[name].play()
+        self.playing.append(self.sounds[name])
+
+    def stop(self):
+        for cur_sound in self.playing:
+            cur_sound.stop()
+        self.playing = []
+
+    def close(self):
+        self.stop()
+
+def default_output(sample_rate=44100, channels=2):
+    """LAB_AUDIO=null -> NullOutput, else sounddevice if installed, else psychopy.sound"""
+    if os.environ.get('LAB_AUDIO') == 'null':
+        return NullOutput(sample_rate, channels, latency=float(os.environ.get('LAB_AUDIO_LATENCY', 0)))
+    try:
+        return SoundDeviceOutput(sample_rate, channels)
+    except (ImportError, OSError):
+        return PsychopyOutput(sample_rate, channels)
+
+def decode_sounds(paths, store=None):
+    """{name: (samples, sample_rate)} for FeedbackSounds' paths. Only reads and decodes files (no audio device), so it
+    can run on a worker thread; the FeedbackSounds made from the same paths later just opens the output."""
+    return dict((name, store.pcm(path) if store is not None else decode_wav(path)) for name,path in paths.items())
+
+class FeedbackSounds(object):
+    """A few short sounds ({name: wav path}, or {name: logical name} with a store from lab_utils.stimuli) decoded
+    once and played through one pre-opened output.
+    Every play is recorded as {'name','requested','visual_onset','audio_onset'} (times on core.getTime's clock,
+    None until known) in self.playbacks. Make it on the main thread: the output opens the audio device."""
+    def __init__(self, paths, output=None, store=None):
+        self.samples = {}
+        rates = set()
+        for name,(samples,rate) in decode_sounds(paths, store).items():
+            self.samples[name] = samples
+            rates.add(rate)
+        if len(rates) > 1:
+            raise ValueError('feedback sounds must share one sample rate, got %s' % sorted(rates))
+        sample_rate = rates.pop() if rates else 44100
+        channels = max([samples.shape[1] for samples in self.samples.values()] or [2])
+        #mono sounds are played on every channel of the shared stream
+        for name,samples in self.samples.items():
+            if samples.shape[1] != channels:
+                self.samples[name] = np.repeat(samples[:,:1], channels, axis=1)
+        self.output = output or default_output(sample_rate, channels)
+        if hasattr(self.output, 'prepare'):
+            for name,samples in self.samples.items():
+                self.output.prepare(name, samples)
+        self.playbacks = []
+
+    def play(self, name, when=None):
+        """Play now, or at `when` (core.getTime clock) if the output can schedule"""
+        record = {'name':name,'requested':when,'visual_onset':None,'audio_onset':None}
+        self.output.play(name, self.samples[name], when, record)
+        self.playbacks.append(record)
+        return record
+
+    def play_on_flip(self, name, win):
+        """Start `name` with the next flip of win; call this just before that flip"""
+        record = {'name':name,'requested':None,'visual_onset':None,'audio_onset':None}
+        if self.output.schedules:
+            record['requested'] = win.getFutureFlipTime(clock=None)
+            self.output.play(name, self.samples[name], record['requested'], record)
+        else:
+            win.callOnFlip(self.output.play, name, self.samples[name], None, record)
+        win.timeOnFlip(record, 'visual_onset')
+        self.playbacks.append(record)
+        return record
+
+    def stop(self):
+        self.output.stop()
+
+    def close(self):
+        self.output.close()
+
+    def asynchrony_ms(self, record=None):
+        """Audio onset minus visual onset (ms) of record (default: the last sound played), None if not known yet"""
+        if record is None:
+            if not self.playbacks:
+                return None
+            record = self.playbacks[-1]
+        if record['audio_onset'] is None or record['visual_onset'] is None:
+            return None
+        return (record['audio_onset']-record['visual_onset'])*1000
+
+    def summary(self):
+        asynchronies = [self.asynchrony_ms(record) for record in self.playbacks]
+        asynchronies = np.array([value for value in asynchronies if value is not None])
+        if not len(asynchronies):
+            return '%d sounds, audio-visual asynchrony not measured (%s)' % (len(self.playbacks), type(self.output).__name__)
+        return '%d sounds, audio-visual asynchrony mean %.2f ms, sd %.2f ms, max %.2f ms (%s)' % (len(self.playbacks),
+            asynchronies.mean(), asynchronies.std(), np.abs(asynchronies).max(), type(self.output).__name__)
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.animation import Animator
+
+## Benchmark of the animation engine, without psychopy or a window:
+## 1. motion: a square meant to turn at 360 deg/s, turned by 6 degrees per flip (square_exercise_complete.py before)
+##    vs by the Animator from the flip times, on simulated 60/120/144 Hz displays that drop 1% of their frames
+## 2. cost per frame of animating N elements: a Python loop adding to each stimulus's ori (before) vs one Animator
+##    track over a list of stimuli vs over an ElementArrayStim (arrays set in one go), plus a staggered pos tween
+##
+##   python bench_animation.py [seconds of simulated motion]
+
+class Stim(object):
+    """Stands in for a psychopy stimulus (plain attributes, so this measures the animation side only)"""
+    def __init__(self):
+        self.ori = 0.0
+        self.pos = (0.0,0.0)
+
+class ElementArrayStim(object):
+    """Stands in for psychopy's ElementArrayStim"""
+    def __init__(self, count):
+        self.xys = np.zeros((count,2))
+        self.oris = np.zeros(count)
+        self.sizes = self.colors = self.opacities = None
+
+def flip_times(frame_rate, duration, drop_rate=0.01, seed=0):
+    """Flip times of a display that misses the refresh (and shows the frame one refresh later) now and then"""
+    rng = np.random.default_rng(seed)
+    frames = int(duration*frame_rate)
+    return np.cumsum(1+(rng.random(frames) < drop_rate))/float(frame_rate)
+
+def motion(frame_rate, duration):
+    times = flip_times(frame_rate, duration)
+    frame_locked = Stim()
+    square = Stim()
+    animator = Animator(None, frame_rate=frame_rate)
+    animator.flipped(0.0)
+    animator.spin([square], 360)
+    turned = 0.0
+    for flip_time in times:
+        frame_locked.ori += 6
+        before = square.ori
+        animator.update()
+        turned += (square.ori-before) % 360
+        animator.flipped(flip_time)
+    return frame_locked.ori/times[-1], turned/times[-1], animator.summary()
+
+def frame_cost(update, frames=300):
+    start = time.perf_counter()
+    for frame in range(frames):
+        update()
+    return (time.perf_counter()-start)/frames*1e6
+
+def costs(count):
+    stims = [Stim() for i in range(count)]
+    def add_to_each():
+        for stim in stims:
+            stim.ori += 6
+    results = {'loop, ori += 6 each': frame_cost(add_to_each)}
+    for label,target in [('Animator, list of stimuli', [Stim() for i in range(count)]),
+            ('Animator, ElementArrayStim', ElementArrayStim(count))]:
+        animator = Animator(None, frame_rate=60)
+        animator.flipped(0.0)
+        animator.spin(target, 360)
+        results[label+' (spin)'] = frame_cost(animator.update)
+    elements = ElementArrayStim(count)
+    animator = Animator(None, frame_rate=60)
+    animator.flipped(0.0)
+    animator.tween(elements, 'pos', np.random.default_rng(0).uniform(-300,300,(count,2)), 1.0, ease='in_out',
+        repeat='pingpong', offsets=np.linspace(0,1,count))
+    results['Animator, ElementArrayStim (staggered pos tween)'] = frame_cost(animator.update)
+    return results
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    for frame_rate in (60,120,144):
+        frame_locked,animated,summary = motion(frame_rate, duration)
+        print('%3d Hz: 6 deg/flip turns %6.1f deg/s, Animator %6.1f deg/s (target 360); Animator max error %.1f deg, '
+            '%d late frames' % (frame_rate, frame_locked, animated, summary['tracks'][0]['error_max'], summary['late_frames']))
+    for count in (100,500,2000):
+        for label,cost in costs(count).items():
+            print('%5d elements  %-52s %8.1f us/frame' % (count, label, cost))
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import random
+import threading
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.input_bus import InputBus
+
+## Benchmark of reading keys in a frame loop: the old square exercise (event.getKeys called once for each of 's', 'r'
+## and 'q' on every pass, with and without a flip pacing the loop) vs the InputBus (one read per flip, or bus.wait
+## when there is nothing to draw). A thread presses random keys at random times into a simulated keyboard that behaves
+## like psychopy.event (getKeys returns the keys asked for and empties the whole buffer). Reports the keys lost, the
+## latency from key press to handler, and the CPU the loop uses. Runs without psychopy or a window.
+##
+##   python bench_input_bus.py [seconds per loop]
+
+keys = ['s','r','q']
+frame_period = 1/60.
+
+class SimulatedKeyboard(object):
+    """Keys pressed by a background thread, kept in a buffer until someone calls getKeys"""
+    def __init__(self, rate=20.0, seed=0):
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.pressed = 0
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self._stop = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.rng.expovariate(self.rate)):
+            with self.lock:
+                self.buffer.append((self.rng.choice(keys), time.perf_counter()))
+                self.pressed += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def getKeys(self, keyList=None):
+        with self.lock:
+            buffer,self.buffer = self.buffer,[]
+        return [[key,key_time] for key,key_time in buffer if keyList is None or key in keyList]
+
+    poll = getKeys
+
+def flip():
+    #a vsync'ed flip: block until the next refresh
+    now = time.perf_counter()
+    time.sleep(frame_period-now % frame_period)
+
+def run(loop, duration):
+    keyboard = SimulatedKeyboard().start()
+    latencies = []
+    handle = lambda key,key_time: latencies.append(time.perf_counter()-key_time)
+    wall,cpu = time.perf_counter(),time.process_time()
+    loop(keyboard, handle, time.perf_counter()+duration)
+    wall,cpu = time.perf_counter()-wall,time.process_time()-cpu
+    keyboard.stop()
+    latencies = np.asarray(latencies)*1000
+    return {'pressed':keyboard.pressed,'handled':len(latencies),'lost':keyboard.pressed-len(latencies),
+        'latency_mean_ms':latencies.mean() if len(latencies) else float('nan'),
+        'latency_p99_ms':np.percentile(latencies, 99) if len(latencies) else float('nan'),'cpu':cpu/wall}
+
+def getkeys_spin(keyboard, handle, end):
+    #the stopped square exercise: no flip, three getKeys per pass
+    while time.perf_counter() < end:
+        for key in keys:
+            for key,key_time in keyboard.getKeys([key]):
+                handle(key, key_time)
+
+def getkeys_flip(keyboard, handle, end):
+    #the spinning square exercise: a flip, then three getKeys
+    while time.perf_counter() < end:
+        flip()
+        for key in keys:
+            for key,key_time in keyboard.getKeys([key]):
+                handle(key, key_time)
+
+def bus_flip(keyboard, handle, end):
+    bus = InputBus(keys=keys, key_source=keyboard, clock=time.perf_counter)
+    bus.on_key(keys, lambda key_event: handle(key_event.name, key_event.time))
+    while time.perf_counter() < end:
+        flip()
+        bus.update()
+
+def bus_wait(keyboard, handle, end):
+    bus = InputBus(keys=keys, key_source=keyboard, clock=time.perf_counter)
+    bus.on_key(keys, lambda key_event: handle(key_event.name, key_event.time))
+    bus.wait(end-time.perf_counter())
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    for label,loop in [('getKeys x3, no flip (old, stopped)', getkeys_spin), ('getKeys x3 after each flip (old)', getkeys_flip),
+            ('InputBus after each flip', bus_flip), ('InputBus.wait, no frames', bus_wait)]:
+        result = run(loop, duration)
+        print('%-36s %4d pressed %4d lost  latency mean %6.2f ms p99 %6.2f ms  cpu %5.1f%%' % (label, result['pressed'],
+            result['lost'], result['latency_mean_ms'], result['latency_p99_ms'], result['cpu']*100))
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import random
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.key_response import collect_keys
+
+## Benchmark of keyboard response collection against a simulated key source:
+## CPU use while waiting and timestamp error (measured rt - true rt) for the old spinning loop and collect_keys
+
+class SimulatedKeySource(object):
+    """Presses `key` a random rt after each clear(). Like psychopy.event, presses are timestamped when they are
+    polled unless hardware_timestamps is set (psychtoolbox-style, stamped at the press itself)."""
+    def __init__(self, rts, key='z', hardware_timestamps=False, poll_interval=0.0005):
+        self.rts = iter(rts)
+        self.key = key
+        self.hardware_timestamps = hardware_timestamps
+        self.poll_interval = poll_interval
+        self.now = time.perf_counter
+        self.sleep = time.sleep
+        self.true_rt = None
+
+    def clear(self):
+        self.start = self.now()
+        self.true_rt = next(self.rts)
+        self.pressed = False
+
+    def poll(self, keyList):
+        cur_time = self.now()
+        if self.pressed or cur_time-self.start < self.true_rt:
+            return []
+        self.pressed = True
+        return [[self.key, self.start+self.true_rt if self.hardware_timestamps else cur_time]]
+
+def spin_collect(source, keyList, duration=0, max_keys=1, poll_interval=None):
+    """The old get_keyboard_response loop: poll as fast as possible"""
+    source.clear()
+    start = source.now()
+    responded = []
+    while True:
+        if not responded:
+            responded = [[key,keyTime-start] for key,keyTime in source.poll(keyList)]
+        if duration > 0:
+            if source.now()-start > duration:
+                break
+        elif responded:
+            break
+    return responded
+
+def run(collect, num_trials, hardware_timestamps=False, seed=1):
+    rng = random.Random(seed)
+    rts = [rng.uniform(.2,.6) for _ in range(num_trials)]
+    source = SimulatedKeySource(rts, hardware_timestamps=hardware_timestamps)
+    errors = []
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(num_trials):
+        response = collect(source, ['z','m'])
+        errors.append((response[0][1]-source.true_rt)*1000)
+    cpu = time.process_time()-cpu_start
+    wall = time.perf_counter()-wall_start
+    mean = sum(errors)/len(errors)
+    sd = (sum((e-mean)**2 for e in errors)/len(errors))**.5
+    return {'cpu_pct':100*cpu/wall, 'mean_err_ms':mean, 'sd_err_ms':sd, 'max_err_ms':max(errors)}
+
+if __name__ == '__main__':
+    num_trials = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for label,collect,hardware in [('spin loop (old)',spin_collect,False),
+            ('collect_keys, event timestamps',collect_keys,False),
+            ('collect_keys, hardware timestamps',collect_keys,True)]:
+        result = run(collect, num_trials, hardware_timestamps=hardware)
+        print('%-36s cpu %5.1f%%  error mean %.3f ms  sd %.3f ms  max %.3f ms' % (label, result['cpu_pct'],
+            result['mean_err_ms'], result['sd_err_ms'], result['max_err_ms']))
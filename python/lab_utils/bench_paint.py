@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.paint import PaintLayer
+
+## Screenshot check and benchmark of PaintLayer against one Circle per dab (drawing_task/draw.py before):
+## 1. the same random stroke (mouse-like whole-pixel positions) is painted both ways over draw.py's white circle and
+##    the two back buffers are compared pixel by pixel; the exit status is 1 if any pixel differs
+## 2. frame time (adding 4 dabs, drawing, glFinish) after 100, 1000 and 10000 dabs
+## Needs a real window, so run it on a lab machine (python -m lab_utils.headless lab_utils/bench_paint.py only checks
+## that it runs).
+##
+##   python bench_paint.py [num_dabs]
+
+from psychopy import visual
+
+try:
+    from pyglet.gl import glFinish
+except ImportError:
+    glFinish = lambda: None
+
+size,color,opacity = 10,'red',0.5
+
+def stroke(num_dabs, seed=0):
+    """A random walk of whole-pixel positions inside the background circle"""
+    rng = np.random.default_rng(seed)
+    steps = rng.integers(-3, 4, size=(num_dabs,2))
+    return np.clip(np.cumsum(steps, axis=0), -140, 140).astype(float)
+
+def screenshot(win):
+    frame = win.getMovieFrame(buffer='back')
+    return None if frame is None else np.asarray(frame, dtype=np.int16)
+
+def paint_circles(win, background, points):
+    background.draw()
+    circle = visual.Circle(win, lineColor=None, fillColor=color, size=[size,size], opacity=opacity)
+    for point in points:
+        circle.pos = point
+        circle.draw()
+    return screenshot(win)
+
+def paint_layer(win, background, points):
+    background.draw()
+    layer = PaintLayer(win, size=size, color=color, opacity=opacity)
+    layer.extend(points)
+    layer.draw()
+    return screenshot(win)
+
+def frame_times(win, background, num_dabs, per_frame=4, frames=60, batched=True):
+    points = stroke(num_dabs+per_frame*frames, seed=1)
+    if batched:
+        layer = PaintLayer(win, size=size, color=color, opacity=opacity)
+        layer.extend(points[:num_dabs])
+    else:
+        circles = [visual.Circle(win, lineColor=None, fillColor=color, size=[size,size], opacity=opacity, pos=point)
+            for point in points[:num_dabs]]
+    times = []
+    for frame in range(frames):
+        new = points[num_dabs+frame*per_frame:num_dabs+(frame+1)*per_frame]
+        start = time.perf_counter()
+        background.draw()
+        if batched:
+            for point in new:
+                layer.add(point)
+            layer.draw()
+        else:
+            circles.extend(visual.Circle(win, lineColor=None, fillColor=color, size=[size,size], opacity=opacity,
+                pos=point) for point in new)
+            for circle in circles:
+                circle.draw()
+        glFinish()
+        times.append(time.perf_counter()-start)
+        win.flip()
+    return np.array(times)*1000
+
+if __name__ == '__main__':
+    num_dabs = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 2000
+    win = visual.Window([600,600], color='white', units='pix', checkTiming=False)
+    background = visual.Circle(win, lineColor='black', fillColor='white', size=[300,300])
+    points = stroke(num_dabs)
+    old = paint_circles(win, background, points)
+    win.flip()
+    new = paint_layer(win, background, points)
+    win.flip()
+    differing = None
+    if old is None or new is None:
+        print('no screenshot from this window, pixels not compared')
+    else:
+        diff = np.abs(old-new).max(axis=-1)
+        differing = int(np.count_nonzero(diff))
+        print('%d dabs: %d of %d pixels differ (max difference %d)' % (num_dabs, differing, diff.size, diff.max()))
+    for count in (100,1000,10000):
+        for label,batched in (('one Circle per dab (old)',False),('PaintLayer',True)):
+            times = frame_times(win, background, count, batched=batched)
+            print('%6d dabs  %-26s mean %7.2f ms  max %7.2f ms' % (count, label, times.mean(), times.max()))
+    win.close()
+    sys.exit(1 if differing else 0)
@@ -0,0 +1,101 @@
+import os
+import atexit
+import threading
+import queue
+
+class DataWriter(object):
+    """Writes trial rows from a background thread so disk latency stays off the trial loop.
+    write() only queues the row; the thread writes whatever has queued up in one go and only flushes + fsyncs
+    at checkpoints: every checkpoint_every rows, whenever checkpoint() is called (e.g. in the ITI or at the end
+    of a block), and on close(). Rows up to the last checkpoint are on disk even if the process dies.
+    close() also runs at exit (core.quit() or an uncaught exception), or use the writer as a context manager."""
+    _checkpoint = object()
+    _stop = object()
+
+    def __init__(self, path, header=None, separator=',', mode='w', checkpoint_every=None, encode=None):
+        self.separator = separator
+        self.checkpoint_every = checkpoint_every
+        self.encode = encode or self.encode_row
+        self.file = open(path, mode)
+        self.joiner = b'' if 'b' in mode else '' #encode may return bytes for binary files
+        self.rows_queued = 0
+        self.rows_written = 0
+        self.rows_synced = 0
+        self.error = None
+        self.queue = queue.Queue()
+        self.synced = threading.Condition()
+        self.closed = False
+        if header is not None:
+            self.file.write(separator.join(header)+'\n')
+        self.thread = threading.Thread(target=self._run, name='data-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def encode_row(self, row):
+        return self.separator.join([str(i) for i in row])+'\n'
+
+    def write(self, row):
+        self._raise_error()
+        self.queue.put(row)
+        self.rows_queued += 1
+        if self.checkpoint_every and self.rows_queued % self.checkpoint_every == 0:
+            self.queue.put(self._checkpoint)
+
+    def checkpoint(self, wait=False):
+        """Make everything written so far durable; wait=True blocks until it is"""
+        self._raise_error()
+        target = self.rows_queued
+        self.queue.put(self._checkpoint)
+        if wait:
+            with self.synced:
+                while self.rows_synced < target and self.error is None and self.thread.is_alive():
+                    self.synced.wait()
+            self._raise_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(self._stop)
+        self.thread.join()
+        self.file.close()
+        atexit.unregister(self.close)
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error,self.error = self.error,None
+            raise error
+
+    def _run(self):
+        stop = False
+        while not stop:
+            items = [self.queue.get()]
+            #batch up whatever else is already waiting
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [item for item in items if item is not self._checkpoint and item is not self._stop]
+            sync = len(rows) < len(items)
+            stop = any(item is self._stop for item in items)
+            try:
+                if rows:
+                    self.file.write(self.joiner.join([self.encode(row) for row in rows]))
+                    self.rows_written += len(rows)
+                if sync:
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+            except Exception as error:
+                self.error = error
+            with self.synced:
+                if sync:
+                    self.rows_synced = self.rows_written
+                self.synced.notify_all()
@@ -0,0 +1,126 @@
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+#Declarative trial designs: cross factors, repeat the crossing, add derived columns, then give every subject
+#their own shuffle (from their own numpy Generator) that satisfies ordering constraints.
+#Used by the mental rotation trial lists (mental_rotation/generate_trials.py) and the Stroop task (stroop_task/stroop.py).
+
+class Factor(object):
+    def __init__(self, name, levels):
+        self.name = name
+        self.levels = np.asarray(levels)
+
+class MaxRunLength(object):
+    """No more than max_run trials in a row with the same value of column"""
+    def __init__(self, column, max_run):
+        self.column = column
+        self.max_run = max_run
+
+    def violations(self, values):
+        """Positions that end a run longer than max_run"""
+        if len(values) <= self.max_run:
+            return np.empty(0, dtype=int)
+        windows = sliding_window_view(values, self.max_run+1)
+        return np.flatnonzero((windows == windows[:,:1]).all(axis=1)) + self.max_run
+
+def NoImmediateRepeat(column):
+    """The same value of column never appears on two trials in a row"""
+    return MaxRunLength(column, 1)
+
+def subject_rng(seed, subject_index=None):
+    """numpy Generator for one subject: from their own seed, or (with subject_index) an independent
+    stream spawned from a study-wide seed"""
+    if subject_index is None:
+        return np.random.default_rng(int(seed))
+    return np.random.default_rng(np.random.SeedSequence(int(seed), spawn_key=(int(subject_index),)))
+
+class Design(object):
+    """factors are fully crossed `repetitions` times. derived maps new column names to functions of the
+    column dict (numpy arrays) that return an array, e.g. a stimulus file name or the correct key.
+    column_order sets the order columns are written in (factors then derived columns by default).
+    weights is a function of the column dict returning how many copies of each crossed row to keep (e.g. to
+    make congruent trials more or less common than a full crossing would)."""
+    def __init__(self, factors, repetitions=1, derived=None, constraints=None, column_order=None, weights=None):
+        self.factors = factors
+        self.repetitions = repetitions
+        self.derived = derived or {}
+        self.weights = weights
+        self.constraints = constraints or []
+        self.columns = self._cross()
+        self.num_trials = len(self.columns[factors[0].name])
+        self.names = list(column_order or self.columns.keys())
+
+    def _cross(self):
+        shape = [len(factor.levels) for factor in self.factors]
+        level_index = np.indices(shape).reshape(len(shape), -1)
+        columns = {}
+        for factor,index in zip(self.factors, level_index):
+            columns[factor.name] = np.tile(factor.levels[index], self.repetitions)
+        for name,derive in self.derived.items():
+            columns[name] = np.asarray(derive(columns))
+        if self.weights is not None:
+            keep = np.repeat(np.arange(len(level_index[0])*self.repetitions), np.asarray(self.weights(columns), dtype=int))
+            columns = {name:column[keep] for name,column in columns.items()}
+        return columns
+
+    def order(self, rng, max_repairs=10000):
+        """A random trial order that satisfies the constraints: shuffle, then swap trials that break a
+        constraint with random other trials until none do"""
+        order = rng.permutation(self.num_trials)
+        if not self.constraints:
+            return order
+        for _ in range(max_repairs):
+            bad = np.unique(np.concatenate([constraint.violations(self.columns[constraint.column][order])
+                for constraint in self.constraints] + [np.empty(0, dtype=int)]))
+            if len(bad) == 0:
+                return order
+            for position,target in zip(bad, rng.integers(0, self.num_trials, len(bad))):
+                order[position],order[target] = order[target],order[position]
+        raise RuntimeError('could not satisfy the design constraints in %d repairs' % max_repairs)
+
+    def trials(self, rng):
+        """Column dict for one subject, in their trial order"""
+        order = self.order(rng)
+        return {name:column[order] for name,column in self.columns.items()}
+
+    def orders(self, subjects, study_seed=None):
+        """subjects is a list of dicts with at least subj_code and seed (other keys become constant columns).
+        Seeds are used as-is unless study_seed is given, in which case subject i gets stream i of study_seed.
+        Returns (subject, trial order) pairs; the order indexes the rows of self.columns."""
+        lists = []
+        for subject_index,subject in enumerate(subjects):
+            if study_seed is None:
+                rng = subject_rng(subject['seed'])
+            else:
+                rng = subject_rng(study_seed, subject_index)
+            lists.append((subject,self.order(rng)))
+        return lists
+
+    def row_text(self, separator=','):
+        """Every design row formatted once, so writing a subject's list is just reordering these"""
+        body = [self.columns[name].astype(str) for name in self.names]
+        return np.array([separator.join(row) for row in zip(*body)], dtype=object)
+
+    def write(self, subjects, out_dir, leading_columns=('subj_code','seed'), study_seed=None, separator=','):
+        """Write one <subj_code>_trials.csv per subject into out_dir: the subject's own columns first
+        (leading_columns plus any other keys), then the design columns. Returns the file paths."""
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        paths = []
+        row_text = self.row_text(separator)
+        for subject,order in self.orders(subjects, study_seed):
+            subject_cols = list(leading_columns) + [key for key in subject if key not in leading_columns]
+            header = subject_cols + self.names
+            prefix = separator.join([str(subject[key]) for key in subject_cols]) + separator
+            #one join in C instead of a Python loop over the rows
+            body = prefix + ('\n'+prefix).join(row_text[order].tolist())
+            path = os.path.join(out_dir, str(subject['subj_code'])+'_trials.csv')
+            #write next to the final file and rename, so a list is either complete or not there at all
+            tmp_path = path+'.tmp%d' % os.getpid()
+            with open(tmp_path, 'w') as trial_file:
+                trial_file.write(separator.join(header)+'\n')
+                trial_file.write(body+'\n')
+            os.replace(tmp_path, path)
+            paths.append(path)
+        return paths
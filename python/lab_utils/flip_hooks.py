@@ -0,0 +1,57 @@
+#One wrapper around win.flip for everything that has to run after each flip (FlipRecorder, InputBus, Animator,
+#MouseTracker), so they can be installed and uninstalled in any order instead of each stacking its own wrapper:
+#
+#    hooks = flip_hooks(win)            #the window's registry (made, and win.flip wrapped, the first time)
+#    hooks.add(callback)                #callback(flip_time) after every flip, in the order they were added
+#    hooks.remove(callback)             #once the last one is removed win.flip is the window's own again
+#
+#    frame_rate = measured_frame_rate(win)   #measured once per window, however many users ask for it
+
+class FlipHooks(object):
+    """Callbacks run with the flip's timestamp right after each win.flip()"""
+    def __init__(self, win):
+        self.win = win
+        self.callbacks = []
+        self._flip = None
+        self._flip_was_set = False #win.flip was already an instance attribute (someone else's wrapper)
+
+    def add(self, callback):
+        if not self.callbacks:
+            self._flip = self.win.flip
+            self._flip_was_set = 'flip' in vars(self.win)
+            self.win.flip = self.flip
+        self.callbacks.append(callback)
+        return callback
+
+    def remove(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+        if not self.callbacks and self._flip is not None:
+            if self._flip_was_set:
+                self.win.flip = self._flip
+            else:
+                del self.win.flip
+            self._flip = None
+
+    def flip(self, *args, **kwargs):
+        flip_time = self._flip(*args, **kwargs)
+        if flip_time is None:
+            flip_time = self.win.lastFrameT
+        #a callback may remove itself (or others) while the flip is being handled
+        for callback in list(self.callbacks):
+            callback(flip_time)
+        return flip_time
+
+def flip_hooks(win):
+    """The FlipHooks of win, made the first time it is asked for"""
+    hooks = getattr(win, '_flip_hooks', None)
+    if hooks is None:
+        hooks = win._flip_hooks = FlipHooks(win)
+    return hooks
+
+def measured_frame_rate(win, default=60.0):
+    """win.getActualFrameRate() (which blocks while it times a run of flips), measured only once per window"""
+    frame_rate = getattr(win, '_measured_frame_rate', None)
+    if frame_rate is None:
+        frame_rate = win._measured_frame_rate = win.getActualFrameRate() or default
+    return frame_rate
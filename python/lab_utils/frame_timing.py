@@ -0,0 +1,169 @@
+import numpy as np
+from lab_utils.flip_hooks import flip_hooks, measured_frame_rate
+
+#Records every win.flip(): when it happened, which trial and phase it belonged to, and whether frames were lost.
+#
+#    recorder = FlipRecorder(win).install()    #from now on win.flip() is recorded
+#    recorder.mark('fixation', trial=trial_num, duration=.3)
+#    fixation_cross.draw()
+#    win.flip()
+#    ...
+#    timing = recorder.trial_timing(trial_num, ['fixation','stimulus','feedback'])   #{'fixation_ms':..., 'dropped_frames':...}
+#    print(recorder.summary())
+#
+#A phase runs from its first flip to the next flip of a different phase. Two kinds of lost frames are counted:
+#dropped frames, when consecutive flips of the same phase are more than a refresh apart (an animation skipping), and
+#late frames, when a phase given a duration stays up longer than that duration rounded to whole frames.
+
+class FlipRecorder(object):
+    """Timestamps each flip (through the window's flip hooks) into a preallocated ring buffer (the last `capacity` flips).
+    Running totals per phase are kept as phases end, so summary() covers the whole session."""
+    def __init__(self, win, capacity=4096, frame_rate=None, tolerance=0.5):
+        self.win = win
+        if frame_rate is None:
+            frame_rate = measured_frame_rate(win)
+        self.frame_period = 1.0/frame_rate
+        #an interval longer than (1+tolerance) refreshes means at least one frame was missed
+        self.tolerance = tolerance
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.trials = np.full(capacity, -1, dtype=np.int32)
+        self.phases = np.zeros(capacity, dtype=np.int16)
+        self.count = 0
+        self.phase_names = ['']
+        self.phase_codes = {'':0}
+        self.trial = -1
+        self.phase = 0
+        self.requested = None
+        self.trial_starts = {} #trial -> index of its first flip
+        self.late_by_trial = {}
+        self.totals = {} #phase -> running totals, see _end_phase
+        self.dropped = 0
+        self.max_interval = 0.0
+        self._last_time = None
+        self._last_phase = None #(trial, phase code, requested) of the last flip
+        self._phase_start = None
+
+    def install(self):
+        """Record every flip of the window from now on"""
+        flip_hooks(self.win).add(self.flipped)
+        return self
+
+    def uninstall(self):
+        flip_hooks(self.win).remove(self.flipped)
+
+    def mark(self, phase, trial=None, duration=None):
+        """Tag the following flips with `phase` (and `trial`, if given). `duration` (s) is how long the phase is
+        meant to stay up; it is only used to count late frames."""
+        if phase not in self.phase_codes:
+            self.phase_codes[phase] = len(self.phase_names)
+            self.phase_names.append(phase)
+        self.phase = self.phase_codes[phase]
+        if trial is not None:
+            self.trial = trial
+        self.requested = duration
+
+    def flipped(self, flip_time):
+        """Record a flip (install() does this; call it yourself with the flip's time if not installed)"""
+        i = self.count % self.capacity
+        self.times[i] = flip_time
+        self.trials[i] = self.trial
+        self.phases[i] = self.phase
+        cur_phase = (self.trial, self.phase, self.requested)
+        if self._last_time is not None:
+            interval = flip_time-self._last_time
+            if interval > self.max_interval:
+                self.max_interval = interval
+            if cur_phase == self._last_phase:
+                if interval > (1+self.tolerance)*self.frame_period:
+                    missed = int(round(interval/self.frame_period))-1
+                    self.dropped += missed
+                    self.totals[self.phase_names[self.phase]]['dropped'] += missed
+            else:
+                self._end_phase(flip_time)
+        if cur_phase != self._last_phase:
+            if self.trial not in self.trial_starts:
+                self.trial_starts[self.trial] = self.count
+            self._phase_start = flip_time
+            self.totals.setdefault(self.phase_names[self.phase],
+                {'count':0,'total_s':0.0,'timed':0,'timed_s':0.0,'requested_s':0.0,'late':0,'late_frames':0,'dropped':0})
+        self._last_time = flip_time
+        self._last_phase = cur_phase
+        self.count += 1
+
+    def _end_phase(self, end_time):
+        trial,phase,requested = self._last_phase
+        totals = self.totals[self.phase_names[phase]]
+        duration = end_time-self._phase_start
+        totals['count'] += 1
+        totals['total_s'] += duration
+        if requested is not None:
+            totals['timed'] += 1
+            totals['timed_s'] += duration
+            totals['requested_s'] += requested
+            late = self.late_frames(duration, requested)
+            if late:
+                totals['late'] += 1
+                totals['late_frames'] += late
+                self.late_by_trial[trial] = self.late_by_trial.get(trial,0)+late
+
+    def late_frames(self, duration, requested):
+        """Whole frames by which `duration` overran `requested` rounded up to the frame grid"""
+        target = np.ceil(requested/self.frame_period-1e-6)*self.frame_period
+        return max(0, int(round((duration-target)/self.frame_period)))
+
+    def _recent(self, start):
+        """Flips from index `start` on as (times, trials, phases), oldest first; None if they were overwritten"""
+        if start is None or self.count-start > self.capacity:
+            return None
+        index = np.arange(start, self.count) % self.capacity
+        return self.times[index], self.trials[index], self.phases[index]
+
+    def trial_timing(self, trial, phases):
+        """Per-trial data columns: '<phase>_ms' (achieved duration of each of `phases`, 'NA' if it was not shown or
+        has not ended yet), 'dropped_frames' and 'late_frames' for the trial's finished phases."""
+        timing = dict((phase+'_ms','NA') for phase in phases)
+        timing['dropped_frames'] = 'NA'
+        timing['late_frames'] = 'NA'
+        recent = self._recent(self.trial_starts.get(trial))
+        if recent is None:
+            return timing
+        times,trials,codes = recent
+        #flips of this trial, plus the one after it (which ends its last phase)
+        count = int(np.argmax(trials != trial)) if (trials != trial).any() else len(trials)
+        times,codes = times[:count+1],codes[:count+1]
+        starts = np.flatnonzero(np.r_[True, codes[1:count] != codes[:count-1]]) if count else np.array([], dtype=int)
+        ends = np.r_[starts[1:], count]
+        dropped = 0
+        for start,end in zip(starts,ends):
+            name = self.phase_names[codes[start]]
+            intervals = np.diff(times[start:end])
+            missed = intervals[intervals > (1+self.tolerance)*self.frame_period]
+            dropped += int(np.sum(np.rint(missed/self.frame_period)-1))
+            if end < len(times):
+                duration = times[end]-times[start]
+                if name in phases and timing[name+'_ms'] == 'NA':
+                    timing[name+'_ms'] = round(float(duration)*1000, 2)
+        timing['dropped_frames'] = dropped
+        #requested durations are not kept per flip, so late frames are totalled per trial as phases end
+        timing['late_frames'] = self.late_by_trial.get(trial,0)
+        return timing
+
+    def summary(self):
+        """Session summary: refresh interval, flips, dropped frames and per-phase achieved vs requested durations"""
+        lines = ['%d flips at %.2f ms/frame, %d dropped frames, longest interval %.1f ms' % (self.count,
+            self.frame_period*1000, self.dropped, self.max_interval*1000)]
+        for phase in self.phase_names:
+            totals = self.totals.get(phase)
+            if not totals or not totals['count']:
+                continue
+            line = '    %-12s x%-5d mean %8.1f ms' % (phase or '(untagged)', totals['count'],
+                totals['total_s']*1000/totals['count'])
+            if totals['timed']:
+                line += '  (timed: %.1f ms, requested %.1f ms, late %d, %d frames)' % (
+                    totals['timed_s']*1000/totals['timed'], totals['requested_s']*1000/totals['timed'],
+                    totals['late'], totals['late_frames'])
+            if totals['dropped']:
+                line += '  dropped %d frames' % totals['dropped']
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,619 @@
+import os
+import sys
+import json
+import math
+import time
+import wave
+import types
+import random
+import runpy
+import threading
+import argparse
+import traceback
+import numpy as np
+
+## Headless runner: runs any of the activity scripts without a display or a human.
+## visual/event/core/sound/gui are swapped for a no-op backend on a virtual clock (core.wait and win.flip just move
+## the clock forward, so sessions run much faster than real time) and a virtual participant answers keyboard and
+## mouse polls with ex-Gaussian RTs. The scripts write their normal data files; run_session returns timing stats.
+##
+##   python -m lab_utils.headless mental_rotation/mental_rotation_complete.py --sessions 20 --var subj_code=sim_{session}
+
+class SessionTimeout(BaseException):
+    """Raised by the virtual clock once a session runs past max_time (BaseException so scripts can't swallow it)"""
+
+class VirtualParticipant(object):
+    """Responds rt() seconds after the last flip, picking keys at random from the keys the script is listening for
+    and clicking somewhere inside one of the shapes/images that were just drawn"""
+    def __init__(self, seed=0, rt_mu=.45, rt_sigma=.05, rt_tau=.15, keys=('space',), hold_time=.3, drag_step=4):
+        self.rng = random.Random(seed)
+        self.rt_mu = rt_mu
+        self.rt_sigma = rt_sigma
+        self.rt_tau = rt_tau
+        self.keys = list(keys)
+        self.hold_time = hold_time
+        self.drag_step = drag_step
+
+    def rt(self):
+        return max(.1, self.rng.gauss(self.rt_mu, self.rt_sigma) + self.rng.expovariate(1.0/self.rt_tau))
+
+    def choose_key(self, keyList):
+        if isinstance(keyList, str):
+            keyList = [keyList]
+        return self.rng.choice(list(keyList) if keyList else self.keys)
+
+    def choose_click(self, stims):
+        clickable = [stim for stim in stims if not isinstance(stim, TextStim)] or [None]
+        target = self.rng.choice(clickable)
+        if target is None:
+            return (0.0,0.0)
+        (x,y),(w,h) = target.pos, target.extent()
+        return (x+self.rng.uniform(-w/4,w/4), y+self.rng.uniform(-h/4,h/4))
+
+class SessionState(object):
+    """Everything one simulated session shares: the virtual clock, the participant and the counters"""
+    def __init__(self, participant, frame_rate=60, max_time=3600, dialog_values=None, poll_step=.005):
+        self.participant = participant
+        self.frame_period = 1.0/frame_rate
+        self.max_time = max_time
+        self.dialog_values = dialog_values or {}
+        self.poll_step = poll_step
+        self.now = 0.0
+        self.last_flip = 0.0
+        self.pending_key = None #(time, key)
+        self.pending_click = None #(time, pos)
+        self.flips = 0
+        self.phases = {} #frame label -> {'count','frames','total_s'}
+        self.cur_phase = None #(label, start time, frames)
+        self.key_rts = []
+        self.clicks = 0
+        self.sounds = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def advance(self, secs):
+        self.now += max(0.0, secs)
+        if self.max_time is not None and self.now > self.max_time:
+            raise SessionTimeout('session ran past %s virtual seconds' % self.max_time)
+
+    def advance_to(self, when):
+        self.advance(when-self.now)
+
+    def step_toward(self, when):
+        """One poll's worth of time, landing exactly on `when` if it is closer (so float error can't stall a poll loop)"""
+        if when-self.now <= self.poll_step:
+            self.advance(when-self.now)
+            self.now = max(self.now, when)
+        else:
+            self.advance(self.poll_step)
+
+    def on_flip(self, label):
+        if self.cur_phase is not None and self.cur_phase[0] == label:
+            self.cur_phase = (label, self.cur_phase[1], self.cur_phase[2]+1)
+        else:
+            self.end_phase()
+            self.cur_phase = (label, self.now, 1)
+        self.flips += 1
+        self.last_flip = self.now
+
+    def end_phase(self):
+        if self.cur_phase is None:
+            return
+        label,start,frames = self.cur_phase
+        phase = self.phases.setdefault(label, {'count':0,'frames':0,'total_s':0.0})
+        phase['count'] += 1
+        phase['frames'] += frames
+        phase['total_s'] += self.now-start
+        self.cur_phase = None
+
+    def key_due(self, keyList):
+        """The participant's next key press, scheduled an rt after the last flip"""
+        if self.pending_key is None:
+            when = max(self.now, self.last_flip+self.participant.rt())
+            self.pending_key = (when, self.participant.choose_key(keyList))
+        return self.pending_key
+
+    def click_due(self, stims):
+        if self.pending_click is None:
+            when = max(self.now, self.last_flip+self.participant.rt())
+            self.pending_click = [when, self.participant.choose_click(stims)]
+        return self.pending_click
+
+_state = None
+
+def state():
+    if _state is None:
+        raise RuntimeError('no headless session is running')
+    return _state
+
+#---- core
+
+def getTime():
+    return state().now
+
+def wait(secs, hogCPUperiod=0.2):
+    cur_state = state()
+    cur_state.waits += 1
+    cur_state.wait_time += max(0.0, secs)
+    cur_state.advance(secs)
+
+def quit():
+    raise SystemExit(0)
+
+class Clock(object):
+    def __init__(self):
+        self.start = getTime()
+
+    def getTime(self):
+        return getTime()-self.start
+
+    def reset(self, newT=0.0):
+        self.start = getTime()+newT
+
+    def addTime(self, t):
+        self.start += t
+
+class MonotonicClock(Clock):
+    pass
+
+class CountdownTimer(Clock):
+    def __init__(self, start=0):
+        Clock.__init__(self)
+        self.start += start
+
+    def getTime(self):
+        return self.start-getTime()
+
+    def add(self, t):
+        self.start += t
+
+#---- visual
+
+class _Stim(object):
+    """Stands in for every stimulus type: keeps whatever attributes it is given, set<Attr>() works, draw() is counted"""
+    defaults = {'pos':(0,0),'size':None,'ori':0.0,'opacity':1.0,'units':'pix','text':'','image':None}
+
+    def __init__(self, win=None, *args, **kwargs):
+        self.__dict__['win'] = win
+        self.__dict__['_autoDraw'] = False
+        for name,value in self.defaults.items():
+            setattr(self, name, value)
+        for name,value in kwargs.items():
+            setattr(self, name, value)
+
+    def __setattr__(self, name, value):
+        if name in ('pos','size') and value is not None:
+            value = np.asarray(value, dtype=float)
+            if value.shape == ():
+                value = np.array([value,value])
+        if name == 'autoDraw':
+            self.setAutoDraw(value)
+            return
+        self.__dict__[name] = value
+
+    def __getattr__(self, name):
+        if name.startswith('set') and len(name) > 3:
+            attr = name[3].lower()+name[4:]
+            return lambda value, *args, **kwargs: setattr(self, attr, value)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return None
+
+    @property
+    def autoDraw(self):
+        return self._autoDraw
+
+    def setAutoDraw(self, value, log=None):
+        self.__dict__['_autoDraw'] = bool(value)
+        if self.win is not None:
+            if value and self not in self.win._autodraw:
+                self.win._autodraw.append(self)
+            elif not value and self in self.win._autodraw:
+                self.win._autodraw.remove(self)
+
+    def draw(self, win=None):
+        (win or self.win)._drawn.append(self)
+
+    def extent(self):
+        if self.size is not None:
+            return abs(float(self.size[0])),abs(float(self.size[1]))
+        return (100.0,100.0)
+
+    def contains(self, x, y=None):
+        if y is None:
+            x,y = x[0],x[1]
+        (w,h) = self.extent()
+        return abs(x-self.pos[0]) <= w/2 and abs(y-self.pos[1]) <= h/2
+
+    def overlaps(self, other):
+        return self.contains(other.pos)
+
+    def label(self):
+        return type(self).__name__
+
+class TextStim(_Stim):
+    def extent(self):
+        height = self.height or 20
+        return (.6*height*max(1,len(str(self.text))), height)
+
+    def label(self):
+        return 'TextStim(%s)' % str(self.text)[:20].replace('\n',' ')
+
+class ImageStim(_Stim):
+    def __init__(self, win=None, image=None, *args, **kwargs):
+        _Stim.__init__(self, win, *args, **kwargs)
+        self.image = image
+        if self.size is None:
+            self.size = self._image_size(image)
+
+    def _image_size(self, image):
+        try:
+            from PIL import Image
+            if isinstance(image, Image.Image):
+                return image.size
+            if isinstance(image, np.ndarray):
+                return (image.shape[1],image.shape[0])
+            if isinstance(image, str):
+                with Image.open(image) as im:
+                    return im.size
+        except (ImportError, IOError):
+            pass
+        return (100,100)
+
+class Rect(_Stim):
+    def __init__(self, win=None, width=None, height=None, *args, **kwargs):
+        _Stim.__init__(self, win, *args, **kwargs)
+        if self.size is None:
+            self.size = (width or .5, height or .5)
+
+class Circle(_Stim):
+    pass
+
+class ShapeStim(_Stim):
+    pass
+
+class ElementArrayStim(_Stim):
+    pass
+
+class BufferImageStim(_Stim):
+    def __init__(self, win=None, buffer='back', rect=(-1,1,1,-1), stim=(), *args, **kwargs):
+        _Stim.__init__(self, win, *args, **kwargs)
+        self.stim = list(stim)
+
+class Window(object):
+    def __init__(self, size=(800,600), color=(0,0,0), units='pix', fullscr=False, checkTiming=True, **kwargs):
+        self.size = np.asarray(size)
+        self.color = color
+        self.units = units
+        self._drawn = []
+        self._autodraw = []
+        self._on_flip = []
+        self._time_on_flip = []
+        self.monitorFramePeriod = state().frame_period
+        self.lastFrameT = getTime()
+        self.frameIntervals = []
+        self.recordFrameIntervals = False
+        self.mouseVisible = True
+        self.movieFrames = 0
+
+    def flip(self, clearBuffer=True):
+        cur_state = state()
+        drawn = self._autodraw + self._drawn
+        label = '+'.join(sorted(set(stim.label() for stim in drawn))) or 'blank'
+        #the flip lands on the next frame boundary
+        cur_state.advance_to((math.floor(cur_state.now/cur_state.frame_period+1e-9)+1)*cur_state.frame_period)
+        flip_time = cur_state.now
+        cur_state.on_flip(label)
+        if self.recordFrameIntervals:
+            self.frameIntervals.append(flip_time-self.lastFrameT)
+        self.lastFrameT = flip_time
+        self.lastDrawn = drawn
+        for obj,attr in self._time_on_flip:
+            if isinstance(obj, dict):
+                obj[attr] = flip_time
+            else:
+                setattr(obj, attr, flip_time)
+        for function,args,kwargs in self._on_flip:
+            function(*args, **kwargs)
+        self._on_flip = []
+        self._time_on_flip = []
+        if clearBuffer:
+            self._drawn = []
+        return flip_time
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._on_flip.append((function,args,kwargs))
+
+    def timeOnFlip(self, obj, attrib):
+        self._time_on_flip.append((obj,attrib))
+
+    def getFutureFlipTime(self, targetTime=0, clock=None):
+        cur_state = state()
+        return (math.floor((cur_state.now+targetTime)/cur_state.frame_period+1e-9)+1)*cur_state.frame_period
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return 1.0/state().frame_period
+
+    def getMovieFrame(self, buffer='front'):
+        self.movieFrames += 1
+
+    def saveMovieFrames(self, fileName, *args, **kwargs):
+        directory = os.path.dirname(fileName)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            from PIL import Image
+            Image.new('RGB', tuple(int(s) for s in self.size), 'grey').save(fileName)
+        except ImportError:
+            pass
+
+    def setMouseVisible(self, visible):
+        self.mouseVisible = visible
+
+    def close(self):
+        pass
+
+#---- event
+
+def clearEvents(eventType=None):
+    cur_state = state()
+    if cur_state.pending_key is not None and cur_state.pending_key[0] <= cur_state.now:
+        cur_state.pending_key = None
+
+def _take_key(keyList, timeStamped):
+    cur_state = state()
+    when,key = cur_state.pending_key
+    cur_state.pending_key = None
+    if isinstance(keyList, str):
+        keyList = [keyList]
+    if keyList and key not in keyList:
+        return [] #like psychopy, keys nobody asked for are dropped
+    cur_state.key_rts.append(when-cur_state.last_flip)
+    if timeStamped is True:
+        return [[key,when]]
+    if timeStamped:
+        return [[key,timeStamped.getTime()-(cur_state.now-when)]]
+    return [key]
+
+def getKeys(keyList=None, timeStamped=False, modifiers=False):
+    cur_state = state()
+    when,key = cur_state.key_due(keyList)
+    if when > cur_state.now:
+        cur_state.step_toward(when)
+        if when > cur_state.now:
+            return []
+    return _take_key(keyList, timeStamped)
+
+def waitKeys(maxWait=float('inf'), keyList=None, timeStamped=False, clearEvents=True, modifiers=False):
+    cur_state = state()
+    start = cur_state.now
+    while True:
+        when,key = cur_state.key_due(keyList)
+        if when-start > maxWait:
+            cur_state.advance_to(start+maxWait)
+            return None
+        cur_state.advance_to(when)
+        keys = _take_key(keyList, timeStamped)
+        if keys:
+            return keys
+
+class Mouse(object):
+    def __init__(self, visible=True, newPos=None, win=None):
+        self.win = win
+        self.pos = np.array([0.0,0.0])
+
+    def _click(self):
+        """The active click as [time, pos] if the button is down right now, scheduling one if needed"""
+        cur_state = state()
+        if threading.current_thread() is not threading.main_thread():
+            #samplers on other threads see the button as it is, but never schedule clicks or move the clock
+            click = cur_state.pending_click
+            if click is None or click[0] > cur_state.now or cur_state.now-click[0] > cur_state.participant.hold_time:
+                return None
+            return click
+        drawn = getattr(self.win, 'lastDrawn', []) if self.win is not None else []
+        click = cur_state.click_due(drawn)
+        if click[0] > cur_state.now:
+            cur_state.step_toward(click[0])
+            if click[0] > cur_state.now:
+                return None
+        else:
+            #polling a held button still takes time, or a loop that never flips would never see it released
+            cur_state.advance(cur_state.poll_step)
+        if cur_state.now-click[0] > cur_state.participant.hold_time:
+            cur_state.pending_click = None
+            cur_state.clicks += 1
+            return None
+        return click
+
+    def getPressed(self, getTime=False):
+        pressed = [1,0,0] if self._click() is not None else [0,0,0]
+        return (pressed,[0,0,0]) if getTime else pressed
+
+    def isPressedIn(self, shape, buttons=(0,1,2)):
+        click = self._click()
+        return click is not None and shape.contains(click[1])
+
+    def getPos(self):
+        cur_state = state()
+        click = cur_state.pending_click
+        if click is not None and click[0] <= cur_state.now and threading.current_thread() is threading.main_thread():
+            #dragging: wander a little from the click point
+            step = cur_state.participant.drag_step
+            click[1] = (click[1][0]+cur_state.participant.rng.uniform(-step,step), click[1][1]+cur_state.participant.rng.uniform(-step,step))
+            self.pos = np.asarray(click[1])
+        return self.pos
+
+    def setPos(self, newPos=(0,0)):
+        self.pos = np.asarray(newPos, dtype=float)
+
+    def setVisible(self, visible):
+        pass
+
+    def clickReset(self, buttons=(0,1,2)):
+        pass
+
+    def getWheelRel(self):
+        return np.array([0.0,0.0])
+
+#---- sound
+
+class Sound(object):
+    def __init__(self, value='A', secs=.5, *args, **kwargs):
+        self.value = value
+        self.secs = secs
+        self.status = 'NOT_STARTED'
+        if isinstance(value, str) and value.endswith('.wav') and os.path.exists(value):
+            with wave.open(value, 'rb') as wav_file:
+                self.secs = wav_file.getnframes()/float(wav_file.getframerate())
+
+    def play(self, loops=None, when=None, *args, **kwargs):
+        state().sounds += 1
+        self.status = 'STARTED'
+
+    def stop(self, *args, **kwargs):
+        self.status = 'STOPPED'
+
+    def getDuration(self):
+        return self.secs
+
+    def setVolume(self, newVol, *args, **kwargs):
+        pass
+
+#---- gui
+
+class DlgFromDict(object):
+    def __init__(self, dictionary, title='', fixed=None, order=None, tip=None, **kwargs):
+        for key,value in list(dictionary.items()):
+            if isinstance(value, (list,tuple)):
+                #pick the first real choice, skipping a 'Choose' placeholder
+                choices = [choice for choice in value if choice != 'Choose'] or list(value)
+                dictionary[key] = choices[0]
+        for key,value in state().dialog_values.items():
+            if key in dictionary:
+                dictionary[key] = type(dictionary[key])(value) if isinstance(dictionary[key], (int,float)) else value
+        self.dictionary = dictionary
+        self.OK = True
+
+class Dlg(object):
+    def __init__(self, title='', *args, **kwargs):
+        self.fields = []
+        self.OK = True
+
+    def addText(self, text, *args, **kwargs):
+        pass
+
+    def addField(self, label, initial='', *args, **kwargs):
+        self.fields.append(state().dialog_values.get(label, initial))
+
+    def show(self):
+        return list(self.fields)
+
+#---- install
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+def install():
+    """Put the headless backend in sys.modules under psychopy.* (once per process)"""
+    if getattr(sys.modules.get('psychopy'), '_headless', False):
+        return
+    visual = _module('psychopy.visual', Window=Window, ImageStim=ImageStim, TextStim=TextStim, Rect=Rect,
+        Circle=Circle, ShapeStim=ShapeStim, Polygon=ShapeStim, Line=ShapeStim, GratingStim=ImageStim,
+        ElementArrayStim=ElementArrayStim, BufferImageStim=BufferImageStim, TextBox2=TextStim)
+    event = _module('psychopy.event', getKeys=getKeys, waitKeys=waitKeys, clearEvents=clearEvents, Mouse=Mouse)
+    core = _module('psychopy.core', Clock=Clock, MonotonicClock=MonotonicClock, CountdownTimer=CountdownTimer,
+        getTime=getTime, wait=wait, quit=quit, rush=lambda *args, **kwargs: None)
+    sound = _module('psychopy.sound', Sound=Sound)
+    gui = _module('psychopy.gui', DlgFromDict=DlgFromDict, Dlg=Dlg)
+    keyboard = _module('psychopy.hardware.keyboard', havePTB=False)
+    hardware = _module('psychopy.hardware', keyboard=keyboard)
+    psychopy = _module('psychopy', visual=visual, event=event, core=core, sound=sound, gui=gui, hardware=hardware,
+        __version__='headless', _headless=True)
+    psychopy.__path__ = []
+    for module in (psychopy,visual,event,core,sound,gui,hardware,keyboard):
+        sys.modules[module.__name__] = module
+    #lab_utils.audio plays into a silent output whose onsets are on the virtual clock
+    os.environ.setdefault('LAB_AUDIO', 'null')
+
+def run_session(script, session=0, seed=0, dialog_values=None, frame_rate=60, max_time=3600, participant=None):
+    """Run one script start to finish on the headless backend and return its timing stats"""
+    global _state
+    install()
+    script = os.path.abspath(script)
+    dialog_values = dict((key,str(value).format(session=session)) for key,value in (dialog_values or {}).items())
+    if participant is None:
+        participant = VirtualParticipant(seed=seed*1000003+session)
+    _state = SessionState(participant, frame_rate=frame_rate, max_time=max_time, dialog_values=dialog_values)
+    old_cwd,old_path = os.getcwd(),list(sys.path)
+    os.chdir(os.path.dirname(script)) #the scripts find their stimuli relative to the working directory
+    sys.path.insert(0, os.path.dirname(script))
+    wall_start = time.perf_counter()
+    outcome = 'finished'
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit:
+        outcome = 'quit'
+    except SessionTimeout:
+        outcome = 'timeout'
+    except Exception:
+        outcome = 'error: ' + traceback.format_exc(limit=-3)
+    finally:
+        os.chdir(old_cwd)
+        sys.path[:] = old_path
+    wall = time.perf_counter()-wall_start
+    cur_state,_state = _state,None
+    cur_state.end_phase()
+    phases = dict((label,{'count':phase['count'],'frames':phase['frames'],'mean_ms':1000*phase['total_s']/phase['count']})
+        for label,phase in cur_state.phases.items())
+    rts = cur_state.key_rts
+    return {'script':os.path.basename(script),'session':session,'outcome':outcome,
+        'virtual_s':cur_state.now,'wall_s':wall,'speedup':cur_state.now/wall if wall > 0 else float('inf'),
+        'flips':cur_state.flips,'waits':cur_state.waits,'wait_s':cur_state.wait_time,
+        'keys':len(rts),'mean_rt_ms':1000*sum(rts)/len(rts) if rts else None,
+        'clicks':cur_state.clicks,'sounds':cur_state.sounds,'phases':phases}
+
+def _run_session_args(args):
+    return run_session(*args)
+
+def run_sessions(script, num_sessions, processes=1, seed=0, dialog_values=None, frame_rate=60, max_time=3600):
+    jobs = [(script,session,seed,dialog_values,frame_rate,max_time) for session in range(num_sessions)]
+    if processes > 1:
+        from multiprocessing import Pool
+        with Pool(processes) as pool:
+            return pool.map(_run_session_args, jobs)
+    return [_run_session_args(job) for job in jobs]
+
+def summarize(results):
+    wall = sum(result['wall_s'] for result in results)
+    virtual = sum(result['virtual_s'] for result in results)
+    outcomes = {}
+    for result in results:
+        outcomes[result['outcome'].split('\n')[0]] = outcomes.get(result['outcome'].split('\n')[0],0)+1
+    return {'sessions':len(results),'outcomes':outcomes,'virtual_s':virtual,'wall_s':wall,
+        'speedup':virtual/wall if wall > 0 else float('inf'),
+        'flips':sum(result['flips'] for result in results),'keys':sum(result['keys'] for result in results)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a psychopy activity script headless with a simulated participant')
+    parser.add_argument('script')
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frame-rate', type=float, default=60)
+    parser.add_argument('--max-time', type=float, default=3600, help='virtual seconds before a session is stopped')
+    parser.add_argument('--var', action='append', default=[], help='dialog value, e.g. subj_code=sim_{session}')
+    parser.add_argument('--json', help='write every session\'s stats to this file')
+    args = parser.parse_args()
+    dialog_values = dict(var.split('=',1) for var in args.var)
+    results = run_sessions(args.script, args.sessions, args.processes, args.seed, dialog_values, args.frame_rate, args.max_time)
+    for result in results:
+        print('session %(session)d: %(outcome)s, %(virtual_s).1f s virtual in %(wall_s).2f s (%(speedup).0fx), %(flips)d flips, %(keys)d keys' % result)
+        for label,phase in sorted(result['phases'].items(), key=lambda item: -item[1]['count'])[:8]:
+            print('    %-50s x%-4d mean %7.1f ms' % (label[:50], phase['count'], phase['mean_ms']))
+    print(json.dumps(summarize(results)))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=1)
@@ -0,0 +1,183 @@
+import time
+import collections
+import numpy as np
+from lab_utils.flip_hooks import flip_hooks
+
+#Input for frame loops: the keyboard and mouse are read once per frame into one buffer of timestamped events, which
+#are then handed to whatever subscribed to them, instead of every part of the loop polling the devices itself:
+#
+#    bus = InputBus(mouse=mouse).install(win)            #reads the devices and dispatches after every flip
+#    bus.on_key('q', quit_handler)                       #handler(event); event.name is the key
+#    bus.on_click(HitTester([image_1, image_2]), click)  #handler(event, index of the stimulus clicked)
+#    bus.on_press(pick_up); bus.on_move(drag); bus.on_release(drop)
+#    bus.on_sample(tracker.record)                       #handler(time, pos, buttons) for every read of the mouse
+#    while running:
+#        ...draw...; win.flip()                          #the flip waits for the refresh, so the loop doesn't spin
+#
+#Every key the source returns is kept, whichever handler it is for: psychopy's getKeys empties the whole key buffer,
+#so checking it three times a frame for three different keys loses the ones that came in before the wrong check.
+#With nothing to draw, bus.wait(duration) keeps reading and dispatching while it sleeps between reads.
+#The mouse is read once per update: with the pyglet backend its state only changes when the window handles its
+#events on flip, so reading it more often (e.g. from a thread) would just see the same state again. Installed, the
+#bus stamps what it reads from the mouse with the time of the flip it was read after. A press and release that both
+#come between two flips is not seen, as with polling the Mouse directly.
+
+InputEvent = collections.namedtuple('InputEvent', ['kind','name','pos','time'])
+InputEvent.__doc__ = """kind is 'key', 'press', 'release' or 'move'; name is the key or the mouse button (0 = left);
+pos is the mouse position (None for keys); time is when it happened (core.getTime's clock)"""
+
+class InputBus(object):
+    """Timestamped keyboard/mouse events, read once per update() and dispatched to subscribed handlers.
+    key_source is anything with poll(keyList) -> [[key, time]] (default: psychopy.event; see
+    key_response.py for hardware-timestamped ones); keys limits which keys are kept (None = all).
+    mouse is a psychopy Mouse (None for keyboard only). The last `history` events stay in self.events."""
+    def __init__(self, mouse=None, keys=None, key_source=None, keyboard=True, clock=None, history=1000):
+        if clock is None:
+            from psychopy import core
+            clock = core.getTime
+        if keyboard and key_source is None:
+            from lab_utils.key_response import EventKeySource
+            key_source = EventKeySource()
+        self.key_source = key_source if keyboard else None
+        self.keys = keys
+        self.mouse = mouse
+        self.clock = clock
+        self.key_handlers = {} #key (None = any key) -> [handler]
+        self.mouse_handlers = {'press':[],'release':[],'move':[]}
+        self.sample_handlers = []
+        self.regions = [] #(HitTester, handler, button)
+        self.pending = collections.deque() #read but not yet dispatched
+        self.events = collections.deque(maxlen=history)
+        self.latencies = collections.deque(maxlen=10000) #dispatch time - event time, s
+        self.buttons = (False,False,False)
+        self.pos = None
+        self.reads = 0
+        self.dispatched = 0
+        self._win = None
+        self._waiting = False
+
+    def on_key(self, keys, handler):
+        """handler(event) for each press of keys (a key, a list of them, or None for any key)"""
+        for key in ([keys] if keys is None or isinstance(keys, str) else keys):
+            self.key_handlers.setdefault(key, []).append(handler)
+        return handler
+
+    def on_press(self, handler):
+        self.mouse_handlers['press'].append(handler)
+        return handler
+
+    def on_release(self, handler):
+        self.mouse_handlers['release'].append(handler)
+        return handler
+
+    def on_move(self, handler):
+        self.mouse_handlers['move'].append(handler)
+        return handler
+
+    def on_sample(self, handler):
+        """handler(time, pos, buttons) after every read of the mouse, moved or not (e.g. a MouseTracker's record)"""
+        self.sample_handlers.append(handler)
+        return handler
+
+    def on_click(self, region, handler, button=0):
+        """handler(event, index) when `button` goes down inside one of region's shapes (a HitTester from
+        mouse_tracking.py; index is the top-most one hit). Call region.update() after moving its stimuli."""
+        self.regions.append((region, handler, button))
+        return handler
+
+    def remove(self, handler):
+        """Unsubscribe handler from everything"""
+        for handlers in list(self.key_handlers.values())+list(self.mouse_handlers.values())+[self.sample_handlers]:
+            while handler in handlers:
+                handlers.remove(handler)
+        self.regions = [region for region in self.regions if region[1] != handler]
+
+    def _sample_mouse(self, now):
+        """Queue the changes since the last sample as events"""
+        buttons = tuple(bool(button) for button in self.mouse.getPressed())
+        pos = tuple(float(value) for value in self.mouse.getPos())
+        for handler in self.sample_handlers:
+            handler(now, pos, buttons)
+        if self.pos is not None and pos != self.pos:
+            self.pending.append(InputEvent('move', None, pos, now))
+        for button,(was_down,down) in enumerate(zip(self.buttons, buttons)):
+            if down != was_down:
+                self.pending.append(InputEvent('press' if down else 'release', button, pos, now))
+        self.buttons,self.pos = buttons,pos
+
+    def read(self, now=None):
+        """Read the devices once and queue what happened (for dispatch()); the mouse is stamped with `now` (default:
+        the clock's time). Returns the number of new events."""
+        if self.key_source is not None:
+            self.pending.extend(InputEvent('key', key, None, key_time) for key,key_time in self.key_source.poll(self.keys))
+        if self.mouse is not None:
+            self._sample_mouse(self.clock() if now is None else now)
+        self.reads += 1
+        return len(self.pending)
+
+    def dispatch(self):
+        """Hand every queued event to its handlers, oldest first; returns how many there were"""
+        events = list(self.pending)
+        self.pending.clear()
+        events.sort(key=lambda event: event.time)
+        for event in events:
+            self.events.append(event)
+            self.latencies.append(self.clock()-event.time)
+            if event.kind == 'key':
+                for handler in self.key_handlers.get(event.name, [])+self.key_handlers.get(None, []):
+                    handler(event)
+                continue
+            if event.kind == 'press':
+                for region,handler,button in self.regions:
+                    if button == event.name:
+                        index = region.hit(event.pos)
+                        if index is not None:
+                            handler(event, index)
+            for handler in self.mouse_handlers[event.kind]:
+                handler(event)
+        self.dispatched += len(events)
+        return len(events)
+
+    def update(self):
+        """read() then dispatch() (install() does this after every flip)"""
+        self.read()
+        return self.dispatch()
+
+    def install(self, win):
+        """Read and dispatch right after each of win's flips, so handlers see input as of the frame just shown"""
+        self._win = win
+        flip_hooks(win).add(self.flipped)
+        return self
+
+    def uninstall(self):
+        if self._win is not None:
+            flip_hooks(self._win).remove(self.flipped)
+            self._win = None
+
+    def flipped(self, flip_time):
+        self.read(flip_time)
+        self.dispatch()
+
+    def wait(self, duration, poll_interval=0.002):
+        """Keep reading and dispatching for duration seconds, sleeping between reads instead of spinning (for
+        stretches with nothing to draw). Returns early if a handler calls stop_waiting()."""
+        end = time.perf_counter()+duration
+        self._waiting = True
+        while self._waiting:
+            self.update()
+            left = end-time.perf_counter()
+            if left <= 0:
+                break
+            time.sleep(min(poll_interval, left))
+        self._waiting = False
+
+    def stop_waiting(self):
+        self._waiting = False
+
+    def summary(self):
+        latencies = np.asarray(self.latencies)*1000
+        summary = {'reads':self.reads,'events':self.dispatched}
+        if len(latencies):
+            summary.update({'latency_mean_ms':round(float(latencies.mean()),3),
+                'latency_p99_ms':round(float(np.percentile(latencies, 99)),3),'latency_max_ms':round(float(latencies.max()),3)})
+        return summary
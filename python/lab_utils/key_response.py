@@ -0,0 +1,95 @@
+import warnings
+
+#Keyboard responses for every task: a key source reads the keys, collect_keys waits for them.
+#
+#    source = default_key_source()                      #psychtoolbox keyboard if there is one, psychopy.event if not
+#    responses = collect_keys(source, ['z','m'])       #[[key, rt in s]]
+#
+#Key sources all look the same to collect_keys: clear() drops pending keys, poll(keyList) returns [[key, time]]
+#for new presses, now() is the clock those times are on, sleep() waits between polls and poll_interval is how long.
+#hardware_timestamps says whether a key's time is when it was pressed (psychtoolbox) or when it was polled
+#(psychopy.event): only the first can sleep between polls and still give sub-millisecond RTs.
+
+class EventKeySource(object):
+    """psychopy.event keys. These are timestamped when the window's event queue is pumped, so collect_keys polls
+    them continuously while a press can come in (precision = how often they are polled)."""
+    poll_interval = 0.0005
+    hardware_timestamps = False
+    def __init__(self):
+        from psychopy import event, core
+        self.event = event
+        self.now = core.getTime
+        self.sleep = lambda secs: core.wait(secs, hogCPUperiod=0)
+
+    def clear(self):
+        self.event.clearEvents()
+
+    def poll(self, keyList):
+        return [[key,keyTime] for key,keyTime in self.event.getKeys(keyList=keyList, timeStamped=True)]
+
+class PTBKeySource(object):
+    """psychopy.hardware.keyboard on the psychtoolbox backend: keys are timestamped by the OS/driver,
+    so polling slowly costs no precision."""
+    poll_interval = 0.005
+    hardware_timestamps = True
+    def __init__(self):
+        from psychopy.hardware import keyboard
+        from psychopy import core
+        self.keyboard = keyboard.Keyboard()
+        self.now = core.getTime
+        self.sleep = lambda secs: core.wait(secs, hogCPUperiod=0)
+
+    def clear(self):
+        self.keyboard.clearEvents()
+
+    def poll(self, keyList):
+        return [[key.name,key.tDown] for key in self.keyboard.getKeys(keyList=keyList, waitRelease=False)]
+
+_default_source = None
+
+def default_key_source():
+    """Hardware-timestamped keyboard if psychtoolbox is available, psychopy.event otherwise (created once)"""
+    global _default_source
+    if _default_source is None:
+        try:
+            from psychopy.hardware import keyboard
+            _default_source = PTBKeySource() if keyboard.havePTB else None
+        except ImportError:
+            pass
+        if _default_source is None:
+            warnings.warn('psychtoolbox is not available: keys come from psychopy.event, which only timestamps them '
+                'when they are polled, so responses are collected by spin-polling (one core busy while waiting)')
+            _default_source = EventKeySource()
+    return _default_source
+
+def collect_keys(source, keyList, duration=0, max_keys=1, poll_interval=None, spin_margin=0.002):
+    """Collect up to max_keys presses as [[key, rt]] (rt in s from the call).
+    With duration>0 this always waits the full duration; otherwise it returns as soon as max_keys keys are in.
+    Hardware-timestamped sources are polled every poll_interval, sleeping in between. Sources stamped when polled
+    are spin-polled until max_keys are in, like the old loop, since any sleep (even sleep(0)) can be added to the
+    rt; that costs a core while waiting. Once no more keys are wanted, the rest of the duration is slept until spin_margin before its end and then spun out, so
+    the window doesn't overrun by a sleep's oversleep."""
+    if poll_interval is None:
+        poll_interval = source.poll_interval
+    spin = not getattr(source, 'hardware_timestamps', False)
+    source.clear()
+    start = source.now()
+    responses = []
+    while True:
+        for key,keyTime in source.poll(keyList):
+            if len(responses) < max_keys:
+                responses.append([key,keyTime-start])
+        elapsed = source.now()-start
+        done = len(responses) >= max_keys
+        if duration > 0:
+            if elapsed > duration:
+                break
+            left = duration-elapsed-spin_margin
+            wait = left if done else (0 if spin else min(poll_interval, left))
+        else:
+            if done:
+                break
+            wait = 0 if spin else poll_interval
+        if wait > 0:
+            source.sleep(wait)
+    return responses
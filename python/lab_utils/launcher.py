@@ -0,0 +1,213 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import importlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+## Faster experiment launch: start the heavy file reading and decoding on background threads before showing the
+## runtime-vars dialog, and collect them after it closes, so they happen while the participant/RA is typing.
+##
+##    preload = Preloader()
+##    preload.imports('numpy', 'PIL.Image')
+##    preload.submit('image_cache', open_cache, cache_dir, image_dir)
+##    preload.submit('sounds', decode_sounds, sound_paths, store=store)
+##    with preload.step('dialog'):
+##        runtime_vars = get_runtime_vars({'subj_code':'mr_101','seed':10}, ['subj_code','seed'])
+##    images = preload.result('image_cache')
+##    print(preload.report())
+##
+## Anything that touches the window, the GL context or the audio device stays on the main thread: that includes
+## importing psychopy.visual, event, sound, gui and hardware (they set up pyglet and the audio backend as they load)
+## and making stimuli, Sounds or FeedbackSounds, so imports() refuses those modules. The import profile of a script's
+## modules (from python -X importtime) can be printed, saved, and compared against a saved baseline:
+##
+##    python -m lab_utils.launcher mental_rotation/mental_rotation_complete.py --save launch_baseline.json
+##    python -m lab_utils.launcher mental_rotation/mental_rotation_complete.py --baseline launch_baseline.json
+
+_loaded = time.perf_counter() #about when the launch started
+#modules that set up the window system or the audio backend when imported, which must happen on the main thread
+main_thread_modules = ('psychopy.visual','psychopy.event','psychopy.sound','psychopy.gui','psychopy.hardware','pyglet')
+
+class Preloader(object):
+    """Background jobs for the launch, each timed; report() gives the launch timeline"""
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = OrderedDict()
+        self.timings = OrderedDict() #name -> {'where','start','end','waited'} (s since launch)
+        self.lock = threading.Lock()
+
+    def _now(self):
+        return time.perf_counter()-_loaded
+
+    def _timed(self, name, function, args, kwargs):
+        start = self._now()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.timings[name] = {'where':'background','start':start,'end':self._now(),'waited':0.0}
+
+    def submit(self, name, function, *args, **kwargs):
+        """Start function(*args, **kwargs) on a worker thread; result(name) returns its value"""
+        self.jobs[name] = self.executor.submit(self._timed, name, function, args, kwargs)
+        return self.jobs[name]
+
+    def imports(self, *modules):
+        """Import each module on a worker thread (a later import of it on the main thread just waits for it)"""
+        for module in modules:
+            if any(module == name or module.startswith(name+'.') for name in main_thread_modules):
+                raise ValueError('%s sets up the window system or audio when it is imported; import it on the main thread' % module)
+            self.submit('import '+module, importlib.import_module, module)
+
+    def result(self, name):
+        """Wait for job `name` and return its result (re-raising its exception); the wait is timed"""
+        start = self._now()
+        value = self.jobs[name].result()
+        self.timings[name]['waited'] = self._now()-start
+        return value
+
+    def wait(self):
+        """Wait for every job"""
+        for name in self.jobs:
+            self.result(name)
+
+    def step(self, name):
+        """Context manager timing a main-thread step of the launch"""
+        return _Step(self, name)
+
+    def report(self):
+        lines = ['launch profile (s since launch)']
+        for name,timing in sorted(self.timings.items(), key=lambda item: item[1]['start']):
+            line = '    %-36s %-10s %7.3f -> %7.3f  (%6.1f ms)' % (name[:36], timing['where'], timing['start'],
+                timing['end'], (timing['end']-timing['start'])*1000)
+            if timing['waited'] > 0.0005:
+                line += '  main thread waited %.1f ms' % (timing['waited']*1000)
+            lines.append(line)
+        lines.append('    total %.3f s' % self._now())
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as out_file:
+            json.dump({'total':self._now(), 'timings':self.timings}, out_file, indent=1)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+class _Step(object):
+    def __init__(self, preloader, name):
+        self.preloader = preloader
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.preloader._now()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.preloader.timings[self.name] = {'where':'main','start':self.start,'end':self.preloader._now(),'waited':0.0}
+        return False
+
+#---- runtime variables
+
+def get_runtime_vars(vars_to_get,order,exp_version="experiment_code_for_reference"):
+    #Get run time variables, see http://www.psychopy.org/api/gui.html for explanation
+    #a station started by orchestrator.py gets them as json in LAB_RUNTIME_VARS instead of from the dialog
+    if os.environ.get('LAB_RUNTIME_VARS'):
+        vars_to_get.update(json.loads(os.environ['LAB_RUNTIME_VARS']))
+        return vars_to_get
+    from psychopy import gui
+    infoDlg = gui.DlgFromDict(dictionary=vars_to_get, title=exp_version, order=order)
+    if infoDlg.OK:
+        return vars_to_get
+    else: 
+        print('User Cancelled')
+
+#---- import profile
+
+_importtime_line = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+def script_imports(script):
+    """Top-level modules a script imports (from its import statements)"""
+    modules = []
+    with open(script) as script_file:
+        for line in script_file:
+            match = re.match(r'\s*(?:from\s+(\S+)\s+import\s+(.+)|import\s+(.+))', line)
+            if not match:
+                continue
+            if match.group(1):
+                names = [match.group(1)]
+                #"from psychopy import visual, sound" imports the submodules too
+                if match.group(1) == 'psychopy':
+                    names = ['psychopy.'+name.strip() for name in match.group(2).split('#')[0].split(',')]
+            else:
+                names = [name.strip().split(' ')[0] for name in match.group(3).split('#')[0].split(',')]
+            for name in names:
+                if name and name not in modules:
+                    modules.append(name)
+    return modules
+
+def import_profile(modules, path=(), python=None):
+    """Run `python -X importtime` on modules in a fresh interpreter (with `path` on sys.path) and return
+    {'modules': {module: {'self_us','cumulative_us','depth'}}, 'total_us', 'failed': [modules that did not import]}"""
+    import subprocess #only needed for profiling, not at launch
+    python = python or sys.executable
+    code = 'import sys\nsys.path[:0] = %r\nfailed = []\n' % list(path)
+    for module in modules:
+        code += 'try:\n    import %s\nexcept Exception:\n    failed.append(%r)\n' % (module, module)
+    code += 'sys.stdout.write(",".join(failed))\n'
+    process = subprocess.run([python, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    profile = OrderedDict()
+    total = 0
+    for line in process.stderr.splitlines():
+        match = _importtime_line.match(line)
+        if not match:
+            continue
+        self_us,cumulative_us,indent,name = int(match.group(1)),int(match.group(2)),match.group(3),match.group(4)
+        depth = (len(indent)-1)//2
+        profile[name] = {'self_us':self_us,'cumulative_us':cumulative_us,'depth':depth}
+        if depth == 0:
+            total += cumulative_us
+    failed = [name for name in process.stdout.strip().split(',') if name]
+    return {'modules':profile,'total_us':total,'failed':failed}
+
+def format_profile(profile, top=20, baseline=None):
+    modules = profile['modules']
+    lines = ['import time %.1f ms (%d modules)' % (profile['total_us']/1000., len(modules))]
+    if baseline is not None:
+        lines[0] += ', baseline %.1f ms (%+.1f ms)' % (baseline['total_us']/1000.,
+            (profile['total_us']-baseline['total_us'])/1000.)
+    if profile['failed']:
+        lines.append('not importable here: '+', '.join(profile['failed']))
+    lines.append('    %-40s %10s %10s' % ('slowest (cumulative)', 'cum ms', 'self ms'))
+    ranked = sorted(modules.items(), key=lambda item: -item[1]['cumulative_us'])[:top]
+    for name,times in ranked:
+        line = '    %-40s %10.1f %10.1f' % (name[:40], times['cumulative_us']/1000., times['self_us']/1000.)
+        if baseline is not None and name in baseline['modules']:
+            line += '  %+8.1f' % ((times['cumulative_us']-baseline['modules'][name]['cumulative_us'])/1000.)
+        lines.append(line)
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import-time profile of an experiment script's modules")
+    parser.add_argument('script')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3, help='runs to take the fastest of (the first is often cold)')
+    parser.add_argument('--save', help='write the profile as json (a baseline for later runs)')
+    parser.add_argument('--baseline', help='compare against a profile saved with --save')
+    args = parser.parse_args()
+    script_dir = os.path.dirname(os.path.abspath(args.script))
+    modules = script_imports(args.script)
+    runs = [import_profile(modules, path=[script_dir, os.path.dirname(script_dir)]) for _ in range(args.repeat)]
+    profile = min(runs, key=lambda run: run['total_us'])
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print(format_profile(profile, top=args.top, baseline=baseline))
+    if args.save:
+        with open(args.save, 'w') as out_file:
+            json.dump(profile, out_file, indent=1)
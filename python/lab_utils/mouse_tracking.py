@@ -0,0 +1,188 @@
+import queue
+import threading
+import numpy as np
+from lab_utils.flip_hooks import flip_hooks
+
+#Mouse trajectories and clicks for the mouse tasks:
+#
+#    tracker = MouseTracker(mouse).install(win)          #one sample per flip, stamped with the flip's time
+#    targets = HitTester([image_1, image_2])
+#    tracker.start_trial(trial_num)
+#    while clicked is None:
+#        ...draw...; win.flip()                          #waits for the refresh instead of spinning
+#        clicked = tracker.poll_click(targets)           #(target index, pos, time) of a press on a target
+#    trajectory = tracker.end_trial()                    #{'t','x','y','pressed'} arrays for the trial
+#    writer.write(trial_num, trajectory)                 #a TrajectoryWriter appends it to disk on its own thread
+#
+#With an InputBus already reading the mouse after every flip, take the samples from it instead of reading the mouse
+#twice: tracker = MouseTracker(); bus.on_sample(tracker.record).
+#Positions are whatever psychopy's Mouse reports; with the pyglet backend that only changes when the window handles
+#its events on flip, so sampling more often than once per flip (e.g. from a thread) would just repeat the same
+#position with made-up timestamps. A press and release that both come between two flips is not seen.
+
+class HitTester(object):
+    """Bounding shapes of N stimuli (rectangles, or ellipses for Circles) tested against any number of points at
+    once. Shapes later in the list are on top."""
+    def __init__(self, stims, kinds=None):
+        self.stims = list(stims)
+        if kinds is None:
+            kinds = ['ellipse' if type(stim).__name__ == 'Circle' else 'rect' for stim in self.stims]
+        self.ellipse = np.array([kind == 'ellipse' for kind in kinds], dtype=bool)
+        self.update()
+
+    def update(self):
+        """Re-read the stimuli's positions and sizes (after moving them)"""
+        self.centers = np.array([np.asarray(stim.pos, dtype=float) for stim in self.stims]).reshape(-1,2)
+        self.half_sizes = np.array([np.broadcast_to(np.asarray(stim.size, dtype=float), (2,)) for stim in self.stims]).reshape(-1,2)/2
+
+    def hits(self, points):
+        """Index of the top-most shape containing each point, -1 where none does"""
+        points = np.asarray(points, dtype=float).reshape(-1,2)
+        offset = np.abs(points[:,None,:]-self.centers[None,:,:])/self.half_sizes[None,:,:]
+        inside = np.where(self.ellipse[None,:], np.sum(offset**2, axis=2) <= 1, np.all(offset <= 1, axis=2))
+        #last True along each row = top-most shape
+        top = inside.shape[1]-1-np.argmax(inside[:,::-1], axis=1)
+        return np.where(inside.any(axis=1), top, -1)
+
+    def hit(self, pos):
+        """Index of the top-most shape containing pos, or None"""
+        index = int(self.hits([pos])[0])
+        return None if index < 0 else index
+
+class MouseTracker(object):
+    """Mouse position and left button, one sample per flip stamped with the flip's time, in arrays that grow as
+    needed (samples from before the current trial are dropped first, so nothing a trial needs is ever overwritten).
+    Samples come from install(win) (reads `mouse` after each flip) or from an InputBus's own per-flip read
+    (bus.on_sample(tracker.record)); sample() and record() can also be called from a frame loop."""
+    def __init__(self, mouse=None, capacity=4096, clock=None):
+        if clock is None:
+            from psychopy import core
+            clock = core.getTime
+        self.mouse = mouse
+        self.clock = clock
+        self.t = np.zeros(capacity)
+        self.xy = np.zeros((capacity,2))
+        self.pressed = np.zeros(capacity, dtype=bool)
+        self.count = 0
+        self.trial_start = 0
+        self.polled = 0 #samples already checked by poll_click
+        self.was_pressed = False
+        self._win = None
+
+    def install(self, win):
+        """Sample the mouse right after each of win's flips (when the window has just handled its events)"""
+        self._win = win
+        flip_hooks(win).add(self.sample)
+        return self
+
+    def uninstall(self):
+        if self._win is not None:
+            flip_hooks(self._win).remove(self.sample)
+            self._win = None
+
+    def sample(self, t=None):
+        """Read the mouse now (at flip time t, if given) and record it"""
+        self.record(self.clock() if t is None else t, self.mouse.getPos(), self.mouse.getPressed())
+
+    def record(self, t, pos, buttons):
+        """Add a sample: time, position and the mouse's buttons (only the left one is kept)"""
+        if self.count == len(self.t):
+            self._make_room()
+        i = self.count
+        self.t[i] = t
+        self.xy[i] = pos
+        self.pressed[i] = bool(buttons[0])
+        self.count += 1
+
+    def _make_room(self):
+        #drop the samples no trial or poll still needs; if that frees less than half, double the arrays
+        keep = min(self.trial_start, self.polled)
+        size = len(self.t)*2 if self.count-keep > len(self.t)//2 else len(self.t)
+        for name in ('t','xy','pressed'):
+            old = getattr(self, name)
+            new = np.zeros((size,)+old.shape[1:], dtype=old.dtype)
+            new[:self.count-keep] = old[keep:self.count]
+            setattr(self, name, new)
+        self.count -= keep
+        self.trial_start -= keep
+        self.polled -= keep
+
+    def start_trial(self, trial=None, since=None):
+        """Start collecting a trajectory, from the next sample or, with since, from the first sample at or after that
+        time (e.g. the press that started a drag, which has already been recorded)"""
+        start = self.count
+        if since is not None:
+            start = int(np.searchsorted(self.t[:self.count], since))
+        self.trial_start = start
+        self.polled = start
+        self.was_pressed = False
+
+    def end_trial(self):
+        """The samples since start_trial as {'t','x','y','pressed'} (copies)"""
+        xy = self.xy[self.trial_start:self.count]
+        return {'t':self.t[self.trial_start:self.count].copy(),'x':xy[:,0].copy(),'y':xy[:,1].copy(),
+            'pressed':self.pressed[self.trial_start:self.count].copy()}
+
+    def poll_click(self, targets):
+        """(target index, pos, time) for the first press that started on one of targets (a HitTester) since the last
+        poll, else None"""
+        end = self.count
+        t,xy,pressed = self.t[self.polled:end],self.xy[self.polled:end],self.pressed[self.polled:end]
+        self.polled = end
+        onsets = np.flatnonzero(pressed & ~np.r_[self.was_pressed, pressed[:-1]])
+        if len(pressed):
+            self.was_pressed = bool(pressed[-1])
+        if len(onsets):
+            hits = targets.hits(xy[onsets])
+            for onset,hit in zip(onsets,hits):
+                if hit >= 0:
+                    return int(hit), xy[onset].copy(), t[onset]
+        return None
+
+class TrajectoryWriter(object):
+    """Appends trajectories as 'trial,t,x,y,pressed' rows to a CSV from a background thread"""
+    def __init__(self, path, mode='w'):
+        self.file = open(path, mode)
+        if mode == 'w':
+            self.file.write('trial,t,x,y,pressed\n')
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='TrajectoryWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, trial, trajectory):
+        self.queue.put((trial, trajectory))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            trial,trajectory = item
+            for row in zip(trajectory['t'], trajectory['x'], trajectory['y'], trajectory['pressed']):
+                self.file.write('%s,%.4f,%.1f,%.1f,%d\n' % ((trial,)+row))
+            self.file.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+def trajectory_measures(x, y):
+    """Maximum deviation (signed, px) and area under the curve (px^2) of a trajectory from the straight line between
+    its first and last points, and its path length (px)"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) < 2:
+        return {'max_deviation':0.0,'auc':0.0,'path_length':0.0}
+    line = np.array([x[-1]-x[0], y[-1]-y[0]])
+    path_length = float(np.sum(np.hypot(np.diff(x), np.diff(y))))
+    length = np.hypot(*line)
+    if length == 0:
+        return {'max_deviation':0.0,'auc':0.0,'path_length':path_length}
+    unit = line/length
+    dx,dy = x-x[0], y-y[0]
+    along = dx*unit[0]+dy*unit[1]
+    deviation = dx*unit[1]-dy*unit[0]
+    return {'max_deviation':float(deviation[np.argmax(np.abs(deviation))]),
+        'auc':float(np.sum((deviation[1:]+deviation[:-1])/2*np.diff(along))),'path_length':path_length}
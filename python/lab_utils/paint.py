@@ -0,0 +1,169 @@
+import numpy as np
+
+#Psychopy draws a Circle as a filled polygon (its `vertices`, scaled by its size). A dab's mask is that polygon
+#sampled at pixel centers, the way OpenGL decides which pixels a polygon fills, and it is drawn without texture
+#interpolation, so each dab should cover the same pixels at the same color and opacity as the Circle it replaces.
+#That is meant for dabs a whole number of pixels wide at whole-pixel positions in 'pix' units (mouse positions in a
+#window with even width and height); anywhere else the mask is sampled smoothly. bench_paint.py compares screenshots
+#of the two on a real window; run it on the display you will use before relying on pixel equality.
+
+def circle_vertices(win, size, units='pix', edges=32):
+    """The polygon psychopy fills for a Circle of this size, in pixels around its center"""
+    from psychopy import visual
+    vertices = visual.Circle(win, size=[size,size], units=units, autoLog=False).vertices
+    if vertices is None:
+        #(a Circle without vertices, e.g. under lab_utils.headless): psychopy's own formula, radius .5
+        angles = np.arange(edges)*2*np.pi/edges
+        vertices = np.column_stack([np.sin(angles),np.cos(angles)])*.5
+    return np.asarray(vertices, dtype=float)*size
+
+def polygon_mask(vertices, width):
+    """psychopy mask (1 inside, -1 outside) of the pixels of a width x width square whose centers are inside the
+    convex polygon `vertices` (pixels, around the square's center)"""
+    centers = np.arange(width)+.5-width/2.
+    x,y = np.meshgrid(centers, centers)
+    start = vertices
+    edge = np.roll(vertices, -1, axis=0)-vertices
+    #which side of every edge each pixel center is on; inside a convex polygon it is the same side for all of them
+    side = edge[:,0,None,None]*(y-start[:,1,None,None])-edge[:,1,None,None]*(x-start[:,0,None,None])
+    inside = (side >= 0).all(axis=0) | (side <= 0).all(axis=0)
+    return np.where(inside, 1.0, -1.0)
+
+_PaintStim = None
+
+def _paint_stim_class():
+    """ElementArrayStim whose draw() first brings its PaintLayer's new dabs in, so an autoDrawn layer catches up in
+    the window's flip (made on first use, so importing this module doesn't import psychopy)"""
+    global _PaintStim
+    if _PaintStim is None:
+        from psychopy import visual
+        class PaintStim(visual.ElementArrayStim):
+            def __init__(self, layer, **kwargs):
+                self.layer = layer
+                visual.ElementArrayStim.__init__(self, layer.win, **kwargs)
+
+            def draw(self, win=None):
+                self.layer._sync()
+                visual.ElementArrayStim.draw(self, win)
+        _PaintStim = PaintStim
+    return _PaintStim
+
+class PaintLayer(object):
+    """Paint dabs (filled circles of one size, color and opacity) kept in a growable numpy array and drawn in a
+    single batch by one ElementArrayStim, so there is one draw call per frame with 10 dabs or 10000.
+    Dabs are drawn in the order they were added, like one Circle per dab would be. Adding a dab only writes its
+    position; the stim catches up once per frame, when it is drawn (by draw() or, autoDrawn, by the window's flip).
+    The stim has an element for every slot of the array (slots without a dab are transparent), so catching up only
+    writes the new dabs into it; its per-element arrays are resized only when the array doubles.
+
+        paint = PaintLayer(win, size=10, color='red', opacity=0.5, autoDraw=True)
+        paint.add(mouse.getPos())
+        win.flip()
+    """
+    def __init__(self, win, size=10, color='red', opacity=0.5, units='pix', capacity=1024, autoDraw=False):
+        self.win = win
+        self.size = size
+        self.color = color
+        self.opacity = opacity
+        self.units = units
+        self.xys = np.zeros((capacity,2))
+        self.count = 0
+        self.stim = None #made with the first dab
+        self.syncs = 0 #times the stim was brought up to date
+        self.resizes = 0 #times the stim's arrays were reallocated
+        self._autoDraw = autoDraw
+        self._synced = 0 #dabs the stim knows about
+
+    def __len__(self):
+        return self.count
+
+    def add(self, pos):
+        """Add one dab at pos"""
+        self.extend([pos])
+
+    def extend(self, points):
+        """Add dabs at each of points (an Nx2 array or list of positions)"""
+        points = np.asarray(points, dtype=float).reshape(-1,2)
+        needed = self.count+len(points)
+        if needed > len(self.xys):
+            #grow by doubling so adding n dabs copies O(n) points in total
+            grown = np.zeros((max(needed,2*len(self.xys)),2))
+            grown[:self.count] = self.xys[:self.count]
+            self.xys = grown
+        self.xys[self.count:needed] = points
+        self.count = needed
+        #the window only draws an autoDrawn stim once it exists
+        if self._autoDraw and self.stim is None:
+            self._sync()
+
+    def _mask(self):
+        if self.units == 'pix' and float(self.size) == int(self.size):
+            return polygon_mask(circle_vertices(self.win, self.size, self.units), int(self.size)), False
+        return 'circle', True
+
+    def _opacities(self):
+        opacities = np.zeros(len(self.xys))
+        opacities[:self.count] = self.opacity
+        return opacities
+
+    def _sync(self):
+        if self._synced == self.count or not self.count:
+            return
+        stim = self.stim
+        if stim is None:
+            mask,interpolate = self._mask()
+            self.stim = _paint_stim_class()(self, units=self.units, nElements=len(self.xys), xys=self.xys,
+                sizes=self.size, elementTex=None, elementMask=mask, interpolate=interpolate, colors=self.color,
+                opacities=self._opacities(), texRes=128, autoLog=False)
+            self.stim.autoDraw = self._autoDraw
+        elif stim.nElements != len(self.xys):
+            #the array has doubled: every per-element array has to match nElements
+            stim.nElements = len(self.xys)
+            stim.xys = self.xys
+            stim.sizes = self.size
+            stim.oris = 0
+            stim.sfs = 1
+            stim.phases = 0
+            stim.contrs = 1
+            stim.opacities = self._opacities()
+            stim.colors = self.color
+            self.resizes += 1
+        else:
+            #write just the dabs added since the last sync into the stim's own arrays
+            new = slice(self._synced, self.count)
+            stim.xys[new] = self.xys[new]
+            stim.opacities[new] = self.opacity
+            stim._needVertexUpdate = True
+            stim._needColorUpdate = True
+        self._synced = self.count
+        self.syncs += 1
+
+    def draw(self):
+        if not self.count:
+            return
+        self._sync()
+        self.stim.draw()
+
+    @property
+    def autoDraw(self):
+        return self._autoDraw
+
+    @autoDraw.setter
+    def autoDraw(self, value):
+        self._autoDraw = bool(value)
+        if value:
+            self._sync()
+        if self.stim is not None:
+            self.stim.autoDraw = self._autoDraw
+
+    def setAutoDraw(self, value, log=None):
+        self.autoDraw = value
+
+    def clear(self):
+        """Remove all dabs"""
+        self.count = 0
+        self._synced = 0
+        if self.stim is not None:
+            #keep the stim (and its place among the autoDrawn stims), with every element transparent
+            self.stim.opacities[:] = 0
+            self.stim._needColorUpdate = True
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import atexit
+import socket
+import sqlite3
+import threading
+import collections
+import socketserver
+
+## Central results store for many stations: each station's ResultsClient streams its completed trials (one JSON
+## line each) to an aggregator, which keeps them in a SQLite file in WAL mode, one row per (subj_code, trial_num).
+## A station that crashed or lost the connection asks the aggregator for the last trial it has and resumes after it;
+## records are resent until acknowledged and duplicates are ignored, so nothing is lost or stored twice.
+##
+##   python -m lab_utils.results serve --db results.db --port 5555
+##   LAB_RESULTS=host:5555 LAB_STATION=station_1 python mental_rotation_complete.py
+
+def _plain(value):
+    """json.dumps default: numpy scalars (e.g. values from a TrialTable) as plain python values"""
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+class ResultsStore(object):
+    """The aggregator's SQLite file (WAL, so it can be read - e.g. exported - while stations are writing)"""
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS trials (subj_code TEXT NOT NULL, trial_num INTEGER NOT NULL, '
+            'station TEXT, received REAL, record TEXT, PRIMARY KEY (subj_code, trial_num))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sessions (subj_code TEXT, station TEXT, event TEXT, '
+            'time REAL, first_trial INTEGER)')
+        self.connection.commit()
+        self.lock = threading.Lock()
+
+    def add_trial(self, subj_code, trial_num, station, record):
+        """Store a trial; returns False if it was already there (a resend)"""
+        with self.lock:
+            cursor = self.connection.execute('INSERT OR IGNORE INTO trials VALUES (?,?,?,?,?)',
+                (subj_code, trial_num, station, time.time(), json.dumps(record)))
+            self.connection.commit()
+            return cursor.rowcount == 1
+
+    def add_event(self, subj_code, station, event, first_trial=None):
+        with self.lock:
+            self.connection.execute('INSERT INTO sessions VALUES (?,?,?,?,?)', (subj_code, station, event, time.time(), first_trial))
+            self.connection.commit()
+
+    def last_trial(self, subj_code):
+        """Highest trial_num stored for subj_code such that every trial before it is stored too (-1 if none)"""
+        with self.lock:
+            rows = self.connection.execute('SELECT trial_num FROM trials WHERE subj_code=? ORDER BY trial_num',
+                (subj_code,)).fetchall()
+        last = -1
+        for (trial_num,) in rows:
+            if trial_num != last+1:
+                break
+            last = trial_num
+        return last
+
+    def trials(self, subj_code=None):
+        """[(subj_code, trial_num, station, record dict)] ordered by subject and trial"""
+        with self.lock:
+            if subj_code is None:
+                rows = self.connection.execute('SELECT subj_code, trial_num, station, record FROM trials ORDER BY subj_code, trial_num').fetchall()
+            else:
+                rows = self.connection.execute('SELECT subj_code, trial_num, station, record FROM trials WHERE subj_code=? '
+                    'ORDER BY trial_num', (subj_code,)).fetchall()
+        return [(row[0], row[1], row[2], json.loads(row[3])) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                op = message['op']
+                if op == 'trial':
+                    store.add_trial(message['subj_code'], message['trial_num'], message.get('station'), message['record'])
+                    reply = {'ack':message['seq']}
+                elif op == 'last_trial':
+                    reply = {'last_trial':store.last_trial(message['subj_code'])}
+                elif op == 'event':
+                    store.add_event(message['subj_code'], message.get('station'), message['event'], message.get('first_trial'))
+                    reply = {'ack':message['seq']}
+                else:
+                    reply = {'error':'unknown op %r' % op}
+            except (ValueError, KeyError) as error:
+                reply = {'error':str(error)}
+            self.wfile.write((json.dumps(reply)+'\n').encode('utf-8'))
+            self.wfile.flush()
+
+class Aggregator(socketserver.ThreadingTCPServer):
+    """TCP server (a thread per station connection) writing into a ResultsStore"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, db_path, host='127.0.0.1', port=0):
+        self.store = ResultsStore(db_path)
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _Handler)
+
+    @property
+    def address(self):
+        return '%s:%d' % self.server_address[:2]
+
+    def server_close(self):
+        socketserver.ThreadingTCPServer.server_close(self)
+        self.store.close()
+
+class ResultsClient(object):
+    """A station's connection to the aggregator. send() only queues the record; a background thread delivers
+    records in order, waits for each acknowledgement, and reconnects (resending what was not acknowledged) when
+    the connection drops. Records are kept in memory until they are delivered."""
+    def __init__(self, address, station=None, subj_code=None, timeout=2.0, retry_interval=0.5):
+        host,port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.station = station or socket.gethostname()
+        self.subj_code = subj_code
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.sent = 0
+        self.reconnects = 0
+        self.closed = False
+        self.socket = None
+        self.reader = None
+        self.thread = threading.Thread(target=self._run, name='ResultsClient')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls, subj_code=None):
+        """A client for LAB_RESULTS (host:port) as LAB_STATION, or None if LAB_RESULTS is not set"""
+        address = os.environ.get('LAB_RESULTS')
+        if not address:
+            return None
+        return cls(address, station=os.environ.get('LAB_STATION'), subj_code=subj_code)
+
+    def _connect(self):
+        self.socket = socket.create_connection(self.address, timeout=self.timeout)
+        self.reader = self.socket.makefile('rb')
+
+    def _disconnect(self):
+        if self.socket is not None:
+            try:
+                self.reader.close()
+                self.socket.close()
+            except OSError:
+                pass
+        self.socket = None
+        self.reader = None
+
+    def _request(self, message):
+        """Send one message and return the reply (connecting first if needed)"""
+        if self.socket is None:
+            self._connect()
+        self.socket.sendall((json.dumps(message, default=_plain)+'\n').encode('utf-8'))
+        line = self.reader.readline()
+        if not line:
+            raise OSError('aggregator closed the connection')
+        return json.loads(line)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                message = self.pending[0]
+            try:
+                reply = self._request(message)
+            except (OSError, ValueError):
+                self._disconnect()
+                self.reconnects += 1
+                with self.condition:
+                    if self.closed and self.close_deadline < time.time():
+                        return
+                    self.condition.wait(self.retry_interval)
+                continue
+            with self.condition:
+                if reply.get('ack') == message['seq']:
+                    self.pending.popleft()
+                    self.sent += 1
+                elif 'error' in reply:
+                    #resending a message the aggregator can't take won't help
+                    print('aggregator rejected %s: %s' % (message['op'], reply['error']))
+                    self.pending.popleft()
+                self.condition.notify_all()
+
+    def _queue(self, message):
+        with self.condition:
+            self.seq += 1
+            message['seq'] = self.seq
+            message['station'] = self.station
+            self.pending.append(message)
+            self.condition.notify_all()
+
+    def send(self, trial_num, record, subj_code=None):
+        """Queue one completed trial (record: a dict of json-serialisable values)"""
+        self._queue({'op':'trial','subj_code':subj_code or self.subj_code,'trial_num':int(trial_num),'record':record})
+
+    def event(self, event, first_trial=None, subj_code=None):
+        """Log a session event (e.g. 'start', 'resume', 'end') with the aggregator"""
+        self._queue({'op':'event','subj_code':subj_code or self.subj_code,'event':event,'first_trial':first_trial})
+
+    def last_trial(self, subj_code=None):
+        """Last trial the aggregator has for subj_code (-1 if none), or None if it can't be reached"""
+        try:
+            connection = socket.create_connection(self.address, timeout=self.timeout)
+        except OSError:
+            return None
+        try:
+            connection.sendall((json.dumps({'op':'last_trial','subj_code':subj_code or self.subj_code})+'\n').encode('utf-8'))
+            reply = json.loads(connection.makefile('rb').readline())
+            return reply['last_trial']
+        except (OSError, ValueError, KeyError):
+            return None
+        finally:
+            connection.close()
+
+    def close(self, timeout=5.0):
+        """Wait up to timeout s for queued records to be delivered, then stop; returns how many were not"""
+        with self.condition:
+            if self.closed:
+                return len(self.pending)
+            self.closed = True
+            self.close_deadline = time.time()+timeout
+            self.condition.notify_all()
+        self.thread.join(timeout+self.timeout)
+        self._disconnect()
+        return len(self.pending)
+
+def serve(db_path, host='127.0.0.1', port=0):
+    """Run an aggregator until interrupted; prints 'listening on host:port' first"""
+    server = Aggregator(db_path, host, port)
+    print('listening on %s' % server.address, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Aggregate trial records from stations into a SQLite file')
+    parser.add_argument('command', choices=['serve'])
+    parser.add_argument('--db', default='results.db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    args = parser.parse_args()
+    serve(args.db, args.host, args.port)
@@ -0,0 +1,149 @@
+import numpy as np
+
+#A Scene draws a frame as one cached background image plus whatever is changing:
+#
+#    scene = Scene(win)
+#    scene.add(Layer([field]))                          #static: composed once into the background
+#    sprites = scene.add(SpriteLayer(win, image_paths, positions, size=100))
+#    scene.add(Layer([highlight], static=False))        #dynamic: drawn every frame
+#    scene.draw()
+#    win.flip()
+#
+#The static parts of all layers are drawn once, in layer order, into a BufferImageStim and that image is drawn
+#each frame instead; a layer that changes its static part calls set_dirty() and the background is composed again
+#on the next draw. Dynamic stimuli are drawn on top of the background every frame, so they always appear above
+#every static part. A SpriteLayer keeps its sprites static except the ones lifted (being dragged), so dragging
+#one of 50 sprites costs two draws per frame.
+
+class Layer(object):
+    """A list of stimuli that are either all static (part of the cached background) or all dynamic"""
+    def __init__(self, stims, static=True):
+        self.stims = list(stims)
+        self.static = static
+        self.dirty = static
+
+    def set_dirty(self):
+        """Call after changing a static layer's stimuli so the background is composed again"""
+        self.dirty = True
+
+    def static_stims(self):
+        return self.stims if self.static else []
+
+    def dynamic_stims(self):
+        return [] if self.static else self.stims
+
+class SpriteLayer(object):
+    """Many same-sized image sprites with hit testing through a uniform grid (cells one sprite wide), so finding
+    the sprite under the mouse only checks the sprites near it. Lifted sprites are dynamic and drawn above the
+    background; the rest are part of it."""
+    def __init__(self, win, images, positions, size, units='pix'):
+        from psychopy import visual
+        self.win = win
+        self.size = np.asarray(np.broadcast_to(np.asarray(size, dtype=float), (2,)))
+        self.positions = np.asarray(positions, dtype=float).reshape(-1,2).copy()
+        self.stims = [visual.ImageStim(win, image=image, size=self.size, pos=pos, units=units)
+            for image,pos in zip(images, self.positions)]
+        self.order = list(range(len(self.stims))) #drawing order, last on top
+        self.lifted = []
+        self.dirty = True
+        self.cell = float(max(self.size))
+        self.grid = {}
+        for index,pos in enumerate(self.positions):
+            self.grid.setdefault(self._cell(pos), []).append(index)
+
+    def __len__(self):
+        return len(self.stims)
+
+    def _cell(self, pos):
+        return (int(np.floor(pos[0]/self.cell)), int(np.floor(pos[1]/self.cell)))
+
+    def set_dirty(self):
+        self.dirty = True
+
+    def sprite_at(self, pos):
+        """Index of the top-most sprite containing pos, or None"""
+        cx,cy = self._cell(pos)
+        candidates = []
+        #a sprite one cell wide can only overlap pos from its own cell or a neighbouring one
+        for dx in (-1,0,1):
+            for dy in (-1,0,1):
+                candidates.extend(self.grid.get((cx+dx,cy+dy), ()))
+        if not candidates:
+            return None
+        candidates = np.array(candidates)
+        offset = np.abs(self.positions[candidates]-np.asarray(pos, dtype=float))
+        hits = candidates[np.all(offset <= self.size/2, axis=1)]
+        if not len(hits):
+            return None
+        hits = set(hits.tolist())
+        for index in reversed(self.order):
+            if index in hits:
+                return index
+
+    def move(self, index, pos):
+        """Move sprite `index` to pos (if it is not lifted this recomposes the background)"""
+        old_cell = self._cell(self.positions[index])
+        self.positions[index] = pos
+        self.stims[index].pos = self.positions[index]
+        new_cell = self._cell(self.positions[index])
+        if new_cell != old_cell:
+            self.grid[old_cell].remove(index)
+            self.grid.setdefault(new_cell, []).append(index)
+        if index not in self.lifted:
+            self.dirty = True
+
+    def lift(self, index):
+        """Make sprite `index` dynamic and put it on top (e.g. when a drag starts)"""
+        if index in self.lifted:
+            return
+        self.order.remove(index)
+        self.order.append(index)
+        self.lifted.append(index)
+        self.dirty = True
+
+    def drop(self, index=None):
+        """Return a lifted sprite (all of them if index is None) to the background"""
+        dropped = list(self.lifted) if index is None else [index]
+        for cur_index in dropped:
+            self.lifted.remove(cur_index)
+        if dropped:
+            self.dirty = True
+
+    def static_stims(self):
+        return [self.stims[index] for index in self.order if index not in self.lifted]
+
+    def dynamic_stims(self):
+        return [self.stims[index] for index in self.lifted]
+
+class Scene(object):
+    """Layers drawn back to front with their static parts cached in one BufferImageStim"""
+    def __init__(self, win):
+        self.win = win
+        self.layers = []
+        self.background = None
+        self.composed = False
+        self.compositions = 0
+
+    def add(self, layer):
+        self.layers.append(layer)
+        return layer
+
+    def compose(self):
+        """Draw every static stimulus into the back buffer and keep it as the background image (clears the buffer,
+        so this has to happen before anything else is drawn in the frame)"""
+        from psychopy import visual
+        static = [stim for layer in self.layers for stim in layer.static_stims()]
+        self.background = visual.BufferImageStim(self.win, stim=static) if static else None
+        for layer in self.layers:
+            layer.dirty = False
+        self.composed = True
+        self.compositions += 1
+
+    def draw(self):
+        if not self.composed or any(layer.dirty for layer in self.layers):
+            self.compose()
+        if self.background is not None:
+            self.background.draw()
+        for layer in self.layers:
+            for stim in layer.dynamic_stims():
+                stim.draw()
@@ -0,0 +1,349 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+#Shared stimulus store: every image and sound under the activities' <task>/stimuli folders, indexed by content
+#(sha256) in one manifest and looked up by logical name instead of a path relative to wherever the script started:
+#
+#    store = StimulusStore()
+#    store.path('images/bulbasaur')      #a file with that content (whichever task folder holds a copy)
+#    store.image('images/bulbasaur')     #PIL image from the decoded-pixel cache
+#    store.pcm('sounds/bleep')           #(float32 frames x channels, sample rate) from the decoded-PCM cache
+#
+#A logical name is the file's path under its stimuli folder without the extension. Identical files in several tasks
+#are one entry (one hash, several copies); a name that means different content in different tasks is prefixed with
+#the task ('drag_images/images/x'). Decoded data is kept in <store>/decoded/ by content hash, so a battery of tasks run
+#one after another on a station decodes each distinct file once; after that it is only np.load'ed (memory-mapped).
+#A file is checked against the manifest before it is used (size and mtime, then its hash if those changed), so a
+#stimulus edited without indexing again raises an error instead of its old pixels or sound being served.
+#
+#    python -m lab_utils.stimuli index        #(re)build the manifest; only new or changed files are hashed
+#    python -m lab_utils.stimuli dedupe       #report identical copies; --link keeps one copy on disk (hard links)
+#    python -m lab_utils.stimuli decode       #fill the decoded cache ahead of a session
+
+manifest_version = 1
+manifest_name = 'manifest.json'
+stat_name = 'stat.json' #size/mtime/hash of every file last indexed, local to each checkout
+image_extensions = ('.png','.jpg','.jpeg','.bmp','.gif','.tif','.tiff')
+sound_extensions = ('.wav',)
+python_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def default_root():
+    """The store folder: $LAB_STIMULI, or python/stimulus_store"""
+    return os.environ.get('LAB_STIMULI') or os.path.join(python_dir,'stimulus_store')
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return None
+
+def _write_json(path, data, indent=None):
+    #write to a temporary file and swap it in, so a reader never sees half a file
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file, indent=indent, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def find_stimuli(stimuli_dirs):
+    """(task, logical name, path) of every image and sound file under the given stimuli folders (the task is the name
+    of the folder holding each one)"""
+    for stimuli_dir in stimuli_dirs:
+        task = os.path.basename(os.path.dirname(os.path.abspath(stimuli_dir)))
+        for dirpath,dirnames,filenames in os.walk(stimuli_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() not in image_extensions+sound_extensions:
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.splitext(os.path.relpath(path, stimuli_dir))[0].replace(os.sep,'/')
+                yield task, name, path
+
+def describe(path):
+    """What the header says about a stimulus file, without decoding it: kind, and size/mode or rate/channels/frames"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in sound_extensions:
+        import wave
+        with wave.open(path, 'rb') as wav_file:
+            return {'kind':'sound','rate':wav_file.getframerate(),'channels':wav_file.getnchannels(),
+                'frames':wav_file.getnframes()}
+    from PIL import Image
+    with Image.open(path) as im:
+        return {'kind':'image','size':list(im.size),'mode':im.mode}
+
+def _relative(path, base_dir):
+    path = os.path.abspath(path)
+    if path.startswith(base_dir+os.sep):
+        return os.path.relpath(path, base_dir).replace(os.sep,'/')
+    return path
+
+def build_index(root=None, stimuli_dirs=None, base_dir=python_dir, workers=8):
+    """Hash every stimulus file (only those whose size or mtime changed since the last index) and write the manifest:
+    {'names': {logical name: sha256}, 'content': {sha256: {'ext','bytes','copies',...describe()}}}.
+    stimuli_dirs defaults to every <task>/stimuli folder under base_dir; copies are stored relative to base_dir.
+    Returns the manifest and counts of what was found."""
+    root = root or default_root()
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    if stimuli_dirs is None:
+        stimuli_dirs = sorted(glob.glob(os.path.join(base_dir,'*','stimuli')))
+    old_manifest = _read_json(os.path.join(root,manifest_name)) or {'content':{}}
+    old_stat = _read_json(os.path.join(root,stat_name)) or {}
+    found = list(find_stimuli(stimuli_dirs))
+    stats = [os.stat(path) for task,name,path in found]
+    copies = [_relative(path, base_dir) for task,name,path in found]
+    shas = [None]*len(found)
+    to_hash = []
+    for index,(copy,stat) in enumerate(zip(copies, stats)):
+        cached = old_stat.get(copy)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            shas[index] = cached[2]
+        else:
+            to_hash.append(index)
+    #hashlib lets go of the GIL while it hashes, so reading and hashing big libraries spreads over the threads
+    with ThreadPoolExecutor(workers) as pool:
+        for index,sha in zip(to_hash, pool.map(file_sha256, [found[index][2] for index in to_hash])):
+            shas[index] = sha
+    content = {}
+    for (task,name,path),copy,stat,sha in zip(found, copies, stats, shas):
+        if sha not in content:
+            entry = dict(old_manifest['content'].get(sha) or describe(path))
+            entry.update({'ext':os.path.splitext(path)[1].lower(),'bytes':stat.st_size,'copies':[]})
+            content[sha] = entry
+        content[sha]['copies'].append(copy)
+    #logical names; one that stands for different content in different tasks is qualified with the task
+    by_name = {}
+    for (task,name,path),sha in zip(found, shas):
+        by_name.setdefault(name, {})[task] = sha
+    names = {}
+    conflicts = []
+    for name,tasks in by_name.items():
+        if len(set(tasks.values())) == 1:
+            names[name] = next(iter(tasks.values()))
+        else:
+            conflicts.append(name)
+            for task,sha in tasks.items():
+                names[task+'/'+name] = sha
+    manifest = {'version':manifest_version,'names':names,'content':content}
+    _write_json(os.path.join(root,manifest_name), manifest, indent=1)
+    _write_json(os.path.join(root,stat_name), dict((copy,[stat.st_size,stat.st_mtime_ns,sha])
+        for copy,stat,sha in zip(copies, stats, shas)))
+    counts = {'files':len(found),'hashed':len(to_hash),'unique':len(content),'names':len(names),'conflicts':conflicts,
+        'duplicate_bytes':sum(entry['bytes']*(len(entry['copies'])-1) for entry in content.values())}
+    return manifest, counts
+
+def read_manifest(root=None):
+    manifest = _read_json(os.path.join(root or default_root(), manifest_name))
+    if manifest is None or manifest.get('version') != manifest_version:
+        return None
+    return manifest
+
+class StimulusStore(object):
+    """Looks stimuli up by logical name in the manifest and hands out their files and decoded data.
+    Decoded pixels/PCM are written once to <root>/decoded/<sha[:2]>/<sha>.npy and memory-mapped from then on
+    (by every task and process on the machine); self.decodes counts the files this process had to decode.
+    Files are verified the way build_stimulus_cache.stale_entries checks its sources: size and mtime against the last
+    index (stat.json), and the hash when they differ; a copy whose content changed is never used."""
+    def __init__(self, root=None, base_dir=python_dir):
+        self.root = root or default_root()
+        self.base_dir = base_dir
+        manifest = read_manifest(self.root)
+        if manifest is None:
+            raise IOError('no stimulus manifest in %s (run python -m lab_utils.stimuli index)' % self.root)
+        self.names = manifest['names']
+        self.content = manifest['content']
+        self.decoded = {} #sha -> array, so each is only mapped once per process
+        self.stat = _read_json(os.path.join(self.root,stat_name)) or {} #this checkout's size/mtime/hash per copy
+        self.verified = {} #path -> (size, mtime) it was last found to have the right content with
+        self.hashed = 0 #files this process had to hash to verify them
+        self.lock = threading.Lock()
+        self.decodes = 0
+
+    def __contains__(self, name):
+        return self._name(name) in self.names
+
+    def _name(self, name):
+        #'images/bulbasaur.png' finds 'images/bulbasaur' too
+        if name not in self.names and os.path.splitext(name)[0] in self.names:
+            return os.path.splitext(name)[0]
+        return name
+
+    def sha(self, name):
+        try:
+            return self.names[self._name(name)]
+        except KeyError:
+            raise KeyError('%r is not in the stimulus store %s (run python -m lab_utils.stimuli index)' % (name, self.root))
+
+    def info(self, name):
+        """The manifest entry for name's content: kind, ext, bytes, copies, and size/mode or rate/channels/frames"""
+        return self.content[self.sha(name)]
+
+    def find(self, prefix='', extension=None):
+        """Sorted logical names that start with prefix (e.g. 'images/'), optionally only those with an extension"""
+        if isinstance(extension, str):
+            extension = [extension]
+        return sorted(name for name,sha in self.names.items() if name.startswith(prefix) and
+            (extension is None or self.content[sha]['ext'] in [ext.lower() for ext in extension]))
+
+    def object_path(self, sha):
+        return os.path.join(self.root,'objects',sha[:2],sha+self.content[sha]['ext'])
+
+    def _verified(self, path, sha):
+        """Whether the file at path still holds the content sha"""
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if self.verified.get(path) == key:
+                return True
+        if stat.st_size != self.content[sha]['bytes']:
+            return False
+        indexed = self.stat.get(_relative(path, self.base_dir))
+        #a touched but unchanged file (e.g. after a fresh checkout) is still fine
+        if indexed is None or indexed[0] != stat.st_size or indexed[1] != stat.st_mtime_ns or indexed[2] != sha:
+            self.hashed += 1
+            if file_sha256(path) != sha:
+                return False
+        with self.lock:
+            self.verified[path] = key
+        return True
+
+    def path(self, name):
+        """A file holding name's content: the store's own copy after dedupe --link, otherwise the first copy found.
+        Copies that changed since the last index are skipped; if every copy left has changed, this raises IOError."""
+        sha = self.sha(name)
+        candidates = [self.object_path(sha)]+[os.path.join(self.base_dir,copy) for copy in self.content[sha]['copies']]
+        changed = []
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                if self._verified(candidate, sha):
+                    return candidate
+                changed.append(candidate)
+        if changed:
+            raise IOError('%r changed since the stimulus store was indexed (%s); run python -m lab_utils.stimuli index' % (
+                name, ', '.join(changed)))
+        raise IOError('no copy of %r (%s) is left on disk' % (name, sha))
+
+    def _decoded(self, sha, decode):
+        with self.lock:
+            if sha in self.decoded:
+                return self.decoded[sha]
+        decoded_path = os.path.join(self.root,'decoded',sha[:2],sha+'.npy')
+        if not os.path.exists(decoded_path):
+            data = decode()
+            if not os.path.isdir(os.path.dirname(decoded_path)):
+                os.makedirs(os.path.dirname(decoded_path), exist_ok=True)
+            tmp_path = '%s.%d.%d.tmp' % (decoded_path, os.getpid(), threading.get_ident())
+            with open(tmp_path, 'wb') as decoded_file:
+                np.save(decoded_file, np.ascontiguousarray(data))
+            os.replace(tmp_path, decoded_path)
+            self.decodes += 1
+        data = np.load(decoded_path, mmap_mode='r')
+        with self.lock:
+            return self.decoded.setdefault(sha, data)
+
+    def pixels(self, name):
+        """Decoded uint8 pixels, (height, width, channels): RGBA if the image has transparency, else RGB (or L)"""
+        path = self.path(name)
+        def decode():
+            from PIL import Image
+            with Image.open(path) as im:
+                if 'A' in im.getbands() or 'transparency' in im.info:
+                    return np.asarray(im.convert('RGBA'))
+                return np.asarray(im.convert('L' if im.mode in ('1','L') else 'RGB'))
+        return self._decoded(self.sha(name), decode)
+
+    def image(self, name):
+        """The decoded pixels as a PIL image (what ImageStim and StimulusCache take)"""
+        from PIL import Image
+        return Image.fromarray(np.asarray(self.pixels(name)))
+
+    def pcm(self, name):
+        """(float32 samples, frames x channels in [-1, 1], sample rate) of a wav"""
+        from lab_utils.audio import decode_wav
+        path = self.path(name)
+        samples = self._decoded(self.sha(name), lambda: decode_wav(path)[0])
+        return samples, self.info(name)['rate']
+
+def dedupe(root=None, base_dir=python_dir, link=False):
+    """Groups of identical files ([(sha, bytes, copies)], largest waste first). With link=True every copy is replaced by
+    a hard link to one file in <root>/objects, so the library only takes the disk space of its distinct content (the
+    files stay where the tasks expect them, with the same bytes)."""
+    root = root or default_root()
+    manifest = read_manifest(root)
+    if manifest is None:
+        raise IOError('no stimulus manifest in %s (run python -m lab_utils.stimuli index)' % root)
+    groups = sorted(((sha,entry['bytes'],entry['copies']) for sha,entry in manifest['content'].items()
+        if len(entry['copies']) > 1), key=lambda group: -group[1]*(len(group[2])-1))
+    if link:
+        for sha,nbytes,copies in groups:
+            object_path = os.path.join(root,'objects',sha[:2],sha+manifest['content'][sha]['ext'])
+            paths = [os.path.join(base_dir,copy) for copy in copies]
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.link(paths[0], object_path)
+            inode = os.stat(object_path).st_ino
+            for path in paths:
+                if os.stat(path).st_ino == inode:
+                    continue
+                if file_sha256(path) != sha:
+                    print('skipping %s: changed since the last index' % path)
+                    continue
+                tmp_path = path+'.link.tmp'
+                os.link(object_path, tmp_path)
+                os.replace(tmp_path, path)
+    return groups
+
+def decode_all(store, prefix='', workers=4):
+    """Fill the decoded cache for every stimulus under prefix (one decode per distinct content). Returns the count."""
+    by_sha = {}
+    for name in store.find(prefix):
+        by_sha.setdefault(store.sha(name), name)
+    def decode(name):
+        if store.info(name)['kind'] == 'image':
+            store.pixels(name)
+        elif store.info(name)['ext'] in sound_extensions:
+            store.pcm(name)
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(decode, by_sha.values()))
+    return len(by_sha)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Content-addressed store of the stimuli shared by the activities')
+    parser.add_argument('command', choices=['index','dedupe','decode'])
+    parser.add_argument('stimuli_dirs', nargs='*', help='index: stimuli folders to index (default: every <task>/stimuli)')
+    parser.add_argument('--root', default=default_root(), help='store folder (default $LAB_STIMULI or python/stimulus_store)')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--link', action='store_true', help='dedupe: hard link identical copies to one file')
+    parser.add_argument('--prefix', default='', help='decode: only names starting with this')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    if args.command == 'index':
+        manifest,counts = build_index(args.root, args.stimuli_dirs or None, workers=args.workers)
+        print('%d files, %d distinct (%.1f MB in extra copies), %d names; hashed %d in %.2f s' % (counts['files'],
+            counts['unique'], counts['duplicate_bytes']/1e6, counts['names'], counts['hashed'], time.perf_counter()-start))
+        for name in counts['conflicts']:
+            print('%s differs between tasks, so it is only known by task-qualified names' % name)
+    elif args.command == 'dedupe':
+        groups = dedupe(args.root, link=args.link)
+        for sha,nbytes,copies in groups:
+            print('%s %8d bytes x%d  %s' % (sha[:12], nbytes, len(copies), '  '.join(copies)))
+        print('%d files have identical copies; the extra copies take %.1f MB%s' % (len(groups),
+            sum(nbytes*(len(copies)-1) for sha,nbytes,copies in groups)/1e6, ' (now hard links)' if args.link else ''))
+    elif args.command == 'decode':
+        store = StimulusStore(args.root)
+        count = decode_all(store, args.prefix, workers=args.workers)
+        print('%d distinct stimuli decoded (%d new) in %.2f s' % (count, store.decodes, time.perf_counter()-start))
@@ -0,0 +1,198 @@
+import collections
+from lab_utils.key_response import EventKeySource
+from lab_utils.flip_hooks import measured_frame_rate
+
+#Frame-locked trials: each phase is shown for a whole number of frames by counting flips, instead of
+#flip + core.wait(), which lands one frame late whenever the wait ends just after a refresh.
+#
+#    timeline = Timeline(win, [
+#        Phase('fixation', duration=.3, stims=[fixation_cross]),
+#        Phase('stimulus', stims=lambda trial: [trial['image']], keys=['z','m']),
+#        Phase('feedback', frames=18, stims=show_feedback),
+#    ])
+#    for trial in trials:
+#        timeline.run(trial)                 #trial['response'], trial['rt'] are filled in by the 'stimulus' phase
+#    print(timeline.summary())
+#
+#Between flips the timeline runs queued tasks (timeline.add_task(function, *args)) until shortly before the next
+#refresh: uploading the next trial's images, writing the last trial's data, and so on. Tasks should be short;
+#one that runs past the refresh delays the next flip.
+#Keys from a hardware-timestamped source (key_response.py) are read once per frame, since their times are when they
+#were pressed. psychopy.event stamps a key when it is polled, so while a phase with keys is up on that source the
+#timeline polls continuously until shortly before the next refresh (running queued tasks one at a time in between)
+#and the rt is not rounded up to the next frame.
+
+class Phase(object):
+    """One part of a trial. Its length is `frames`, or `duration` seconds rounded to whole frames; with `keys`
+    it also ends at the first of those keys (and with neither it lasts until any key is pressed).
+    `stims` is a list of stimuli to draw every frame, or a function(trial) returning one, called at the start of
+    the phase. key_source reads the keys (see key_response.py; psychopy.event if not given).
+    on_start(trial) runs before the phase's first flip (use win.callOnFlip to sync with its onset),
+    on_end(trial) after its last frame."""
+    def __init__(self, name, duration=None, frames=None, stims=(), keys=None, key_source=None,
+            on_start=None, on_end=None):
+        self.name = name
+        self.duration = duration
+        self.frames = frames
+        self.stims = stims
+        self.keys = keys
+        self.key_source = key_source
+        self.on_start = on_start
+        self.on_end = on_end
+
+    def num_frames(self, frame_period):
+        if self.frames is not None:
+            return self.frames
+        if self.duration is not None:
+            return max(1, int(round(self.duration/frame_period)))
+        return None
+
+class Timeline(object):
+    """Presents a list of Phases frame by frame and records requested vs achieved duration for each.
+    A phase's achieved duration runs from its first flip to the first flip of the next phase (so the last phase
+    of a trial is completed by the next trial's first flip). If `recorder` (a FlipRecorder) is given, flips are
+    tagged with the trial and phase."""
+    def __init__(self, win, phases, frame_rate=None, recorder=None, margin=0.004):
+        from psychopy import core
+        self.win = win
+        self.phases = list(phases)
+        if frame_rate is None:
+            frame_rate = 1.0/recorder.frame_period if recorder is not None else measured_frame_rate(win)
+        self.frame_period = 1.0/frame_rate
+        self.recorder = recorder
+        #stop starting idle tasks this long before the next refresh is due
+        self.margin = margin
+        self.now = core.getTime
+        self.tasks = collections.deque()
+        self.totals = collections.OrderedDict((phase.name,{'count':0,'requested_s':0.0,'achieved_s':0.0,
+            'off':0,'max_off_frames':0}) for phase in self.phases)
+        self.trial_num = 0
+        self._open = None #(result, onset) of the phase shown last, until the next flip ends it
+        self._default_keys = None
+
+    def add_task(self, function, *args, **kwargs):
+        """Queue function(*args, **kwargs) to run in the idle time between flips"""
+        self.tasks.append((function,args,kwargs))
+
+    def idle(self, flip_time):
+        """Run queued tasks until `margin` before the refresh after `flip_time`"""
+        deadline = flip_time+self.frame_period-self.margin
+        while self.tasks and self.now() < deadline:
+            function,args,kwargs = self.tasks.popleft()
+            function(*args, **kwargs)
+
+    def flush(self):
+        """Run all queued tasks now (e.g. after the last trial)"""
+        while self.tasks:
+            function,args,kwargs = self.tasks.popleft()
+            function(*args, **kwargs)
+
+    def _key_source(self, phase):
+        if phase.key_source is not None:
+            return phase.key_source
+        if self._default_keys is None:
+            self._default_keys = EventKeySource()
+        return self._default_keys
+
+    def _close_open_phase(self, end_time):
+        if self._open is None:
+            return
+        result,onset = self._open
+        self._open = None
+        result['achieved_ms'] = (end_time-onset)*1000
+        totals = self.totals[result['phase']]
+        totals['count'] += 1
+        totals['achieved_s'] += end_time-onset
+        if result['requested_ms'] is not None:
+            totals['requested_s'] += result['requested_ms']/1000.
+            off = int(round((end_time-onset-result['requested_ms']/1000.)/self.frame_period))
+            if off:
+                totals['off'] += 1
+                totals['max_off_frames'] = max(totals['max_off_frames'], abs(off))
+
+    def _spin_keys(self, source, key_list, flip_time):
+        """Poll a source stamped when polled until `margin` before the refresh after flip_time (running queued
+        tasks in between); returns the first keys it gives, or []"""
+        deadline = flip_time+self.frame_period-self.margin
+        while True:
+            pressed = source.poll(key_list)
+            if pressed or self.now() >= deadline:
+                return pressed
+            if self.tasks:
+                function,args,kwargs = self.tasks.popleft()
+                function(*args, **kwargs)
+
+    def run(self, trial=None, trial_num=None):
+        """Present one trial. `trial` (a dict, or anything the phases' functions expect) gets 'response', 'rt'
+        (s from the onset of the phase with keys) and 'response_phase' set by phases with keys.
+        Returns {phase name: {'phase','requested_frames','frames','onset','requested_ms','achieved_ms'}};
+        achieved_ms of the last phase is filled in by the next flip."""
+        if trial_num is None:
+            trial_num = self.trial_num
+        self.trial_num = trial_num+1
+        results = collections.OrderedDict()
+        for phase in self.phases:
+            num_frames = phase.num_frames(self.frame_period)
+            result = {'phase':phase.name,'requested_frames':num_frames,'frames':0,'onset':None,
+                'requested_ms':num_frames*self.frame_period*1000 if num_frames else None,'achieved_ms':None}
+            results[phase.name] = result
+            if phase.on_start is not None:
+                phase.on_start(trial)
+            stims = phase.stims(trial) if callable(phase.stims) else phase.stims
+            keys = None
+            #a phase with neither a length nor keys lasts until any key (keyList None)
+            if phase.keys is not None or num_frames is None:
+                keys = self._key_source(phase)
+                spin = not getattr(keys, 'hardware_timestamps', False)
+            if self.recorder is not None:
+                self.recorder.mark(phase.name, trial=trial_num,
+                    duration=result['requested_ms']/1000. if num_frames else None)
+            while True:
+                for stim in stims:
+                    stim.draw()
+                flip_time = self.win.flip()
+                if flip_time is None:
+                    flip_time = self.win.lastFrameT
+                result['frames'] += 1
+                if result['onset'] is None:
+                    self._close_open_phase(flip_time)
+                    result['onset'] = flip_time
+                    self._open = (result,flip_time)
+                    if keys is not None:
+                        keys.clear() #only presses after onset count
+                if keys is None:
+                    self.idle(flip_time)
+                else:
+                    if spin:
+                        pressed = self._spin_keys(keys, phase.keys, flip_time)
+                    else:
+                        self.idle(flip_time)
+                        pressed = keys.poll(phase.keys)
+                    if pressed:
+                        key,key_time = pressed[0]
+                        if trial is not None:
+                            trial['response'] = key
+                            trial['rt'] = key_time-result['onset']
+                            trial['response_phase'] = phase.name
+                        break
+                if num_frames is not None:
+                    #also stop on time, so a dropped frame shortens the phase instead of making it late
+                    elapsed = flip_time-result['onset']+self.frame_period
+                    if result['frames'] >= num_frames or elapsed >= (num_frames-0.5)*self.frame_period:
+                        break
+            if phase.on_end is not None:
+                phase.on_end(trial)
+        return results
+
+    def summary(self):
+        """Achieved vs requested duration per phase"""
+        lines = ['%.2f ms/frame' % (self.frame_period*1000)]
+        for name,totals in self.totals.items():
+            if not totals['count']:
+                continue
+            line = '    %-12s x%-5d achieved %8.1f ms' % (name, totals['count'], totals['achieved_s']*1000/totals['count'])
+            if totals['requested_s']:
+                line += '  requested %8.1f ms  off by a frame or more: %d (max %d frames)' % (
+                    totals['requested_s']*1000/totals['count'], totals['off'], totals['max_off_frames'])
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import time
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.data_writer import DataWriter
+from session_data import open_trial_log
+from checkpoint import SessionJournal
+
+## Benchmark of session checkpointing for long trial lists: the time the journal entry adds to each trial (against
+## rewriting a JSON state file every trial), and how long a relaunch takes to recover from a crash at the end.
+##
+##   python bench_checkpoint.py 10000 50000
+
+header = ["subj_code","seed",'image_name','item','angle','match','correct_response','response','rt']
+record = {'subj_code':'mr_101','seed':10,'image_name':'12_50_R','item':12,'angle':50,'match':'different',
+    'correct_response':'m','response':'m','rt':734.2861}
+
+def rewrite_state(num_trials, path):
+    """The obvious alternative: write the whole session state to a file and replace the old one, every trial"""
+    times = []
+    for trial_num in range(num_trials):
+        start = time.perf_counter()
+        tmp_path = path+'.tmp'
+        with open(tmp_path, 'w') as state_file:
+            json.dump({'trial':trial_num,'rows':trial_num+1,'time':time.time()}, state_file)
+        os.replace(tmp_path, path)
+        times.append(time.perf_counter()-start)
+    return times
+
+def journaled_session(num_trials, out_dir):
+    """Write num_trials trials the way mental_rotation_complete.py does, timing the journal commit, then 'crash'
+    (leaving half a row behind) without closing anything"""
+    data_path = os.path.join(out_dir, 'bench_data.csv')
+    log_path = os.path.join(out_dir, 'bench_data.trlog')
+    journal = SessionJournal(os.path.join(out_dir, 'bench_session.journal'))
+    info = {'subj_code':'mr_101','seed':10,'trial_path':'bench_trials.csv','num_trials':num_trials+1}
+    journal.recover(info, data_path, log_path)
+    data_file = DataWriter(data_path, header=header)
+    trial_log = open_trial_log(log_path)
+    times = []
+    for trial_num in range(num_trials):
+        data_file.write([record[name] for name in header])
+        trial_log.write(record)
+        start = time.perf_counter()
+        journal.commit(trial_num)
+        times.append(time.perf_counter()-start)
+    data_file.close()
+    trial_log.close()
+    with open(data_path, 'a') as data_file:
+        data_file.write('mr_101,10,3_1') #torn row
+    os.close(journal.fd)
+    return times, info, data_path, log_path
+
+def resume(out_dir, info, data_path, log_path):
+    start = time.perf_counter()
+    journal = SessionJournal(os.path.join(out_dir, 'bench_session.journal'))
+    first_trial = journal.recover(info, data_path, log_path)
+    elapsed = time.perf_counter()-start
+    journal.close()
+    return elapsed, first_trial
+
+def report(label, times):
+    times = sorted(t*1e6 for t in times)
+    print('    %-40s mean %8.1f us  p99 %8.1f us  max %8.1f us' % (label, sum(times)/len(times),
+        times[int(len(times)*.99)], times[-1]))
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 50000]
+    for num_trials in sizes:
+        out_dir = tempfile.mkdtemp()
+        print('%d trials' % num_trials)
+        report('rewrite JSON state every trial', rewrite_state(num_trials, os.path.join(out_dir,'state.json')))
+        times,info,data_path,log_path = journaled_session(num_trials, out_dir)
+        report('append journal entry', times)
+        elapsed,first_trial = resume(out_dir, info, data_path, log_path)
+        print('    resume: %.1f ms to continue at trial %d (journal %.0f kB)' % (elapsed*1000, first_trial,
+            os.path.getsize(os.path.join(out_dir,'bench_session.journal'))/1000.))
@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from generate_trials import generate_trials_batch
+
+## Benchmark of generating trial lists for a cohort: the old nested-loop generate_trials (one subject per call,
+## without its prints) vs generate_trials_batch. Both write one subject first, so the one-time imports (numpy.random
+## is only loaded on first use, ~20 ms) are reported separately instead of in the cohort time.
+
+def legacy_generate_trials(subj_code, seed, test_mode, out_dir):
+    random.seed(int(seed))
+    trial_file = open(os.path.join(out_dir,subj_code+'_trials.csv'),'w')
+    trial_file.write(','.join(["subj_code","seed","test_mode",'image_name','item','angle','match','correct_response'])+'\n')
+    trials = []
+    for i in range(48):
+        item = str(i+1)
+        for angle in ["0","50","100"]:
+            for match in ["same","different"]:
+                if match == "same":
+                    trials.append([subj_code,seed,test_mode,item+"_"+angle,item,angle,match,"z"])
+                else:
+                    trials.append([subj_code,seed,test_mode,item+"_"+angle+"_R",item,angle,match,"m"])
+    random.shuffle(trials)
+    for cur_trial in trials:
+        trial_file.write(','.join(map(str,cur_trial))+'\n')
+    trial_file.close()
+
+if __name__ == '__main__':
+    num_subjects = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    subjects = [{'subj_code':'mr_%d' % i,'seed':i,'test_mode':'real'} for i in range(num_subjects)]
+    out_dir = tempfile.mkdtemp()
+    warm_dir = tempfile.mkdtemp()
+    start = time.perf_counter()
+    legacy_generate_trials('warm', 0, 'real', warm_dir)
+    print('first subject, old:    %.1f ms' % ((time.perf_counter()-start)*1000))
+    start = time.perf_counter()
+    generate_trials_batch([{'subj_code':'warm','seed':0,'test_mode':'real'}], warm_dir)
+    print('first subject, batch:  %.1f ms' % ((time.perf_counter()-start)*1000))
+    start = time.perf_counter()
+    for subject in subjects:
+        legacy_generate_trials(subject['subj_code'], subject['seed'], subject['test_mode'], out_dir)
+    print('nested loops (old):    %.1f ms for %d subjects' % ((time.perf_counter()-start)*1000, num_subjects))
+    start = time.perf_counter()
+    generate_trials_batch(subjects, out_dir)
+    print('generate_trials_batch: %.1f ms for %d subjects' % ((time.perf_counter()-start)*1000, num_subjects))
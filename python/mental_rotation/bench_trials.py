@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import tracemalloc
+from trial_source import TrialTable, stream_trials
+
+## Benchmark of reading a large trial file: the old import_trials loop vs TrialTable.load and stream_trials
+
+def legacy_import_trials(trial_filename, col_names=None, separator=','):
+    """import_trials as it was: split each line, one dict of strings per row"""
+    trial_file = open(trial_filename, 'r')
+    if col_names is None:
+        col_names = trial_file.readline().rstrip().split(separator)
+    trials_list = []
+    for cur_trial in trial_file:
+        cur_trial = cur_trial.rstrip().split(separator)
+        assert len(cur_trial) == len(col_names)
+        trials_list.append(dict(zip(col_names, cur_trial)))
+    return trials_list
+
+def write_trial_file(path, num_rows, seed=1):
+    rng = random.Random(seed)
+    with open(path, 'w') as trial_file:
+        trial_file.write(','.join(["subj_code","seed","test_mode",'image_name','item','angle','match','correct_response'])+'\n')
+        for _ in range(num_rows):
+            item = rng.randint(1,48)
+            angle = rng.choice([0,50,100])
+            if rng.random() < .5:
+                row = ['mr_101',10,'real','%d_%d' % (item,angle),item,angle,'same','z']
+            else:
+                row = ['mr_101',10,'real','%d_%d_R' % (item,angle),item,angle,'different','m']
+            trial_file.write(','.join(map(str,row))+'\n')
+
+def measure(label, load):
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter()-start
+    #memory is measured on a second run; tracemalloc slows everything down
+    tracemalloc.start()
+    result = load()
+    current,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-34s %7.1f ms  kept %7.1f MB  peak %7.1f MB' % (label, elapsed*1000, current/1e6, peak/1e6))
+    return result
+
+def consume(rows):
+    for row in rows:
+        pass
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    path = os.path.join(tempfile.mkdtemp(),'trials.csv')
+    write_trial_file(path, num_rows)
+    measure('import_trials (old)', lambda: legacy_import_trials(path))
+    table = measure('TrialTable.load', lambda: TrialTable.load(path))
+    measure('stream_trials (nothing kept)', lambda: consume(stream_trials(path)))
+    start = time.perf_counter()
+    resumed = table[num_rows//2]['image_name']
+    print('random access to trial %d: %.1f us' % (num_rows//2, (time.perf_counter()-start)*1e6))
@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.data_writer import DataWriter
+
+## Benchmark of the time writing one trial adds to the trial loop:
+## the old inline write + flush + fsync (write_to_file's default) vs queueing the row on a DataWriter
+
+header = ["subj_code","seed",'image_name','item','angle','match','correct_response','response','rt']
+row = ['mr_101',10,'12_50_R',12,50,'different','m','m',734.2861]
+
+def fsync_every_trial(num_trials, path):
+    times = []
+    with open(path, 'w') as data_file:
+        data_file.write(','.join(header)+'\n')
+        for _ in range(num_trials):
+            start = time.perf_counter()
+            data_file.write(','.join([str(i) for i in row])+'\n')
+            data_file.flush()
+            os.fsync(data_file)
+            times.append(time.perf_counter()-start)
+    return times
+
+def data_writer(num_trials, path, checkpoint_every=None):
+    times = []
+    with DataWriter(path, header=header, checkpoint_every=checkpoint_every) as writer:
+        for trial_num in range(num_trials):
+            start = time.perf_counter()
+            writer.write(row)
+            times.append(time.perf_counter()-start)
+            #the checkpoint would be requested during the ITI, outside the timed part of the trial
+            writer.checkpoint()
+    return times
+
+def report(label, times):
+    times = sorted(t*1e6 for t in times)
+    print('%-40s mean %8.1f us  p99 %8.1f us  max %8.1f us' % (label, sum(times)/len(times),
+        times[int(len(times)*.99)], times[-1]))
+
+if __name__ == '__main__':
+    num_trials = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    out_dir = tempfile.mkdtemp()
+    report('write + fsync every trial (old)', fsync_every_trial(num_trials, os.path.join(out_dir,'old.csv')))
+    report('DataWriter, checkpoint in ITI', data_writer(num_trials, os.path.join(out_dir,'new.csv')))
@@ -0,0 +1,193 @@
+import os
+import glob
+import json
+import hashlib
+import argparse
+import numpy as np
+from PIL import Image
+
+#the cache is one flat uint8 file with every image back to back, plus a json index of name -> offset/shape.
+#Images are stored the way they will be uploaded: already at their on-screen size, and as a single luminance channel
+#(height,width) when they only hold gray (the mental rotation figures are gray, but saved as RGB JPGs)
+data_name = 'images.u8'
+index_name = 'index.json'
+cache_version = 2
+grayscale_policies = ('auto','always','never')
+
+def file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def display_size(width, height, scale):
+    return (max(1,int(round(width*scale))), max(1,int(round(height*scale))))
+
+def chroma(pixels):
+    """Mean and 99th percentile of the spread between the colour channels of an (height,width,3) uint8 array"""
+    spread = pixels.max(axis=2).astype(np.int16)-pixels.min(axis=2)
+    return float(spread.mean()), float(np.percentile(spread, 99))
+
+def is_grayscale(pixels, max_mean=4.0, max_p99=24.0):
+    """True if an RGB image only holds gray (up to JPEG colour noise); every other pixel in each direction is enough"""
+    if pixels.ndim == 2:
+        return True
+    mean,p99 = chroma(pixels[::2,::2])
+    return mean <= max_mean and p99 <= max_p99
+
+def prepare_image(im, size, grayscale='auto'):
+    """im resized to size (width,height) with a proper filter (LANCZOS), as 'RGBA' if it has any transparent pixels,
+    otherwise as 'L' if grayscale is 'always', or 'auto' and the image is gray, and as 'RGB' if not"""
+    if grayscale not in grayscale_policies:
+        raise ValueError('grayscale must be one of %s, got %r' % (', '.join(grayscale_policies), grayscale))
+    if 'A' in im.getbands() or 'transparency' in im.info:
+        im = im.convert('RGBA')
+        if im.getchannel('A').getextrema()[0] == 255:
+            im = im.convert('RGB')
+    else:
+        im = im.convert('RGB')
+    if im.mode == 'RGB' and (grayscale == 'always' or (grayscale == 'auto' and is_grayscale(np.asarray(im)))):
+        im = im.convert('L')
+    if im.size != tuple(size):
+        im = im.resize(tuple(size), Image.LANCZOS)
+    return im
+
+def texture_nbytes(width, height, channels=4, mipmaps=False):
+    """Texture memory for width x height texels of `channels` bytes (a full mipmap chain adds a third)"""
+    nbytes = width*height*channels
+    return nbytes*4//3 if mipmaps else nbytes
+
+def build_cache(source_dir, cache_dir, extension='.jpg', scale=0.5, grayscale='auto'):
+    """Decode every image in source_dir once, resize it to its on-screen size (single channel if gray, see
+    prepare_image) and pack it into cache_dir"""
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    file_list = sorted(glob.glob(os.path.join(source_dir,'*'+extension)))
+    entries = {}
+    offset = 0
+    tmp_data_path = os.path.join(cache_dir,data_name+'.tmp')
+    with open(tmp_data_path, 'wb') as data_file:
+        for fullPath in file_list:
+            stimFile = os.path.splitext(os.path.basename(fullPath))[0]
+            with Image.open(fullPath) as im:
+                (width,height) = im.size
+                im = prepare_image(im, display_size(width,height,scale), grayscale)
+            pixels = np.asarray(im, dtype=np.uint8)
+            data_file.write(pixels.tobytes())
+            stat = os.stat(fullPath)
+            entries[stimFile] = {'offset':offset,'shape':list(pixels.shape),'source_size':[width,height],
+                'file':os.path.basename(fullPath),'mtime':stat.st_mtime,'bytes':stat.st_size,'sha1':file_hash(fullPath)}
+            offset += pixels.nbytes
+    index = {'version':cache_version,'extension':extension,'scale':scale,'grayscale':grayscale,'entries':entries}
+    tmp_index_path = os.path.join(cache_dir,index_name+'.tmp')
+    with open(tmp_index_path, 'w') as index_file:
+        json.dump(index, index_file, indent=1)
+    #swap both files in only once they are complete
+    os.replace(tmp_data_path, os.path.join(cache_dir,data_name))
+    os.replace(tmp_index_path, os.path.join(cache_dir,index_name))
+    return index
+
+def read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir,index_name), 'r') as index_file:
+            index = json.load(index_file)
+    except (IOError, ValueError):
+        return None
+    if index.get('version') != cache_version:
+        return None
+    return index
+
+def stale_entries(index, source_dir):
+    """Names whose source file changed (size/mtime and then hash), disappeared, or is missing from the cache"""
+    stale = []
+    entries = index['entries']
+    on_disk = set(os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(source_dir,'*'+index['extension'])))
+    stale.extend(on_disk.difference(entries))
+    for name,entry in entries.items():
+        fullPath = os.path.join(source_dir,entry['file'])
+        if name not in on_disk:
+            stale.append(name)
+            continue
+        stat = os.stat(fullPath)
+        if stat.st_size == entry['bytes'] and stat.st_mtime == entry['mtime']:
+            continue
+        #a touched but unchanged file (e.g. after a fresh checkout) is still fine
+        if stat.st_size != entry['bytes'] or file_hash(fullPath) != entry['sha1']:
+            stale.append(name)
+    return stale
+
+def open_cache(cache_dir, source_dir, extension='.jpg', scale=0.5, rebuild=True, grayscale='auto'):
+    """Return {name: read-only uint8 (height,width) or (height,width,3) view into the memory-mapped cache} and the index.
+    The cache is rebuilt (or, with rebuild=False, ignored by returning None) if it is out of date."""
+    index = read_index(cache_dir)
+    if (index is None or index['scale'] != scale or index['extension'] != extension or index['grayscale'] != grayscale
+            or stale_entries(index, source_dir)):
+        if not rebuild:
+            return None, None
+        print('rebuilding stimulus cache in ' + cache_dir)
+        index = build_cache(source_dir, cache_dir, extension=extension, scale=scale, grayscale=grayscale)
+    data = np.memmap(os.path.join(cache_dir,data_name), dtype=np.uint8, mode='r')
+    views = {}
+    for name,entry in index['entries'].items():
+        shape = tuple(entry['shape'])
+        views[name] = data[entry['offset']:entry['offset']+int(np.prod(shape))].reshape(shape)
+    return views, index
+
+def memory_report(index, mipmaps=False):
+    """Per-stimulus texture bytes of the cached images next to what the source file costs uploaded the old way
+    (full size, RGBA): [{'name','size','channels','nbytes','full_rgba_bytes'}, ...]"""
+    rows = []
+    for name,entry in sorted(index['entries'].items()):
+        shape = entry['shape']
+        channels = 1 if len(shape) == 2 else 4
+        rows.append({'name':name,'size':(shape[1],shape[0]),'channels':channels,
+            'nbytes':texture_nbytes(shape[1], shape[0], channels, mipmaps),
+            'full_rgba_bytes':texture_nbytes(entry['source_size'][0], entry['source_size'][1])})
+    return rows
+
+def verify_pixels(views, index, source_dir):
+    """Compare every cached image with an RGB LANCZOS resize of its source file (what the cache held before single
+    channel textures): {name: (mean, 99th percentile, max absolute difference)}"""
+    differences = {}
+    for name,entry in sorted(index['entries'].items()):
+        with Image.open(os.path.join(source_dir,entry['file'])) as im:
+            reference = np.asarray(im.convert('RGBA' if views[name].ndim == 3 and views[name].shape[2] == 4 else 'RGB').resize(display_size(entry['source_size'][0], entry['source_size'][1],
+                index['scale']), Image.LANCZOS), dtype=np.int16)
+        pixels = views[name]
+        if pixels.ndim == 2:
+            pixels = pixels[:,:,None]
+        diff = np.abs(reference-pixels)
+        differences[name] = (float(diff.mean()), float(np.percentile(diff, 99)), int(diff.max()))
+    return differences
+
+if __name__ == '__main__':
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Pack the mental rotation images into a display-sized, memory-mappable cache')
+    parser.add_argument('--source', default=os.path.join(cur_dir,'stimuli','images'))
+    parser.add_argument('--out', default=os.path.join(cur_dir,'stimuli','cache'))
+    parser.add_argument('--scale', type=float, default=0.5, help='on-screen size relative to the source images')
+    parser.add_argument('--extension', default='.jpg')
+    parser.add_argument('--grayscale', choices=grayscale_policies, default='auto', help='store gray images as one channel')
+    parser.add_argument('--report', action='store_true', help='print the texture bytes of every stimulus')
+    parser.add_argument('--verify', action='store_true', help='compare the cached pixels with an RGB resize of the sources')
+    args = parser.parse_args()
+    index = build_cache(args.source, args.out, extension=args.extension, scale=args.scale, grayscale=args.grayscale)
+    total = sum(int(np.prod(entry['shape'])) for entry in index['entries'].values())
+    gray = sum(len(entry['shape']) == 2 for entry in index['entries'].values())
+    print('%d images (%d single channel), %.1f MB in %s' % (len(index['entries']), gray, total/1e6, args.out))
+    rows = memory_report(index)
+    if args.report:
+        for row in rows:
+            print('%-16s %4dx%-4d %d channel  %9d bytes  (full size RGBA %9d)' % (row['name'], row['size'][0],
+                row['size'][1], row['channels'], row['nbytes'], row['full_rgba_bytes']))
+    nbytes = sum(row['nbytes'] for row in rows)
+    full_rgba_bytes = sum(row['full_rgba_bytes'] for row in rows)
+    print('texture memory %.1f MB, %.1f MB as full size RGBA (%.1fx less)' % (nbytes/1e6, full_rgba_bytes/1e6,
+        full_rgba_bytes/float(max(nbytes,1))))
+    if args.verify:
+        views,index = open_cache(args.out, args.source, extension=args.extension, scale=args.scale, grayscale=args.grayscale)
+        differences = verify_pixels(views, index, args.source)
+        worst = max(differences, key=lambda name: differences[name][0])
+        print('pixels vs RGB resize: mean diff %.2f (worst %s: mean %.2f, p99 %.1f, max %d)' % ((
+            np.mean([diff[0] for diff in differences.values()]), worst)+differences[worst]))
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import zlib
+import struct
+import numpy as np
+
+## Crash-safe sessions: after every trial one small fixed-size entry (trial index, rows written so far, time) is
+## appended to data/<subj_code>_session.journal, after a header naming the trial list the session uses. Nothing is
+## ever rewritten. When the session is launched again with the same subj_code, recover() finds the last trial that
+## both the data CSV and the trial log hold in full, cuts off anything after it (a row half-written by the crash, or
+## rows the journal never heard of) and returns the trial to carry on from. The trial order comes from the trial list,
+## so there is no random state to restore. Launching a session that already ran its last trial returns num_trials and leaves its files alone.
+##
+##   journal = SessionJournal(journal_path)
+##   trial_path = journal.trial_path() or find_trial_list(subj_code, seed, test_mode)
+##   first_trial = journal.recover(info, data_path, trial_log_path)
+##   ...after writing each trial's rows:
+##   journal.commit(trial_num)
+
+MAGIC = b'SESSJRNL2\n'
+_length = struct.Struct('<I')
+#trial index, rows written, time
+_entry = struct.Struct('<qqd')
+_crc = struct.Struct('<I')
+ENTRY_SIZE = _entry.size+_crc.size
+#the same layout for reading a whole journal at once
+_entry_dtype = np.dtype([('trial','<i8'),('rows','<i8'),('time','<f8'),('crc','<u4')])
+
+def read_journal(path):
+    """(info dict, entries as an array of _entry_dtype, size of the header in bytes). Only the end of the journal can
+    be torn by a crash, so entries are checked from the end back to the first one whose CRC is right."""
+    with open(path, 'rb') as journal_file:
+        data = journal_file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(path + ' is not a session journal')
+    pos = len(MAGIC)
+    (size,) = _length.unpack_from(data, pos)
+    pos += _length.size
+    info = json.loads(data[pos:pos+size].decode('utf-8'))
+    pos += size
+    count = (len(data)-pos)//ENTRY_SIZE
+    entries = np.frombuffer(data, dtype=_entry_dtype, count=count, offset=pos)
+    while count and zlib.crc32(data[pos+(count-1)*ENTRY_SIZE:pos+count*ENTRY_SIZE-_crc.size]) != entries['crc'][count-1]:
+        count -= 1
+    return info, entries[:count], pos
+
+def csv_rows(path, header_lines=1):
+    """Byte offset of the end of every complete row of a CSV (after its header)"""
+    data = np.fromfile(path, dtype=np.uint8)
+    return np.flatnonzero(data == ord('\n'))[header_lines:]+1
+
+def trial_log_rows(path):
+    """Byte offset of the end of every complete record of a trial log (see session_data.py)"""
+    from session_data import MAGIC as LOG_MAGIC
+    with open(path, 'rb') as log_file:
+        data = log_file.read()
+    if not data.startswith(LOG_MAGIC):
+        return []
+    pos = len(LOG_MAGIC)
+    (size,) = _length.unpack_from(data, pos)
+    pos += _length.size+size
+    ends = []
+    unpack_from,prefix = _length.unpack_from,_length.size
+    while pos+prefix <= len(data):
+        pos += prefix+unpack_from(data, pos)[0]
+        if pos > len(data):
+            break
+        ends.append(pos)
+    return ends
+
+def _truncate(path, offset):
+    with open(path, 'r+b') as out_file:
+        out_file.truncate(offset)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+
+class SessionJournal(object):
+    """Append-only record of a session's progress (one ENTRY_SIZE-byte entry per trial). Each entry is written with a
+    single os.write to a file opened for appending, so a crash can at worst leave a torn last entry, which the CRC
+    catches. Entries are not fsync'ed: they reach the disk with the page cache (or at close()), and recover() only
+    trusts rows that are really in the data files, so a journal that is behind them just costs the last few trials."""
+    def __init__(self, path):
+        self.path = path
+        self.info = None
+        self.entries = np.zeros(0, dtype=_entry_dtype)
+        self.header_size = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.info,self.entries,self.header_size = read_journal(path)
+        self.fd = None
+        self.rows = 0
+        self.commits = 0
+
+    def unfinished(self):
+        """True if the journal belongs to a session that stopped before its last trial"""
+        return len(self.entries) > 0 and self.entries['trial'][-1] < self.info['num_trials']-1
+
+    def finished(self):
+        """True if the journal belongs to a session that ran its last trial"""
+        return len(self.entries) > 0 and self.entries['trial'][-1] >= self.info['num_trials']-1
+
+    def _same_session(self, info):
+        return all(str(self.info.get(key)) == str(info.get(key)) for key in ('subj_code','seed','num_trials'))
+
+    def trial_path(self):
+        """Trial list an unfinished session was using (so it is not generated again), or None"""
+        if self.unfinished() and os.path.exists(self.info['trial_path']):
+            return self.info['trial_path']
+        return None
+
+    def recover(self, info, data_path, log_path, before_trial=None):
+        """Continue the unfinished session described by info (subj_code, seed, trial_path, num_trials): cut the
+        data CSV and trial log back to the last trial they both hold (and that comes before before_trial, e.g. the
+        first trial the results aggregator is missing), and return the next trial's index.
+        If that session already ran its last trial, nothing is touched and num_trials is returned.
+        Otherwise (no journal, another session's finished one, or nothing recoverable) start a new journal and return 0."""
+        if self.finished() and self._same_session(info):
+            self.rows = int(self.entries['rows'][-1])
+            return int(self.info['num_trials'])
+        if self.unfinished():
+            for key in ('subj_code','seed','num_trials'):
+                if str(self.info.get(key)) != str(info.get(key)):
+                    raise ValueError('%s belongs to a session with %s=%s, not %s (use another subj_code or remove it)' % (
+                        self.path, key, self.info.get(key), info.get(key)))
+            data_ends = csv_rows(data_path) if os.path.exists(data_path) else []
+            log_ends = trial_log_rows(log_path) if os.path.exists(log_path) else []
+            rows = self.entries['rows']
+            usable = (rows <= len(data_ends)) & (rows <= len(log_ends))
+            if before_trial is not None:
+                usable &= self.entries['trial'] < before_trial
+            if usable.any():
+                index = len(usable)-1-int(np.argmax(usable[::-1]))
+                entry = self.entries[index]
+                self.rows = int(entry['rows'])
+                _truncate(data_path, int(data_ends[self.rows-1]))
+                _truncate(log_path, int(log_ends[self.rows-1]))
+                #later entries described rows that are gone now
+                self.entries = self.entries[:index+1]
+                _truncate(self.path, self.header_size+len(self.entries)*ENTRY_SIZE)
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+                return int(entry['trial'])+1
+        self._start(info)
+        return 0
+
+    def _start(self, info):
+        """Begin a new journal for the session described by info"""
+        self.info = info
+        self.entries = np.zeros(0, dtype=_entry_dtype)
+        self.rows = 0
+        info_json = json.dumps(info).encode('utf-8')
+        tmp_path = self.path+'.tmp'
+        with open(tmp_path, 'wb') as journal_file:
+            journal_file.write(MAGIC+_length.pack(len(info_json))+info_json)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(tmp_path, self.path)
+        self.header_size = len(MAGIC)+_length.size+len(info_json)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def commit(self, trial_index, rows=1):
+        """Record that trial_index is done and its `rows` rows have been written (queued) to the data files"""
+        self.rows += rows
+        body = _entry.pack(trial_index, self.rows, time.time())
+        os.write(self.fd, body+_crc.pack(zlib.crc32(body)))
+        self.commits += 1
+
+    def close(self):
+        if self.fd is not None:
+            os.fsync(self.fd)
+            os.close(self.fd)
+            self.fd = None
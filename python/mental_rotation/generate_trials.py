@@ -1,47 +1,121 @@
-import random
 import os
+import sys
+import csv
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.design import Design, Factor
 
-def generate_trials(subj_code,seed,test_mode):
-	separator=","
-	
-	#set seed
-	random.seed(int(seed))
-	
-	#open trial file and write header
-	trial_file = open(os.path.join(os.getcwd(),'trials',subj_code+'_trials.csv'),'w')
-	header = separator.join(["subj_code","seed","test_mode", 'image_name','item','angle','match','correct_response'])
-	trial_file.write(header+'\n')
-	
-	#define trial parameters
-	angle_list = ["0","50","100"]
-	num_items = 48
-	match_list = ["same","different"]
-	image_name_sep = "_"
-	#image_ext = ".jpg"
-	
-	#create trials
-	trials = []
-	for i in range(num_items):
-		item = str(i+1)
-		for angle in angle_list:
-			for match in match_list:
-				if match == "same":
-					image_name = item+image_name_sep+angle
-					correct_response = "z"
-				else:
-					image_name = item+image_name_sep+angle+image_name_sep+"R"
-					correct_response = "m"
-				trials.append([subj_code,seed,test_mode,image_name,item,angle,match,correct_response])
-	print(trials)
-	random.shuffle(trials)
-	
-	for cur_trial in trials:
-		print(cur_trial)
-		trial_file.write(separator.join(map(str,cur_trial))+'\n')
-	
-	trial_file.close()
-	return True
+#trial lists live next to this script, wherever it is launched from (or in LAB_TRIALS_DIR: orchestrator.py's test
+#points the sessions it launches at its own work directory)
+trials_dir = os.environ.get('LAB_TRIALS_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)),'trials')
+index_name = 'index.csv'
 
+#define trial parameters
+angle_list = [0,50,100]
+num_items = 48
+match_list = ["same","different"]
+image_name_sep = "_"
+#image_ext = ".jpg"
+
+def image_name(columns):
+	image_names = np.char.add(np.char.add(columns['item'].astype(str),image_name_sep),columns['angle'].astype(str))
+	return np.where(columns['match']=="same",image_names,np.char.add(image_names,image_name_sep+"R"))
+
+def correct_response(columns):
+	return np.where(columns['match']=="same","z","m")
+
+def mental_rotation_design(constraints=None):
+	"""48 items x angle_list x match_list, e.g. constraints=[MaxRunLength('correct_response',4), NoImmediateRepeat('item')]"""
+	return Design([Factor('item',np.arange(1,num_items+1)),Factor('angle',angle_list),Factor('match',match_list)],
+		derived={'image_name':image_name,'correct_response':correct_response},
+		constraints=constraints,
+		column_order=['image_name','item','angle','match','correct_response'])
+
+def generate_trials(subj_code,seed,test_mode,out_dir=None,constraints=None):
+	#one subject's shuffled trial list, written to trials/<subj_code>_trials.csv
+	return generate_trials_batch([{'subj_code':subj_code,'seed':seed,'test_mode':test_mode}],out_dir,constraints)[0]
+
+def generate_trials_batch(subjects,out_dir=None,constraints=None,study_seed=None):
+	"""Write trial lists for many subjects in one go. subjects is a list of dicts with subj_code, seed and test_mode.
+	Each subject's order comes from their own numpy Generator, so the same seed always gives the same list."""
+	if out_dir is None:
+		out_dir = trials_dir
+	design = mental_rotation_design(constraints)
+	return design.write(subjects,out_dir,leading_columns=('subj_code','seed','test_mode'),study_seed=study_seed)
+
+def read_manifest(manifest_path,study_seed=0):
+	"""Cohort manifest: a CSV with a subj_code column and optionally seed, test_mode and any condition columns.
+	Subjects without a seed get one derived from study_seed and their row number, so reruns give the same lists."""
+	with open(manifest_path,'r',newline='') as manifest_file:
+		subjects = [dict(row) for row in csv.DictReader(manifest_file)]
+	for subject_index,subject in enumerate(subjects):
+		if not subject.get('seed'):
+			seed_seq = np.random.SeedSequence(int(study_seed),spawn_key=(subject_index,))
+			subject['seed'] = int(seed_seq.generate_state(1)[0])
+		subject.setdefault('test_mode','real')
+	return subjects
+
+def write_index(subjects,paths,out_dir):
+	"""trials/index.csv: one row per subject with their seed, conditions and trial file (relative to out_dir)"""
+	cols = ['subj_code','seed','test_mode'] + sorted(set(key for subject in subjects for key in subject).difference(['subj_code','seed','test_mode']))
+	index_path = os.path.join(out_dir,index_name)
+	tmp_path = index_path+'.tmp%d' % os.getpid()
+	with open(tmp_path,'w',newline='') as index_file:
+		writer = csv.writer(index_file)
+		writer.writerow(cols+['trial_file'])
+		for subject,path in zip(subjects,paths):
+			writer.writerow([subject.get(col,'') for col in cols]+[os.path.relpath(path,out_dir)])
+	os.replace(tmp_path,index_path)
+	return index_path
+
+def generate_cohort(manifest_path,out_dir=None,processes=None,constraints=None,study_seed=0,chunk_size=50):
+	"""Generate every trial list in a cohort manifest across a process pool and write trials/index.csv"""
+	if out_dir is None:
+		out_dir = trials_dir
+	if not os.path.isdir(out_dir):
+		os.makedirs(out_dir)
+	subjects = read_manifest(manifest_path,study_seed)
+	chunks = [subjects[i:i+chunk_size] for i in range(0,len(subjects),chunk_size)]
+	paths = []
+	with ProcessPoolExecutor(max_workers=processes) as pool:
+		for chunk_paths in pool.map(generate_trials_batch,chunks,[out_dir]*len(chunks),[constraints]*len(chunks)):
+			paths.extend(chunk_paths)
+	return write_index(subjects,paths,out_dir)
+
+def find_trial_list(subj_code,seed=None,test_mode=None,out_dir=None):
+	"""Path of a pre-generated trial list for subj_code (looked up in the index, then by file name), or None.
+	With seed and/or test_mode a list made with different ones is not used (None, so the caller makes a new one)."""
+	if out_dir is None:
+		out_dir = trials_dir
+	path = os.path.join(out_dir,subj_code+'_trials.csv')
+	index_path = os.path.join(out_dir,index_name)
+	if os.path.exists(index_path):
+		with open(index_path,'r',newline='') as index_file:
+			for row in csv.DictReader(index_file):
+				if row['subj_code'] == subj_code:
+					path = os.path.join(out_dir,row['trial_file'])
+					break
+	if not os.path.exists(path):
+		return None
+	#every row of a trial list repeats the seed and test_mode it was made with
+	with open(path,'r',newline='') as trial_file:
+		first_trial = next(csv.DictReader(trial_file),{})
+	for col,wanted in (('seed',seed),('test_mode',test_mode)):
+		if wanted is not None and str(first_trial.get(col)) != str(wanted):
+			print('%s was made with %s %s, not %s; making a new trial list' % (path,col,first_trial.get(col),wanted))
+			return None
+	return path
 
 if __name__ == '__main__':
-	generate_trials("test",100,"practice")	
+	parser = argparse.ArgumentParser(description='Generate mental rotation trial lists')
+	parser.add_argument('--manifest', help='cohort CSV (subj_code[,seed,test_mode,...]); without it a single test list is made')
+	parser.add_argument('--out', default=trials_dir)
+	parser.add_argument('--processes', type=int, default=None)
+	parser.add_argument('--study-seed', type=int, default=0, help='used for subjects without a seed in the manifest')
+	args = parser.parse_args()
+	if args.manifest:
+		print(generate_cohort(args.manifest,args.out,args.processes,study_seed=args.study_seed))
+	else:
+		generate_trials("test",100,"practice",args.out)
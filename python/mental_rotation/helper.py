@@ -1,83 +1,315 @@
-from psychopy import visual, event, core, gui 
+#psychopy is imported where it is used, so importing helper (e.g. to show the runtime-vars dialog) stays cheap
 import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image
+from collections import OrderedDict
+from prefetch import decode_image
+from build_stimulus_cache import open_cache, display_size, prepare_image, texture_nbytes
+from lab_utils.key_response import default_key_source, collect_keys
+from lab_utils.launcher import get_runtime_vars
+from trial_source import TrialTable, TRIAL_SCHEMA
 import glob
+import numpy as np
 
-#runtime variables
-def get_runtime_vars(vars_to_get,order,exp_version="experiment_code_for_reference"):
-    #Get run time variables, see http://www.psychopy.org/api/gui.html for explanation
-    infoDlg = gui.DlgFromDict(dictionary=vars_to_get, title=exp_version, order=order)
-    if infoDlg.OK:
-        return vars_to_get
-    else: 
-        print('User Cancelled')
-
-def import_trials(trial_filename, col_names=None, separator=','):
-    trial_file = open(trial_filename, 'r')
- 
-    if col_names is None:
-        # Assume the first row contains the column names
-        col_names = trial_file.readline().rstrip().split(separator)
-    trials_list = []
-    for cur_trial in trial_file:
-        cur_trial = cur_trial.rstrip().split(separator)
-        assert len(cur_trial) == len(col_names) # make sure the number of column names = number of columns
-        trial_dict = dict(zip(col_names, cur_trial))
-        trials_list.append(trial_dict)
-    return trials_list
-
-def load_files(directory,extension,fileType,win='',restriction='*',stim_list=[]):
-    """ Load all the pics and sounds. Uses pyo or pygame for the sound library (see prefs.general['audioLib'])"""
+def import_trials(trial_filename, col_names=None, separator=',', schema=TRIAL_SCHEMA):
+    """Read a trial list (CSV, or Parquet with pyarrow) into a TrialTable: typed values (angle, item etc. are ints),
+    one Trial per row that reads like a dict (cur_trial['image_name']), and random access by trial index"""
+    return TrialTable.load(trial_filename, schema=schema, col_names=col_names, separator=separator)
+
+class StimulusCache(object):
+    """Dict-like store of image stimuli that only builds an ImageStim on first access (or on prefetch).
+    Entries look exactly like the ones load_files used to return ({'stim':...,'width':...} etc).
+    Least recently used entries are dropped once max_entries or max_bytes (estimated RGBA texture size) is exceeded.
+    pixels can map names to display-sized uint8 arrays (see build_stimulus_cache.py), which are then used instead of the files;
+    otherwise the file is decoded and resized to display_scale (LANCZOS) before it is uploaded.
+    grayscale ('auto', 'always' or 'never') uploads gray images as single channel luminance textures, and mipmaps
+    builds mipmaps for every texture (for stimuli drawn smaller than their texture); see memory_report.
+    file_list holds paths, or (name, path) pairs for files not named after their stimulus (e.g. from a stimulus store),
+    and open_image(name) can return the full-size image instead of the file being decoded (see load_files' store).
+    variants maps names to (base name, transform) (see stimulus_variants.py): those are drawn from the base's texture
+    with the transform's draw parameters, so they are never decoded or uploaded themselves."""
+    def __init__(self, win, file_list, max_entries=None, max_bytes=None, stim_kwargs=None, pixels=None, display_scale=None,
+            variants=None, grayscale='auto', mipmaps=False, open_image=None):
+        self.win = win
+        self.variants = dict(variants or {})
+        self.variant_entries = {} #variant name -> (base entry it was made from, entry)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.pixels = pixels or {}
+        self.display_scale = display_scale
+        self.grayscale = grayscale
+        self.mipmaps = mipmaps
+        self.open_image = open_image
+        self.stim_kwargs = stim_kwargs or {'mask':None,'interpolate':True}
+        self.files = {} #stim name -> (num, full path)
+        for num,fullPath in enumerate(file_list):
+            if isinstance(fullPath, tuple):
+                stimFile,fullPath = fullPath
+            else:
+                stimFile = os.path.splitext(os.path.basename(fullPath))[0]
+            self.files[stimFile] = (num,fullPath)
+        self.entries = OrderedDict() #loaded stimuli, oldest access first
+        self.nbytes = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def __getitem__(self, name):
+        if name in self.variants:
+            return self._variant(name)
+        if name in self.entries:
+            self.entries.move_to_end(name)
+            return self.entries[name]
+        if name not in self.files:
+            raise KeyError(name)
+        return self._load(name)
+
+    def __contains__(self, name):
+        return name in self.files or name in self.variants
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return list(self.files)+[name for name in self.variants if name not in self.files]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def base_name(self, name):
+        """The stimulus whose texture name is drawn with (itself unless it is a variant)"""
+        return self.variants[name][0] if name in self.variants else name
+
+    def is_loaded(self, name):
+        return self.base_name(name) in self.entries
+
+    def variant(self, base, transform):
+        """Entry for base drawn with transform (e.g. 'mirror'), registered as '<base>|<transform>'"""
+        name = base+'|'+transform
+        self.variants.setdefault(name, (base, transform))
+        return self[name]
+
+    def _variant(self, name):
+        from stimulus_variants import VariantStim, draw_params
+        base,transform = self.variants[name]
+        base_entry = self[base]
+        cached = self.variant_entries.get(name)
+        if cached is not None and cached[0] is base_entry:
+            return cached[1]
+        scale = draw_params(transform)['scale']
+        entry = dict(base_entry, stim=VariantStim(base_entry['stim'], transform), filename=name, base=base, nbytes=0,
+            width=base_entry['width']*scale, height=base_entry['height']*scale)
+        self.variant_entries[name] = (base_entry, entry)
+        return entry
+
+    def prefetch(self, names):
+        """Load stimuli ahead of time (e.g. the image names from the trial list), in the order they will be used.
+        Stops early once the cache is full, so the first trials are never evicted by later ones."""
+        loaded = 0
+        for name in names:
+            name = self.base_name(name)
+            if name in self.entries:
+                continue
+            if self._is_full():
+                break
+            self[name]
+            loaded += 1
+        return loaded
+
+    def _is_full(self):
+        if self.max_entries is not None and len(self.entries) >= self.max_entries:
+            return True
+        if self.max_bytes is not None and self.nbytes >= self.max_bytes:
+            return True
+        return False
+
+    def add(self, name, image):
+        """Upload an already decoded image (e.g. from a TrialPrefetcher) instead of reading the file again"""
+        if name in self.variants:
+            self.add(self.base_name(name), image)
+            return self._variant(name)
+        if name in self.entries:
+            self.entries.move_to_end(name)
+            return self.entries[name]
+        return self._load(name, image)
+
+    def decode(self, name):
+        """Decoded pixels for name, ready to upload (safe to call from a worker thread)"""
+        name = self.base_name(name)
+        if name in self.pixels:
+            return Image.fromarray(self.pixels[name])
+        if self.open_image is not None:
+            im = self.open_image(name)
+            return prepare_image(im, display_size(im.size[0], im.size[1], self.display_scale or 1.0), self.grayscale)
+        if self.display_scale is None and self.grayscale == 'never':
+            return decode_image(self.files[name][1])
+        with Image.open(self.files[name][1]) as im:
+            return prepare_image(im, display_size(im.size[0], im.size[1], self.display_scale or 1.0), self.grayscale)
+
+    def _load(self, name, image=None):
+        num,fullPath = self.files[name]
+        if image is None:
+            as_file = self.display_scale is None and self.grayscale == 'never' and self.open_image is None
+            image = fullPath if as_file and name not in self.pixels else self.decode(name)
+        from psychopy import visual
+        #an 'L' image becomes a luminance texture (one byte per texel instead of four)
+        stim = visual.ImageStim(self.win, image=image, **self.stim_kwargs)
+        if self.display_scale is not None and not (isinstance(image, Image.Image) and image.size == self.display_size(name)):
+            stim.size = self.display_size(name)
+        (width,height) = (stim.size[0],stim.size[1])
+        mipmaps = self.mipmaps and generate_mipmaps(stim)
+        if isinstance(image, Image.Image):
+            channels = 1 if image.mode == 'L' else 4
+            nbytes = texture_nbytes(image.size[0], image.size[1], channels, mipmaps)
+        else:
+            channels = 4
+            nbytes = texture_bytes(fullPath)
+        entry = {'stim':stim,'fullPath':os.path.basename(fullPath),'filename':name,'num':num,'width':width,'height':height,
+            'channels':channels,'nbytes':nbytes}
+        self.entries[name] = entry
+        self.nbytes += nbytes
+        self.loads += 1
+        self._evict()
+        return entry
+
+    def display_size(self, name):
+        """On-screen size in pixels: the size of the cached pixels, or the source size scaled by display_scale"""
+        if name in self.variants:
+            from stimulus_variants import draw_params
+            scale = draw_params(self.variants[name][1])['scale']
+            width,height = self.display_size(self.base_name(name))
+            return (max(1,int(round(width*scale))), max(1,int(round(height*scale))))
+        if name in self.pixels:
+            return (self.pixels[name].shape[1],self.pixels[name].shape[0])
+        with Image.open(self.files[name][1]) as im:
+            return display_size(im.size[0], im.size[1], self.display_scale)
+
+    def memory_report(self):
+        """Texture bytes of every loaded stimulus, and of all of them, next to what its file would take uploaded at
+        full size as RGBA: {'stimuli':[{'name','channels','nbytes','full_rgba_bytes'}, ...],'nbytes','full_rgba_bytes'}"""
+        rows = [{'name':name,'channels':entry['channels'],'nbytes':entry['nbytes'],
+            'full_rgba_bytes':texture_bytes(self.files[name][1])} for name,entry in self.entries.items()]
+        return {'stimuli':rows,'nbytes':self.nbytes,'full_rgba_bytes':sum(row['full_rgba_bytes'] for row in rows)}
+
+    def _evict(self):
+        #always keep the most recently used entry, even if it alone is over the limit
+        while len(self.entries) > 1 and (
+            (self.max_entries is not None and len(self.entries) > self.max_entries) or
+            (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            name,entry = self.entries.popitem(last=False)
+            self.nbytes -= entry['nbytes']
+            self.evictions += 1
+
+def generate_mipmaps(stim):
+    """Build the mipmap chain of an ImageStim's texture and sample it trilinearly, so it stays smooth drawn smaller than
+    the texture. Returns False (and does nothing) without an OpenGL texture, e.g. under lab_utils.headless."""
+    tex_id = getattr(stim, '_texID', None)
+    if tex_id is None:
+        return False
+    try:
+        from pyglet import gl
+    except ImportError:
+        return False
+    gl.glBindTexture(gl.GL_TEXTURE_2D, tex_id)
+    gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+    return True
+
+def texture_bytes(image_path, channels=4):
+    """Estimate the texture memory for an image from its header (no decode)"""
+    with Image.open(image_path) as im:
+        (width,height) = im.size
+    return width*height*channels
+
+def load_files(directory,extension,fileType,win='',restriction='*',stim_list=[],lazy=True,max_entries=None,max_bytes=None,display_scale=None,cache_dir=None,cache=None,variants=None,grayscale='auto',mipmaps=False,store=None):
+    """ Load all the pics and sounds. Uses pyo or pygame for the sound library (see prefs.general['audioLib'])
+    Images are returned as a StimulusCache: with lazy=True each ImageStim is only built when it is first used
+    (or prefetched), and max_entries/max_bytes bound how many are kept around.
+    With cache_dir, images come from the memory-mapped, display-sized cache (rebuilt if any source file changed);
+    cache can instead be the (views, index) open_cache already returned, e.g. from a background thread.
+    variants ({name: (base, transform)} or the path of a variants file from stimulus_variants.py verify) are drawn
+    from their base stimulus instead of their own file.
+    grayscale and mipmaps set the texture format (see StimulusCache); files_data.memory_report() gives the texture bytes.
+    With a store (lab_utils.stimuli.StimulusStore), directory is a folder of logical names (e.g. 'images') rather than
+    a path, and images and sounds are decoded through the store's cache."""
     path = os.getcwd() #set path to current directory
-    if isinstance(extension,list):
+    prefix = directory.rstrip('/')+'/'
+    if store is not None:
+        import fnmatch
+        names = [name[len(prefix):] for name in store.find(prefix, extension)]
+        file_list = [(name,store.path(prefix+name)) for name in names if '/' not in name and fnmatch.fnmatch(name, restriction)]
+        if cache_dir is not None:
+            raise ValueError('cache_dir needs a directory of image files, not a stimulus store')
+    elif isinstance(extension,list):
         file_list = []
         for curExtension in extension:
             file_list.extend(glob.glob(os.path.join(path,directory,restriction+curExtension)))
     else:
         file_list = glob.glob(os.path.join(path,directory,restriction+extension))
-    files_data = {} #initialize files_data  as a dict because it'll be accessed by file names (picture names, sound names)
-    for num,curFile in enumerate(file_list):
-        fullPath = curFile
-        fullFileName = os.path.basename(fullPath)
-        stimFile = os.path.splitext(fullFileName)[0]
-        if fileType=="image":
-            try:
-                surface = pygame.image.load(fullPath) #gets height/width of the image
-                stim = visual.ImageStim(win, image=fullPath,mask=None,interpolate=True)
-                (width,height) = (surface.get_width(),surface.get_height())
-            except: #if no pygame, image dimensions may not be available
-                pass
-            stim = visual.ImageStim(win, image=fullPath,mask=None,interpolate=True)
-            (width,height) = (stim.size[0],stim.size[1])
-            files_data[stimFile] = {'stim':stim,'fullPath':fullFileName,'filename':stimFile,'num':num,'width':width, 'height':height}
-        elif fileType=="sound":
-            files_data[stimFile] = {'stim':sound.Sound(fullPath), 'duration':sound.Sound(fullPath).getDuration()}
+    if fileType=="image":
+        pixels = None
+        if cache is not None:
+            pixels,index = cache
+        elif cache_dir is not None:
+            pixels,index = open_cache(cache_dir, os.path.join(path,directory), extension=extension, scale=display_scale or 1.0,
+                grayscale=grayscale)
+        if isinstance(variants,str):
+            from stimulus_variants import read_variants
+            variants = read_variants(variants)
+        files_data = StimulusCache(win,file_list,max_entries=max_entries,max_bytes=max_bytes,pixels=pixels,display_scale=display_scale,
+            variants=variants,grayscale=grayscale,mipmaps=mipmaps,
+            open_image=(lambda name: store.image(prefix+name)) if store is not None else None)
+        if not lazy:
+            files_data.prefetch(files_data.keys())
+    else:
+        from psychopy import sound
+        files_data = {} #initialize files_data  as a dict because it'll be accessed by file names (picture names, sound names)
+        for num,curFile in enumerate(file_list):
+            if store is not None:
+                stimFile,fullPath = curFile
+            else:
+                fullPath = curFile
+                fullFileName = os.path.basename(fullPath)
+                stimFile = os.path.splitext(fullFileName)[0]
+            if fileType=="sound" and store is not None:
+                samples,rate = store.pcm(prefix+stimFile)
+                cur_sound = sound.Sound(value=np.asarray(samples), sampleRate=rate, stereo=samples.shape[1] == 2)
+                files_data[stimFile] = {'stim':cur_sound, 'duration':len(samples)/float(rate)}
+            elif fileType=="sound":
+                cur_sound = sound.Sound(fullPath)
+                files_data[stimFile] = {'stim':cur_sound, 'duration':cur_sound.getDuration()}
  
     #optionally check that the stimuli we *need* to load are actually available in the directory; return error if there is a discrepancy
     if stim_list and set(files_data.keys()).intersection(stim_list) != set(stim_list):
-        popupError(str(set(stim_list).difference(list(files_data.keys()))) + " does not exist in " + path+'\\'+directory) 
+        popupError(str(set(stim_list).difference(list(files_data.keys()))) + " does not exist in " + os.path.join(path,directory))
     return files_data
 
+def popupError(text):
+    from psychopy import gui, core
+    errorDlg = gui.Dlg(title="Error")
+    errorDlg.addText('Error: '+text, color='Red')
+    errorDlg.show()
+    core.quit()
+
 
 #get keyboard response
-def get_keyboard_response(validResponses,duration=0):
-    event.clearEvents()
-    responded = False
-    done = False
-    rt = '*'
-    responseTimer = core.Clock()
-    while True: 
-        if not responded:
-            responded = event.getKeys(keyList=validResponses, timeStamped=responseTimer) 
-        if duration>0:
-            if responseTimer.getTime() > duration:
-                break
-        else: #end on response
-            if responded:
-                break
-    if not responded:
+def get_keyboard_response(validResponses,duration=0,max_keys=1,key_source=None,poll_interval=None):
+    """Wait for a key from validResponses and return [key, rt] (rt in s), or ['NA','NA'] if nothing was pressed.
+    With max_keys>1 returns the list of [key, rt] instead. Sleeps between polls rather than spinning;
+    key_source defaults to the hardware-timestamped keyboard when psychtoolbox is available (see lab_utils/key_response.py)."""
+    if key_source is None:
+        key_source = default_key_source()
+    responses = collect_keys(key_source,validResponses,duration=duration,max_keys=max_keys,poll_interval=poll_interval)
+    if max_keys > 1:
+        return responses
+    if not responses:
         return ['NA','NA']
     else:
-        return responded[0] #only get the first resp
+        return responses[0] #only get the first resp
     
 #write to file
 def write_to_file(fileHandle,trial,separator=',', sync=True,add_newline=False):
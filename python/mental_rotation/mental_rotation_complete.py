@@ -1,28 +1,81 @@
-from psychopy import visual, event, core, sound, gui # import the bits of PsychoPy we'll need for this walkthrough
 import os
-from generate_trials import generate_trials
-from helper import get_runtime_vars, import_trials, load_files, get_keyboard_response
-#generate trials
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.launcher import Preloader
+from lab_utils.audio import FeedbackSounds, decode_sounds
+from lab_utils.stimuli import StimulusStore
+from build_stimulus_cache import open_cache
+
+#the slow file work of the launch (opening the image cache, decoding the feedback sounds) starts in the background
+#right away and runs while the runtime-vars dialog is up; psychopy's window and sound modules, the window and the
+#sound output are made on the main thread. preload.report() at the end shows the timeline
+preload = Preloader()
 
-#open a window
-win = visual.Window([800,800],color="grey", units='pix', checkTiming=False) 
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+print(cur_dir)
+#images are drawn at half their stored size; they come pre-scaled from the stimulus cache (see build_stimulus_cache.py),
+#and since they only hold gray, as single channel (luminance) textures
+image_scale = 0.5
+preload.submit('image cache', open_cache, os.path.join(cur_dir,"stimuli","cache"), os.path.join(cur_dir,"stimuli","images"),
+    extension='.jpg', scale=image_scale)
+
+# add audio feedback: both sounds are decoded once (here, in the background) and played through an output stream that
+# stays open (opened below, on the main thread); they are looked up by name in the shared stimulus store (see
+# lab_utils/stimuli.py), whose decoded copies every task reuses
+stimulus_store = StimulusStore()
+feedback_sound_paths = {'correct':'sounds/bleep','incorrect':'sounds/buzz'}
+preload.submit('decode feedback sounds', decode_sounds, feedback_sound_paths, store=stimulus_store)
+
+from generate_trials import generate_trials, find_trial_list
+from helper import get_runtime_vars, import_trials, load_files
 
 #get runtime variables
 order =  ['subj_code','seed','test_mode']
-runtime_vars= get_runtime_vars({'subj_code':'mr_101', 'seed':10, 'test_mode':['Choose', 'practice','real']}, order)
+with preload.step('runtime-vars dialog'):
+    runtime_vars= get_runtime_vars({'subj_code':'mr_101', 'seed':10, 'test_mode':['Choose', 'practice','real']}, order)
 print(runtime_vars)
 
-# generate trials
-generate_trials(runtime_vars['subj_code'],runtime_vars['seed'],runtime_vars['test_mode'])
+with preload.step('import psychopy'):
+    from psychopy import visual, event, core # import the bits of PsychoPy we'll need for this walkthrough
+from lab_utils.frame_timing import FlipRecorder
+from lab_utils.timeline import Timeline, Phase
+from lab_utils.key_response import default_key_source
+from prefetch import TrialPrefetcher
+from lab_utils.data_writer import DataWriter
+from session_data import open_trial_log, compact_trial_log
+from lab_utils.results import ResultsClient
+from checkpoint import SessionJournal
+
+#open a window (this has to happen on the main thread)
+with preload.step('window'):
+    win = visual.Window([800,800],color="grey", units='pix', checkTiming=False) 
+    #timestamp every flip, tagged with the trial and phase it belongs to (see lab_utils/frame_timing.py)
+    flip_recorder = FlipRecorder(win).install()
+
+#a session that crashed or was quit part-way carries on where it stopped: its journal (see checkpoint.py) names the
+#trial list it was using, so the list is not generated again
+if not os.path.isdir(os.path.join(os.getcwd(),'data')):
+    os.makedirs(os.path.join(os.getcwd(),'data'))
+journal = SessionJournal(os.path.join(os.getcwd(),'data',runtime_vars['subj_code']+'_session.journal'))
+
+# use the pre-generated trial list (python generate_trials.py --manifest cohort.csv) if there is one, otherwise generate it now
+with preload.step('trial list'):
+    trial_path = journal.trial_path() or find_trial_list(runtime_vars['subj_code'],runtime_vars['seed'],runtime_vars['test_mode'])
+    if trial_path is None:
+        trial_path = generate_trials(runtime_vars['subj_code'],runtime_vars['seed'],runtime_vars['test_mode'])
 
 #positions
 positions = {"center": (0,0)}
 separator=","
 
-#preload
-cur_dir = os.path.dirname(os.path.abspath(__file__))
-print(cur_dir)
-images_dictionary = load_files(os.path.join(cur_dir,"stimuli","images"),'.jpg',fileType="image",win=win)
+#images are loaded lazily; keep at most this many textures around (least recently used ones are dropped)
+max_cached_images = 150
+#stimuli that stimulus_variants.py verified to be transforms of another one (if any) are drawn from that one's texture
+images_dictionary = load_files(os.path.join(cur_dir,"stimuli","images"),'.jpg',fileType="image",win=win,max_entries=max_cached_images,
+    display_scale=image_scale,cache=preload.result('image cache'),variants=os.path.join(cur_dir,"stimuli","variants.json"))
+preload.result('decode feedback sounds')
+with preload.step('feedback sounds output'):
+    feedback_sounds = FeedbackSounds(feedback_sound_paths, store=stimulus_store)
 
 #add feedback
 correct_feedback = visual.TextStim(win, text = "Correct!",color="white", height=30, pos = (0,0))
@@ -32,104 +85,160 @@ incorrect_feedback = visual.TextStim(win, text = "Incorrect.",color="white", hei
 fixation_cross = visual.TextStim(win, text = "+",color="black", height=40, pos = (0,0))
 fixation_cross_duration = .3
 
-# add audio feedback
-correct_feedback_sound_path = os.path.join(os.getcwd(),"stimuli","sounds","bleep.wav")
-correct_feedback_sound = sound.Sound(correct_feedback_sound_path)
-incorrect_feedback_sound_path = os.path.join(os.getcwd(),"stimuli","sounds","buzz.wav")
-incorrect_feedback_sound = sound.Sound(incorrect_feedback_sound_path)
-
 #read in trials
-trial_path = os.path.join(os.getcwd(),'trials',runtime_vars['subj_code']+'_trials.csv')
 trial_list = import_trials(trial_path)
+print(preload.report())
+preload.shutdown()
+
+#decode the upcoming trials' images in the background; the trial loop only uploads them
+prefetcher = TrialPrefetcher(trial_list, images_dictionary.decode, lookahead=5, cache=images_dictionary).start()
+
+#on a station run by orchestrator.py (LAB_RESULTS is set) every trial also goes to the lab's results aggregator, and a
+#restarted session does not carry on past the last trial the aggregator has
+results = ResultsClient.from_env(subj_code=runtime_vars['subj_code'])
+aggregator_next = None
+if results is not None:
+    last_trial = results.last_trial()
+    if last_trial is None:
+        print('results aggregator not reachable, trials are kept until it is')
+    else:
+        aggregator_next = last_trial+1
+
+data_path = os.path.join(os.getcwd(),'data',runtime_vars['subj_code']+'_data.csv')
+trial_log_path = os.path.join(os.getcwd(),'data',runtime_vars['subj_code']+'_data.trlog')
+session_info = {'subj_code':runtime_vars['subj_code'],'seed':runtime_vars['seed'],'trial_path':os.path.abspath(trial_path),
+    'num_trials':len(trial_list)}
+first_trial = journal.recover(session_info, data_path, trial_log_path, before_trial=aggregator_next)
+#no local files to carry on from (e.g. a different station), but the aggregator already has the first trials
+if first_trial == 0 and aggregator_next:
+    first_trial = aggregator_next
+#relaunching a session that has already run every trial leaves its files alone
+if first_trial >= len(trial_list):
+    print('%s has already completed all %d trials, nothing to run (use a new subj_code for a new session)' % (
+        runtime_vars['subj_code'], len(trial_list)))
+    prefetcher.stop()
+    feedback_sounds.close()
+    if results is not None:
+        results.close()
+    journal.close()
+    win.close()
+    core.quit()
+resuming = journal.rows > 0 #the data files hold earlier trials of this session
+if first_trial:
+    print('resuming at trial %d of %d' % (first_trial, len(trial_list)))
+if results is not None:
+    results.event('resume' if first_trial else 'start', first_trial)
 
 #open file to write data to and store a header
-data_file = open(os.path.join(os.getcwd(),'data',runtime_vars['subj_code']+'_data.csv'),'w')
-header = separator.join(["subj_code","seed", 'image_name','item','angle','match','correct_response','response','rt'])
-data_file.write(header+'\n')
+#rows are written in the background and only fsync'ed at checkpoints (every ITI), not inside the trial
+#the trial's own columns come first, in the trial list's order, because that is how record_trial writes them
+header = list(trial_list.names)+['response','rt']
+#achieved phase durations and lost frames from the flip recorder
+timing_columns = ['fixation_ms','stimulus_ms','feedback_ms','dropped_frames','late_frames','av_asynchrony_ms']
+header.extend(timing_columns)
+#a resumed session appends to its files, which the journal has already cut back to the last complete trial
+data_file = DataWriter(data_path,header=None if resuming else header,separator=separator,mode='a' if resuming else 'w')
+#typed copy of the same columns: a binary log during the session, turned into a parquet file at the end
+if os.path.exists(trial_log_path) and not resuming:
+    os.remove(trial_log_path)
+trial_log = open_trial_log(trial_log_path)
 
 #show instructions
 instruction_text = "Welcome to the experiment!\n\nPress the space bar to continue."
 instruction = visual.TextStim(win, text = instruction_text,color="white", height=30, pos = (0,0))
 instruction.draw()
+flip_recorder.mark('instructions')
 win.flip()
 #wait for the space key
 event.waitKeys(keyList=['space'])
+flip_recorder.mark('blank', duration=.5)
 win.flip()
 core.wait(.5)
 
-# trial loop
-responseTimer = core.Clock()
-for cur_trial in trial_list:
-
-    #define current image
-    cur_image_name = cur_trial['image_name']
-    cur_image = images_dictionary[cur_image_name]['stim']
-
-    #set size
-    print(cur_image.size)
-    cur_image.size = cur_image.size * 0.5
-    #cur_image.size = [400,214]
-    
-    #draw fixation cross
-    fixation_cross.draw()
-    
-    #show
-    win.flip()
-    core.wait(fixation_cross_duration)
-    
-    #draw image
-    cur_image.draw()
-    
-    #show
-    win.flip()
-
-    #wait until the participant presses one of the keys from the key list
-    event.clearEvents()
-    responseTimer.reset()
-    key_pressed = event.waitKeys(keyList=['z','m'],timeStamped=responseTimer)
-    #once they press one of those keys, print it out and flip the window (why?)
-    if key_pressed:
-        print(key_pressed)
-        response=key_pressed[0][0]
-        rt = key_pressed[0][1]*1000
-        win.flip()
-
-    # present feedback
-    cur_correct_response = cur_trial['correct_response']
-    if response == cur_correct_response:
-        #correct
-        correct_feedback.draw()
-        win.flip()
-        correct_feedback_sound.play() 
-        core.wait(0.3)
-        correct_feedback_sound.stop() 
-    else:
-        #incorrect
-        incorrect_feedback.draw()
-        
-        win.flip()
-        incorrect_feedback_sound.play()
-        core.wait(0.3)
-        incorrect_feedback_sound.stop() 
-    
+# each trial is a timeline of phases shown for a counted number of frames (see lab_utils/timeline.py);
+# between flips the timeline runs small jobs like uploading the next images and writing the last trial's data
+def start_fixation(trial):
+    prefetcher.advance(trial['trial_num'])
+    #upload whatever the prefetcher has decoded while the fixation cross is up
+    timeline.add_task(prefetcher.upload_ready)
+
+def show_image(trial):
+    return [prefetcher.stim(trial['trial']['image_name'])['stim']]
+
+def start_feedback(trial):
+    #the rt comes from the key's timestamp relative to the image's onset flip
+    trial['rt'] = trial['rt']*1000
+    print([trial['response'],trial['rt']])
+    trial['correct'] = trial['response'] == trial['trial']['correct_response']
+    #start the sound on the same flip as the feedback text
+    trial['feedback_sound'] = feedback_sounds.play_on_flip('correct' if trial['correct'] else 'incorrect', win)
+
+def show_feedback(trial):
+    return [correct_feedback if trial['correct'] else incorrect_feedback]
+
+def stop_feedback(trial):
+    feedback_sounds.stop()
+
+def start_iti(trial):
+    #the feedback phase has ended by the time the ITI is up, so all of its timing is known
+    timeline.add_task(record_trial, trial)
+
+def record_trial(trial):
+    cur_trial = trial['trial']
+    timing = flip_recorder.trial_timing(trial['trial_num'], ['fixation','stimulus','feedback'])
+    #audio onset - visual onset of the feedback (NA if the sound output can't measure it)
+    asynchrony = feedback_sounds.asynchrony_ms(trial['feedback_sound'])
+    timing['av_asynchrony_ms'] = 'NA' if asynchrony is None else round(asynchrony, 3)
     #writing a response
-    print([_ for _ in cur_trial])
     response_list=[cur_trial[_] for _ in cur_trial]
-    print(response_list)
 	#write dep variables
     response_list.extend([
-			response,rt])
-    responses = map(str,response_list)
+			trial['response'],trial['rt']])
+    response_list.extend([timing[_] for _ in timing_columns])
     print(response_list)
-    line = separator.join([str(i) for i in response_list])
-    data_file.write(line+'\n')
-    
-    #trial-end wait seconds
-    core.wait(0.5)
-    
-    win.flip()
+    data_file.write(response_list)
+    record = dict(cur_trial,response=trial['response'],rt=trial['rt'],**timing)
+    trial_log.write(record)
+    journal.commit(trial['trial_num'])
+    if results is not None:
+        results.send(trial['trial_num'], record)
+    #make the data written so far durable while the ITI is up
+    data_file.checkpoint()
+    trial_log.checkpoint()
+
+timeline = Timeline(win, [
+    Phase('fixation', duration=fixation_cross_duration, stims=[fixation_cross], on_start=start_fixation),
+    #wait until the participant presses one of the keys from the key list
+    Phase('stimulus', stims=show_image, keys=['z','m'], key_source=default_key_source()),
+    Phase('feedback', duration=0.3, stims=show_feedback, on_start=start_feedback, on_end=stop_feedback),
+    Phase('iti', duration=0.5, on_start=start_iti),
+], recorder=flip_recorder)
 
+# trial loop
+prefetcher.advance(first_trial)
+for trial_num in range(first_trial, len(trial_list)):
+    timeline.run({'trial':trial_list[trial_num],'trial_num':trial_num}, trial_num)
+
+#the last ITI ends with a blank flip; then any jobs still queued are finished
+win.flip()
+timeline.flush()
+prefetcher.stop()
+print(prefetcher.summary())
+print("%d textures uploaded (%d evicted) for %d stimuli" % (images_dictionary.loads, images_dictionary.evictions, len(images_dictionary)))
+texture_memory = images_dictionary.memory_report()
+print("texture memory %.1f MB for %d loaded stimuli (%.1f MB as full size RGBA)" % (texture_memory['nbytes']/1e6,
+    len(texture_memory['stimuli']), texture_memory['full_rgba_bytes']/1e6))
+print(flip_recorder.summary())
+print(timeline.summary())
+print(feedback_sounds.summary())
+feedback_sounds.close()
+if results is not None:
+    results.event('end', len(trial_list))
+    results.close()
 data_file.close()
+trial_log.close()
+journal.close()
+compact_trial_log(trial_log_path)
 win.close() #close the window
 core.quit() #quit out of the program
 
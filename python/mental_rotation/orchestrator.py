@@ -0,0 +1,242 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.results import ResultsClient, ResultsStore
+from generate_trials import read_manifest, generate_trials, find_trial_list
+from build_stimulus_cache import open_cache
+
+## Running a cohort on many stations at once, with every trial collected in one place:
+##
+##   python -m lab_utils.results serve --db results.db --port 5555                      #on the results machine
+##   python orchestrator.py assign cohort.csv --stations 8 --out assignments.csv        #subjects (and seeds) per station
+##   python orchestrator.py station assignments.csv --name station_3 --results host:5555 #on each station
+##   python orchestrator.py export results.db --out all_trials.csv                      #one CSV for the whole cohort
+##
+## A station runs its subjects one after another. Each session streams its trials to the aggregator (see
+## lab_utils/results.py); if the session crashes or the station drops off the network, the station starts it again
+## and it resumes after the last trial the aggregator has. `test` tries all of this on one machine with headless
+## sessions as separate processes, killing stations and the aggregator part-way through.
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+script = os.path.join(cur_dir, 'mental_rotation_complete.py')
+
+def assign(subjects, stations):
+    """Deal subjects out to stations round-robin; returns the rows of the assignment table"""
+    if isinstance(stations, int):
+        stations = ['station_%d' % (num+1) for num in range(stations)]
+    return [dict(subject, station=stations[num % len(stations)], order=num // len(stations))
+        for num,subject in enumerate(subjects)]
+
+def write_assignments(rows, path):
+    columns = ['station','order','subj_code','seed','test_mode']
+    with open(path, 'w', newline='') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+def read_assignments(path, station=None):
+    with open(path, 'r', newline='') as in_file:
+        rows = [row for row in csv.DictReader(in_file) if station is None or row['station'] == station]
+    return sorted(rows, key=lambda row: int(row['order']))
+
+def session_command(headless=False, max_time=None):
+    """Command line for one session (run from the python/ directory)"""
+    if not headless:
+        return [sys.executable, script]
+    command = [sys.executable, '-m', 'lab_utils.headless', script]
+    if max_time is not None:
+        command.extend(['--max-time', str(max_time)])
+    return command
+
+def num_trials(trial_path):
+    with open(trial_path, 'r') as trial_file:
+        return sum(1 for line in trial_file)-1
+
+def run_subject(subject, results_address, station, headless=False, retries=5, max_time=None, log=None, trials_dir=None):
+    """Run one subject's session, restarting it (it resumes) until the aggregator has every trial.
+    Trial lists are kept in trials_dir (default: generate_trials.py's). Returns the number of launches it took."""
+    trial_path = find_trial_list(subject['subj_code'], int(subject['seed']), subject['test_mode'], trials_dir)
+    if trial_path is None:
+        trial_path = generate_trials(subject['subj_code'], int(subject['seed']), subject['test_mode'], trials_dir)
+    total = num_trials(trial_path)
+    client = ResultsClient(results_address, station=station, subj_code=subject['subj_code'])
+    env = dict(os.environ, LAB_RESULTS=results_address, LAB_STATION=station,
+        LAB_RUNTIME_VARS=json.dumps({'subj_code':subject['subj_code'],'seed':int(subject['seed']),'test_mode':subject['test_mode']}))
+    if trials_dir is not None:
+        env['LAB_TRIALS_DIR'] = os.path.abspath(trials_dir)
+    launches = 0
+    try:
+        while True:
+            last_trial = client.last_trial()
+            if last_trial is not None and last_trial+1 >= total:
+                return launches
+            if launches > retries:
+                raise RuntimeError('%s: gave up after %d launches (aggregator has %s of %d trials)' % (subject['subj_code'],
+                    launches, 'none' if last_trial is None else last_trial+1, total))
+            if last_trial is None:
+                #no aggregator: wait for it rather than run trials that might not be collected
+                time.sleep(1)
+                continue
+            launches += 1
+            subprocess.run(session_command(headless, max_time), cwd=os.path.dirname(cur_dir), env=env,
+                stdout=log, stderr=subprocess.STDOUT if log is not None else None)
+    finally:
+        client.close()
+
+def run_station(assignments_path, name, results_address, headless=False, retries=5, max_time=None, log=None,
+        trials_dir=None):
+    #make sure the image cache is built once here, not by each session
+    open_cache(os.path.join(cur_dir,'stimuli','cache'), os.path.join(cur_dir,'stimuli','images'), extension='.jpg', scale=0.5)
+    for subject in read_assignments(assignments_path, name):
+        launches = run_subject(subject, results_address, name, headless, retries, max_time, log, trials_dir)
+        print('%s: %s done (%d launch%s)' % (name, subject['subj_code'], launches, '' if launches == 1 else 'es'), flush=True)
+
+def export(db_path, out_path):
+    """Write every trial in the results db to one CSV (subj_code and trial_num first, then the record's columns)"""
+    rows = ResultsStore(db_path).trials()
+    columns = []
+    for row in rows:
+        columns.extend([name for name in row[3] if name not in columns])
+    with open(out_path, 'w', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(['station','trial_num']+columns)
+        for subj_code,trial_num,station,record in rows:
+            writer.writerow([station,trial_num]+[record.get(name,'NA') for name in columns])
+    return len(rows)
+
+#---- local test
+
+def start_aggregator(db_path, port=0):
+    """Aggregator in its own process; returns (process, 'host:port')"""
+    process = subprocess.Popen([sys.executable, '-m', 'lab_utils.results', 'serve', '--db', db_path, '--port', str(port)],
+        cwd=os.path.dirname(cur_dir), stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith('listening on '):
+        process.kill()
+        raise RuntimeError('aggregator did not start: %r' % line)
+    return process, line.split()[-1]
+
+def local_test(num_stations=3, subjects_per_station=2, kill_after=15, work_dir=None):
+    """Several stations (separate processes, each running headless sessions) against one aggregator. One session is
+    killed part-way (on Linux), the aggregator is restarted mid-run, and every subject must end up with each trial exactly
+    once. The results db, assignments, logs and trial lists go in work_dir (a new temporary directory by default)."""
+    work_dir = work_dir or tempfile.mkdtemp(prefix='orchestrator_test_')
+    db_path = os.path.join(work_dir, 'results.db')
+    trials_dir = os.path.join(work_dir, 'trials')
+    os.makedirs(trials_dir, exist_ok=True)
+    subjects = [{'subj_code':'orch_%02d' % num,'seed':str(100+num),'test_mode':'practice'}
+        for num in range(num_stations*subjects_per_station)]
+    assignments_path = write_assignments(assign(subjects, num_stations), os.path.join(work_dir, 'assignments.csv'))
+    aggregator,address = start_aggregator(db_path)
+    port = address.rsplit(':',1)[1]
+    stations = []
+    start = time.perf_counter()
+    for num in range(num_stations):
+        log = open(os.path.join(work_dir, 'station_%d.log' % (num+1)), 'w')
+        stations.append((subprocess.Popen([sys.executable, os.path.abspath(__file__), 'station', assignments_path,
+            '--name', 'station_%d' % (num+1), '--results', address, '--headless', '--trials', trials_dir],
+            cwd=cur_dir, stdout=log, stderr=subprocess.STDOUT), log))
+    #crash a session: kill the first subject's session process (not its station) once a few trials are in
+    store = ResultsStore(db_path)
+    killed = restarted = False
+    can_kill = os.path.isdir('/proc')
+    if not can_kill:
+        print('no /proc on this system, so no session is killed (the aggregator is still restarted)')
+    while any(process.poll() is None for process,log in stations):
+        if can_kill and not killed and store.last_trial(subjects[0]['subj_code']) >= kill_after:
+            killed = _kill_session(subjects[0]['subj_code'])
+        if (killed or not can_kill) and not restarted and store.last_trial(subjects[1]['subj_code']) >= kill_after:
+            #the aggregator goes away for a moment; stations keep their trials until it is back
+            aggregator.kill()
+            aggregator.wait()
+            time.sleep(1)
+            aggregator,address = start_aggregator(db_path, port)
+            restarted = True
+        time.sleep(.05)
+    wall = time.perf_counter()-start
+    aggregator.terminate()
+    aggregator.wait()
+    for process,log in stations:
+        log.close()
+    #check: every trial of every subject exactly once, in order
+    problems = []
+    for subject in subjects:
+        expected = num_trials(find_trial_list(subject['subj_code'], int(subject['seed']), subject['test_mode'], trials_dir))
+        trial_nums = [row[1] for row in store.trials(subject['subj_code'])]
+        if trial_nums != list(range(expected)):
+            problems.append('%s: %d of %d trials' % (subject['subj_code'], len(trial_nums), expected))
+    events = store.connection.execute("SELECT subj_code, first_trial FROM sessions WHERE event='resume'").fetchall()
+    store.close()
+    print('%d stations, %d subjects, %.1f s; session killed: %s, aggregator restarted: %s' % (num_stations, len(subjects),
+        wall, killed, restarted))
+    print('resumed sessions: %s' % (', '.join('%s at trial %d' % event for event in events) or 'none'))
+    print('station exit codes: %s' % [process.returncode for process,log in stations])
+    print('OK: every trial collected exactly once' if not problems else 'PROBLEMS:\n    '+'\n    '.join(problems))
+    print('files in ' + work_dir)
+    for subject in subjects:
+        for name in ('_data.csv','_data.trlog','_data.parquet','_session.journal'):
+            path = os.path.join(cur_dir, 'data', subject['subj_code']+name)
+            if os.path.exists(path):
+                os.remove(path)
+    return not problems
+
+def _kill_session(subj_code):
+    """Kill the session process running subj_code, found through its environment in /proc. Linux only: the session
+    is started by a station process, so the test has no handle on it."""
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', pid, 'environ'), 'rb') as environ_file:
+                environ = environ_file.read()
+        except OSError:
+            continue
+        if b'"subj_code": "%s"' % subj_code.encode() in environ and b'lab_utils.headless' in open(os.path.join('/proc', pid, 'cmdline'), 'rb').read():
+            os.kill(int(pid), 9)
+            return True
+    return False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a mental rotation cohort across several stations')
+    commands = parser.add_subparsers(dest='command')
+    assign_parser = commands.add_parser('assign', help='assign the subjects in a cohort manifest to stations')
+    assign_parser.add_argument('manifest')
+    assign_parser.add_argument('--stations', required=True, help='how many, or a comma-separated list of names')
+    assign_parser.add_argument('--out', default='assignments.csv')
+    assign_parser.add_argument('--study-seed', type=int, default=0)
+    station_parser = commands.add_parser('station', help="run this station's subjects")
+    station_parser.add_argument('assignments')
+    station_parser.add_argument('--name', required=True)
+    station_parser.add_argument('--results', required=True, help='host:port of the aggregator')
+    station_parser.add_argument('--retries', type=int, default=5, help='relaunches of a session before giving up')
+    station_parser.add_argument('--headless', action='store_true', help='simulated participant (lab_utils.headless)')
+    station_parser.add_argument('--max-time', type=float, default=None, help='virtual seconds per headless launch')
+    station_parser.add_argument('--log', help="append the sessions' output here")
+    station_parser.add_argument('--trials', help='directory for the trial lists (default: mental_rotation/trials)')
+    export_parser = commands.add_parser('export', help='write the results db as one CSV')
+    export_parser.add_argument('db')
+    export_parser.add_argument('--out', default='all_trials.csv')
+    test_parser = commands.add_parser('test', help='several headless stations and an aggregator on this machine')
+    test_parser.add_argument('--stations', type=int, default=3)
+    test_parser.add_argument('--subjects', type=int, default=2, help='per station')
+    test_parser.add_argument('--kill-after', type=int, default=15, help='trial after which a session is killed')
+    args = parser.parse_args()
+    if args.command == 'assign':
+        stations = int(args.stations) if args.stations.isdigit() else args.stations.split(',')
+        print(write_assignments(assign(read_manifest(args.manifest, args.study_seed), stations), args.out))
+    elif args.command == 'station':
+        log = open(args.log, 'a') if args.log else None
+        run_station(args.assignments, args.name, args.results, args.headless, args.retries, args.max_time, log, args.trials)
+    elif args.command == 'export':
+        print('%d trials written to %s' % (export(args.db, args.out), args.out))
+    elif args.command == 'test':
+        sys.exit(0 if local_test(args.stations, args.subjects, args.kill_after) else 1)
+    else:
+        parser.print_help()
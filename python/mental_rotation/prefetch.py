@@ -0,0 +1,140 @@
+import os
+import sys
+import csv
+import time
+import threading
+from PIL import Image
+
+def decode_image(path):
+    """Fully decode an image file into memory (convert() forces the pixel data to be read)"""
+    with Image.open(path) as im:
+        return im.convert('RGB')
+
+class TrialPrefetcher(object):
+    """Decodes the images for the next few trials on a worker thread.
+    The worker walks the trial list at most `lookahead` trials ahead of the current trial and keeps at most
+    `max_buffered` decoded images waiting; the main thread only uploads them (upload_ready / stim).
+    decode maps an image name to its decoded pixels (e.g. StimulusCache.decode)."""
+    def __init__(self, trial_list, decode, lookahead=5, max_buffered=None, cache=None, name_col='image_name'):
+        self.names = [cur_trial[name_col] for cur_trial in trial_list]
+        self.decode = decode
+        self.lookahead = lookahead
+        self.max_buffered = max_buffered or lookahead
+        self.cache = cache
+        self.cur_index = 0
+        self.buffer = {} #decoded but not yet uploaded
+        self.in_progress = None
+        self.decode_times = [] #(image name, seconds spent decoding), one per decode
+        self.wait_times = [] #seconds the main thread had to wait per take()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.worker = threading.Thread(target=self._run, name='image-prefetch', daemon=True)
+
+    def start(self):
+        self.worker.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.worker.join()
+
+    def advance(self, trial_index):
+        """Tell the worker which trial is about to be shown"""
+        with self.condition:
+            self.cur_index = trial_index
+            self.condition.notify_all()
+
+    def _is_needed(self, name):
+        #whether it is buffered or uploaded *now*: an image the cache has since evicted has to be decoded again
+        if name in self.buffer:
+            return False
+        return self.cache is None or not self.cache.is_loaded(name)
+
+    def _run(self):
+        next_index = 0
+        while True:
+            with self.condition:
+                while not self.stopped and next_index < len(self.names) and (
+                        next_index > self.cur_index + self.lookahead or len(self.buffer) >= self.max_buffered):
+                    self.condition.wait()
+                if self.stopped or next_index >= len(self.names):
+                    return
+                next_index = max(next_index, self.cur_index)
+                name = self.names[next_index]
+                next_index += 1
+                if not self._is_needed(name):
+                    continue
+                self.in_progress = name
+            start = time.perf_counter()
+            image = self.decode(name)
+            decode_time = time.perf_counter() - start
+            with self.condition:
+                self.buffer[name] = image
+                self.decode_times.append((name, decode_time))
+                self.in_progress = None
+                self.condition.notify_all()
+
+    def take(self, name):
+        """Return the decoded image for name, waiting for the worker if it is decoding it right now
+        (or decoding it here if the worker has not got to it)"""
+        start = time.perf_counter()
+        with self.condition:
+            while self.in_progress == name:
+                self.condition.wait()
+            image = self.buffer.pop(name, None)
+            self.condition.notify_all()
+        if image is None:
+            image = self.decode(name)
+            self.decode_times.append((name, time.perf_counter() - start))
+        self.wait_times.append(time.perf_counter() - start)
+        return image
+
+    def upload_ready(self):
+        """Upload everything that has been decoded so far into the stimulus cache (main thread only)"""
+        with self.condition:
+            ready = list(self.buffer.keys())
+        for name in ready:
+            self.cache.add(name, self.take(name))
+        return len(ready)
+
+    def stim(self, name):
+        """Get the cache entry for name, uploading it first if needed"""
+        if not self.cache.is_loaded(name):
+            self.cache.add(name, self.take(name))
+        return self.cache[name]
+
+    def summary(self):
+        decode_ms = [t*1000 for _,t in self.decode_times]
+        wait_ms = [t*1000 for t in self.wait_times]
+        stalls = [t for t in wait_ms if t > 1]
+        return {'decoded':len(decode_ms),'redecoded':len(decode_ms)-len(set(name for name,_ in self.decode_times)),
+            'mean_decode_ms':sum(decode_ms)/len(decode_ms) if decode_ms else 0,
+            'max_decode_ms':max(decode_ms) if decode_ms else 0,
+            'stalls':len(stalls),
+            'mean_stall_ms':sum(stalls)/len(stalls) if stalls else 0,
+            'max_wait_ms':max(wait_ms) if wait_ms else 0}
+
+def headless_test(trial_path, image_dir, fixation_cross_duration=.3, lookahead=5, extension='.jpg'):
+    """Run through a trial list without a window: each trial waits out the fixation period and then takes its image,
+    so any time spent waiting for the decoder is latency the fixation did *not* hide."""
+    with open(trial_path, 'r') as trial_file:
+        trial_list = list(csv.DictReader(trial_file))
+    decode = lambda name: decode_image(os.path.join(image_dir,name+extension))
+    prefetcher = TrialPrefetcher(trial_list, decode, lookahead=lookahead).start()
+    for trial_num,cur_trial in enumerate(trial_list):
+        prefetcher.advance(trial_num)
+        time.sleep(fixation_cross_duration) #fixation cross is on screen
+        prefetcher.take(cur_trial['image_name'])
+    prefetcher.stop()
+    summary = prefetcher.summary()
+    summary['trials'] = len(trial_list)
+    return summary
+
+if __name__ == '__main__':
+    #usage: python prefetch.py trials/<subj_code>_trials.csv [fixation duration in s]
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    trial_path = sys.argv[1]
+    fixation_cross_duration = float(sys.argv[2]) if len(sys.argv) > 2 else .3
+    print(headless_test(trial_path, os.path.join(cur_dir,"stimuli","images"), fixation_cross_duration))
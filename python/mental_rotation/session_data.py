@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import struct
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.data_writer import DataWriter
+from trial_source import coerce
+
+## Typed session output: an append-only binary record log written during the session (through a DataWriter),
+## compacted into a Parquet file at the end. Load a whole study in R with arrow::open_dataset("data") or in
+## python with pyarrow.parquet.read_table("data").
+
+#column name, type: 'int', 'float' or 'str'
+DATA_SCHEMA = [('subj_code','str'),('seed','int'),('test_mode','str'),('image_name','str'),('item','int'),('angle','int'),
+    ('match','str'),('correct_response','str'),('response','str'),('rt','float'),
+    ('fixation_ms','float'),('stimulus_ms','float'),('feedback_ms','float'),('dropped_frames','int'),('late_frames','int'),
+    ('av_asynchrony_ms','float')]
+
+MAGIC = b'TRIALLOG1\n'
+_length = struct.Struct('<I')
+_formats = {'int':struct.Struct('<q'),'float':struct.Struct('<d')}
+
+class RecordCodec(object):
+    """Encodes one trial (a dict keyed by column name) as: record length, null bitmap, then each non-null
+    field (int64, float64, or utf-8 string with a length prefix)."""
+    def __init__(self, schema=DATA_SCHEMA):
+        self.schema = [(name,col_type) for name,col_type in schema]
+        self.bitmap_bytes = (len(self.schema)+7)//8
+
+    def encode(self, record):
+        nulls = 0
+        parts = []
+        for col_num,(name,col_type) in enumerate(self.schema):
+            value = coerce(record.get(name), col_type)
+            if value is None:
+                nulls |= 1 << col_num
+            elif col_type == 'str':
+                value = value.encode('utf-8')
+                parts.append(_length.pack(len(value)))
+                parts.append(value)
+            else:
+                parts.append(_formats[col_type].pack(value))
+        body = nulls.to_bytes(self.bitmap_bytes,'little') + b''.join(parts)
+        return _length.pack(len(body)) + body
+
+    def decode(self, body):
+        nulls = int.from_bytes(body[:self.bitmap_bytes],'little')
+        pos = self.bitmap_bytes
+        record = {}
+        for col_num,(name,col_type) in enumerate(self.schema):
+            if nulls & (1 << col_num):
+                record[name] = None
+            elif col_type == 'str':
+                (size,) = _length.unpack_from(body,pos)
+                pos += _length.size
+                record[name] = body[pos:pos+size].decode('utf-8')
+                pos += size
+            else:
+                (record[name],) = _formats[col_type].unpack_from(body,pos)
+                pos += _formats[col_type].size
+        return record
+
+def open_trial_log(path, schema=DATA_SCHEMA, checkpoint_every=None):
+    """Open (or append to) a binary trial log and return a DataWriter whose write() takes a dict per trial"""
+    codec = RecordCodec(schema)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        schema_json = json.dumps(codec.schema).encode('utf-8')
+        with open(path, 'wb') as log_file:
+            log_file.write(MAGIC + _length.pack(len(schema_json)) + schema_json)
+    return DataWriter(path, mode='ab', encode=codec.encode, checkpoint_every=checkpoint_every)
+
+def read_trial_log(path):
+    """Return (schema, list of record dicts). A record cut off by a crash at the end of the file is ignored."""
+    with open(path, 'rb') as log_file:
+        data = log_file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(path + ' is not a trial log')
+    pos = len(MAGIC)
+    (size,) = _length.unpack_from(data,pos)
+    pos += _length.size
+    codec = RecordCodec(json.loads(data[pos:pos+size].decode('utf-8')))
+    pos += size
+    records = []
+    while pos + _length.size <= len(data):
+        (size,) = _length.unpack_from(data,pos)
+        if pos + _length.size + size > len(data):
+            break
+        records.append(codec.decode(data[pos+_length.size:pos+_length.size+size]))
+        pos += _length.size + size
+    return codec.schema, records
+
+def compact_trial_log(log_path, out_path=None):
+    """Convert a trial log into a typed Parquet file (needs pyarrow) and return its path"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrow_types = {'int':pa.int64(),'float':pa.float64(),'str':pa.string()}
+    schema,records = read_trial_log(log_path)
+    if out_path is None:
+        out_path = os.path.splitext(log_path)[0]+'.parquet'
+    table = pa.table({name:pa.array([record[name] for record in records], type=arrow_types[col_type])
+        for name,col_type in schema})
+    tmp_path = out_path+'.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+if __name__ == '__main__':
+    #usage: python session_data.py data/<subj_code>_data.trlog [...] -- compact logs left over from crashed sessions
+    for log_path in sys.argv[1:]:
+        print(compact_trial_log(log_path))
@@ -0,0 +1,154 @@
+import os
+import glob
+import json
+import argparse
+import numpy as np
+from PIL import Image
+
+## Stimulus variants: a stimulus that is just a mirrored/rotated/scaled copy of another one doesn't need its own
+## file, decode or texture. A variant is (base name, transform), e.g. ('10_50', 'mirror'); StimulusCache (helper.py)
+## draws it with the base's texture and the transform's draw parameters (flipHoriz/flipVert/ori/size).
+## Transforms are strings of steps joined with '+': mirror, flip, rotate:<degrees clockwise>, scale:<factor>.
+##
+## Only use a variant where it really is equivalent to the stored file. `verify` decodes each stored file and its
+## base, tries the transforms and writes the ones that match (within JPEG noise) to a variants file:
+##
+##   python stimulus_variants.py verify --suffix _R --transforms mirror,flip,rotate:180 --out stimuli/variants.json
+
+def parse_transform(spec):
+    """'mirror+rotate:90' -> [('mirror', None), ('rotate', 90.0)]"""
+    steps = []
+    for step in spec.split('+'):
+        op,_,arg = step.strip().partition(':')
+        if op in ('mirror','flip','none'):
+            steps.append((op, None))
+        elif op in ('rotate','scale'):
+            steps.append((op, float(arg)))
+        else:
+            raise ValueError('unknown transform %r in %r' % (op, spec))
+    return steps
+
+def draw_params(spec):
+    """ImageStim settings that show the base stimulus transformed: flipHoriz, flipVert, ori (degrees clockwise,
+    added to the base's) and scale (of the base's size)"""
+    params = {'flipHoriz':False,'flipVert':False,'ori':0.0,'scale':1.0}
+    for op,arg in parse_transform(spec):
+        if op == 'mirror':
+            params['flipHoriz'] = not params['flipHoriz']
+        elif op == 'flip':
+            params['flipVert'] = not params['flipVert']
+        elif op == 'rotate':
+            params['ori'] += arg
+        elif op == 'scale':
+            params['scale'] *= arg
+    return params
+
+def apply_transform(pixels, spec):
+    """The transform applied to an (height, width[, channels]) uint8 array, the way draw_params shows it"""
+    for op,arg in parse_transform(spec):
+        if op == 'mirror':
+            pixels = pixels[:,::-1]
+        elif op == 'flip':
+            pixels = pixels[::-1]
+        elif op == 'rotate':
+            if arg % 90 == 0:
+                pixels = np.rot90(pixels, -int(arg//90) % 4)
+            else:
+                pixels = np.asarray(Image.fromarray(np.ascontiguousarray(pixels)).rotate(-arg, resample=Image.BILINEAR))
+        elif op == 'scale':
+            height,width = pixels.shape[:2]
+            size = (max(1,int(round(width*arg))), max(1,int(round(height*arg))))
+            pixels = np.asarray(Image.fromarray(np.ascontiguousarray(pixels)).resize(size, Image.LANCZOS))
+    return np.ascontiguousarray(pixels)
+
+class VariantStim(object):
+    """Draws a base ImageStim with a transform's draw parameters, then puts the base's own back. Anything else
+    (pos, opacity, ...) is the base's."""
+    def __init__(self, base, spec):
+        self.base = base
+        self.spec = spec
+        self.params = draw_params(spec)
+
+    def draw(self, win=None):
+        base = self.base
+        saved = (base.flipHoriz, base.flipVert, base.ori, base.size)
+        base.flipHoriz = saved[0] != self.params['flipHoriz']
+        base.flipVert = saved[1] != self.params['flipVert']
+        base.ori = saved[2]+self.params['ori']
+        if self.params['scale'] != 1.0:
+            base.size = np.asarray(saved[3], dtype=float)*self.params['scale']
+        base.draw(win)
+        base.flipHoriz,base.flipVert,base.ori,base.size = saved
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+def read_variants(path):
+    """{variant name: (base name, transform)} from a variants file ({} if there isn't one)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as variants_file:
+        variants = json.load(variants_file)['variants']
+    return dict((name,(entry['base'],entry['transform'])) for name,entry in variants.items())
+
+def compare(a, b):
+    """Mean and 99th percentile of the absolute pixel difference (None if the shapes differ)"""
+    if a.shape != b.shape:
+        return None
+    diff = np.abs(a.astype(np.int16)-b.astype(np.int16))
+    return float(diff.mean()), float(np.percentile(diff, 99))
+
+def verify(image_dir, suffix='_R', transforms=('mirror','flip','rotate:180'), extension='.jpg', max_mean=2.0, max_p99=16.0):
+    """Check every <base><suffix> file against its base under each transform. Returns one row per pair:
+    {'name','base','transform' (the best one),'mean_diff','p99_diff','equivalent'}"""
+    rows = []
+    for path in sorted(glob.glob(os.path.join(image_dir,'*'+suffix+extension))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        base = name[:-len(suffix)]
+        base_path = os.path.join(image_dir,base+extension)
+        if not os.path.exists(base_path):
+            continue
+        with Image.open(path) as im:
+            stored = np.asarray(im.convert('RGB'))
+        with Image.open(base_path) as im:
+            base_pixels = np.asarray(im.convert('RGB'))
+        best = None
+        for spec in transforms:
+            result = compare(apply_transform(base_pixels, spec), stored)
+            if result is not None and (best is None or result[0] < best[1]):
+                best = (spec,)+result
+        if best is None:
+            continue
+        rows.append({'name':name,'base':base,'transform':best[0],'mean_diff':round(best[1],2),'p99_diff':best[2],
+            'equivalent':best[1] <= max_mean and best[2] <= max_p99})
+    return rows
+
+def write_variants(rows, path, extension='.jpg'):
+    """Write the equivalent rows as a variants file for read_variants / load_files(variants=...)"""
+    variants = dict((row['name'],{'base':row['base'],'transform':row['transform'],'mean_diff':row['mean_diff']})
+        for row in rows if row['equivalent'])
+    with open(path, 'w') as variants_file:
+        json.dump({'extension':extension,'variants':variants}, variants_file, indent=1)
+    return variants
+
+if __name__ == '__main__':
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Find stored stimuli that are transforms of other stimuli')
+    parser.add_argument('command', choices=['verify'])
+    parser.add_argument('--images', default=os.path.join(cur_dir,'stimuli','images'))
+    parser.add_argument('--suffix', default='_R')
+    parser.add_argument('--extension', default='.jpg')
+    parser.add_argument('--transforms', default='mirror,flip,rotate:180', help='comma-separated transforms to try')
+    parser.add_argument('--max-mean', type=float, default=2.0, help='largest mean abs difference that counts as equivalent')
+    parser.add_argument('--max-p99', type=float, default=16.0, help='largest 99th percentile abs difference')
+    parser.add_argument('--out', help='write the equivalent variants here (e.g. stimuli/variants.json)')
+    args = parser.parse_args()
+    rows = verify(args.images, args.suffix, args.transforms.split(','), args.extension, args.max_mean, args.max_p99)
+    for row in rows:
+        print('%-16s %-12s best %-12s mean %6.2f  p99 %6.1f  %s' % (row['name'], row['base'], row['transform'],
+            row['mean_diff'], row['p99_diff'], 'equivalent' if row['equivalent'] else 'different'))
+    equivalent = [row for row in rows if row['equivalent']]
+    print('%d of %d stored variants are transforms of their base' % (len(equivalent), len(rows)))
+    if args.out:
+        write_variants(rows, args.out, args.extension)
+        print(args.out)
@@ -0,0 +1,193 @@
+import sys
+import csv
+import itertools
+from array import array
+
+## Reading trial lists: stream_trials yields typed rows lazily from a CSV file, a Parquet file or any iterable of
+## dicts; TrialTable keeps them column by column (ints/floats in typed arrays, repeated strings shared) and gives
+## random access by trial index, e.g. to resume a session part way through the list.
+
+#column name, type ('int', 'float' or 'str'); columns that are not listed are read as strings
+TRIAL_SCHEMA = [('subj_code','str'),('seed','int'),('test_mode','str'),('image_name','str'),('item','int'),
+    ('angle','int'),('match','str'),('correct_response','str')]
+
+MISSING = ('NA','',None)
+
+def coerce(value, col_type):
+    """Convert a raw (usually string) value to its column type; 'NA' and empty values become None"""
+    if value in MISSING:
+        return None
+    if col_type == 'int':
+        return int(value)
+    if col_type == 'float':
+        return float(value)
+    return str(value)
+
+def _csv_chunks(path, col_names=None, separator=',', chunk_size=4096):
+    """Yield (column names, list of up to chunk_size rows) from a CSV file"""
+    with open(path, 'r', newline='') as trial_file:
+        reader = csv.reader(trial_file, delimiter=separator)
+        if col_names is None:
+            # Assume the first row contains the column names
+            col_names = next(reader)
+        while True:
+            rows = [row for row in itertools.islice(reader, chunk_size) if row]
+            if not rows:
+                return
+            for row in rows:
+                if len(row) != len(col_names): # make sure the number of column names = number of columns
+                    raise ValueError('%s: row %r has %d columns, expected %d' % (path, row, len(row), len(col_names)))
+            yield col_names, rows
+
+def _parquet_rows(path):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(path).iter_batches():
+        for row in batch.to_pylist():
+            yield row
+
+def _convert_column(values, col_type):
+    """Convert one column of raw values, all at once when nothing is missing"""
+    if col_type in ('int','float'):
+        try:
+            return list(map(int if col_type == 'int' else float, values))
+        except (ValueError, TypeError):
+            return [coerce(value, col_type) for value in values]
+    return [None if value in MISSING else sys.intern(str(value)) for value in values]
+
+def _typed_rows(source, schema, col_names=None, separator=','):
+    types = dict(schema)
+    if isinstance(source, str) and not source.endswith('.parquet'):
+        for names,rows in _csv_chunks(source, col_names, separator):
+            columns = [_convert_column(values, types.get(name,'str')) for name,values in zip(names, zip(*rows))]
+            for row in zip(*columns):
+                yield dict(zip(names, row))
+    else:
+        rows = _parquet_rows(source) if isinstance(source, str) else source
+        for row in rows:
+            yield {name:coerce(value, types.get(name,'str')) for name,value in row.items()}
+
+def stream_trials(source, schema=TRIAL_SCHEMA, col_names=None, separator=',', start=0):
+    """Yield one typed dict per trial, starting at trial index `start`, without reading the whole file first.
+    source is a .csv path (quoted fields are fine), a .parquet path (needs pyarrow) or an iterable of dicts."""
+    return itertools.islice(_typed_rows(source, schema, col_names, separator), start, None)
+
+class Trial(object):
+    """One row of a TrialTable. Reads like the dicts import_trials used to return (cur_trial['image_name'],
+    iterating gives the column names) but only stores the table and the row number."""
+    __slots__ = ('table','index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.table.columns[name][self.index]
+
+    def __iter__(self):
+        return iter(self.table.names)
+
+    def __len__(self):
+        return len(self.table.names)
+
+    def __contains__(self, name):
+        return name in self.table.columns
+
+    def keys(self):
+        return list(self.table.names)
+
+    def values(self):
+        return [self[name] for name in self.table.names]
+
+    def items(self):
+        return [(name,self[name]) for name in self.table.names]
+
+    def get(self, name, default=None):
+        return self[name] if name in self.table.columns else default
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+class TrialTable(object):
+    """Column-oriented trial list with random access: table[i] is a Trial, iter_from(i) resumes at trial i"""
+    _array_codes = {'int':'q','float':'d'}
+
+    def __init__(self, schema=TRIAL_SCHEMA):
+        self.types = dict(schema)
+        self.names = []
+        self.columns = {}
+        self.length = 0
+
+    @classmethod
+    def load(cls, source, schema=TRIAL_SCHEMA, col_names=None, separator=','):
+        table = cls(schema)
+        if isinstance(source, str) and not source.endswith('.parquet'):
+            #CSV files are converted a column at a time, which is much faster than row by row
+            for names,rows in _csv_chunks(source, col_names, separator):
+                table.extend_columns(names, rows)
+        else:
+            for row in stream_trials(source, schema, col_names, separator):
+                table.append(row)
+        return table
+
+    def _add_column(self, name):
+        col_type = self.types.get(name,'str')
+        if col_type in self._array_codes and self.length == 0:
+            column = array(self._array_codes[col_type])
+        else:
+            column = [None]*self.length #earlier rows did not have this column
+        self.names.append(name)
+        self.columns[name] = column
+
+    def append(self, row):
+        for name in row:
+            if name not in self.columns:
+                self._add_column(name)
+        for name in self.names:
+            value = row.get(name)
+            column = self.columns[name]
+            if isinstance(value, str):
+                value = sys.intern(value) #item/condition strings repeat a lot; store each once
+            elif value is None and isinstance(column, array):
+                #missing numbers need a plain list
+                column = self.columns[name] = list(column)
+            column.append(value)
+        self.length += 1
+
+    def extend_columns(self, names, rows):
+        """Add rows given as lists of raw (string) values in the order of names"""
+        for name in names:
+            if name not in self.columns:
+                self._add_column(name)
+        for name,values in zip(names, zip(*rows)):
+            values = _convert_column(values, self.types.get(name,'str'))
+            column = self.columns[name]
+            if isinstance(column, array) and None in values:
+                #missing numbers need a plain list
+                column = self.columns[name] = list(column)
+            column.extend(values)
+        for name in self.names:
+            if name not in names:
+                self.columns[name].extend([None]*len(rows))
+        self.length += len(rows)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Trial(self, i) for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return Trial(self, index)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        for index in range(start, self.length):
+            yield Trial(self, index)
+
+    def column(self, name):
+        return self.columns[name]
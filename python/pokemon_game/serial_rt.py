@@ -1,4 +1,8 @@
 from psychopy import visual, event, core # import the bits of PsychoPy we'll need for this walkthrough
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.scene import Scene, Layer
 
 ## Serial RT task - in progress
 
@@ -15,23 +19,24 @@ box_positions = [(-300,-100),(-100,-100),(100,-100),(300,-100)]
 box_list = [visual.Rect(win,fillColor="white",lineWidth=5,lineColor="black",size=[100,100],pos=box_position) for box_position in box_positions]
 print(box_list)
 
-#draw boxes
-for box in box_list:
-    box.draw()
-
 #add labels
 box_labels = ["1","2","3","4"]
 text_position = {"1":(-300,-100),"2":(-100,-100),"3":(100,-100),"4":(300,-100)}
 text_list = [visual.TextStim(win,text = box_label, color="black",height=75,pos=text_position[box_label]) for box_label in box_labels]
-#draw labels
-for text in text_list:
-    text.draw()
 
-# add Pokemon
+#the boxes and labels never change, so they are drawn once into a cached background image;
+#only the highlight around the current box is drawn on top of it each frame
+highlight = visual.Rect(win,fillColor=None,lineWidth=10,lineColor="yellow",size=[120,120],pos=box_positions[0])
+scene = Scene(win)
+scene.add(Layer(box_list+text_list))
+scene.add(Layer([highlight],static=False))
 
-#show
-win.flip()
+# add Pokemon
 
-#wait 5 seconds
-core.wait(5)
+#show, moving the highlight to the next box every second for 5 seconds
+timer = core.Clock()
+while timer.getTime() < 5:
+    highlight.pos = box_positions[int(timer.getTime()) % len(box_positions)]
+    scene.draw()
+    win.flip()
 
@@ -1,11 +1,20 @@
-from psychopy import visual, event, core, sound # import the bits of PsychoPy we'll need for this walkthrough
+from psychopy import visual, event, core # import the bits of PsychoPy we'll need for this walkthrough
 import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.mouse_tracking import MouseTracker, HitTester, TrajectoryWriter, trajectory_measures
+from lab_utils.audio import FeedbackSounds
+from lab_utils.input_bus import InputBus
+from lab_utils.stimuli import StimulusStore
 
 #open a window
 win = visual.Window([800,800],color="grey", units='pix', checkTiming=False) 
 
 # add a Mouse
 mouse = event.Mouse(win=win)
+# record the mouse's path (from the input bus's read of the mouse after every flip, below)
+mouse_tracker = MouseTracker()
 
 #positions
 positions = {"left": (-200,0),"right": (200,0)}
@@ -18,57 +27,73 @@ frame_list = [visual.Rect(win,fillColor="white",lineWidth=5,lineColor="black",si
 instruction_text = "Click on the bulbasaur."
 instruction = visual.TextStim(win, text = instruction_text,color="white", height=30, pos = (0,-150))
 
-#create images
-image_path_1 = os.path.join(os.getcwd(),"stimuli","images","bulbasaur.png")
-image_path_2 = os.path.join(os.getcwd(),"stimuli","images","charmander.png")
-
-image_1 = visual.ImageStim(win,image=image_path_1,size=[200,200],pos=positions["left"])
-image_2 = visual.ImageStim(win,image=image_path_2,size=[200,200],pos=positions["right"])
+#create images: stimuli are looked up by name in the shared stimulus store (see lab_utils/stimuli.py), which hands
+#out pixels already decoded by whichever task used them first
+stimulus_store = StimulusStore()
+image_1 = visual.ImageStim(win,image=stimulus_store.image("images/bulbasaur"),size=[200,200],pos=positions["left"])
+image_2 = visual.ImageStim(win,image=stimulus_store.image("images/charmander"),size=[200,200],pos=positions["right"])
 
 #add feedback
 correct_feedback = visual.TextStim(win, text = "Correct!",color="white", height=30, pos = (0,0))
 incorrect_feedback = visual.TextStim(win, text = "Incorrect.",color="white", height=30, pos = (0,0))
 
-# add audio feedback
-correct_feedback_sound_path = os.path.join(os.getcwd(),"stimuli","sounds","bleep.wav")
-correct_feedback_sound = sound.Sound(correct_feedback_sound_path)
-incorrect_feedback_sound_path = os.path.join(os.getcwd(),"stimuli","sounds","buzz.wav")
-incorrect_feedback_sound = sound.Sound(incorrect_feedback_sound_path)
-
-# draw boxes
-for frame in frame_list:
-    frame.draw()
-
-#draw instruction
-instruction.draw()
-
-# draw images
-image_1.draw()
-image_2.draw()
-
-#show
-win.flip()
-
-#check mouse until pressed in one of the pics
-while True:
-     if mouse.isPressedIn(image_1) or mouse.isPressedIn(image_2):
-            response = mouse.getPos()
-            break
+# add audio feedback: both sounds are decoded once and played through an output stream that stays open
+feedback_sounds = FeedbackSounds({'correct':'sounds/bleep','incorrect':'sounds/buzz'}, store=stimulus_store)
+
+# the pictures that can be clicked, tested all at once
+targets = HitTester([image_1, image_2])
+mouse_tracker.start_trial()
+
+#the input bus reads the mouse after every flip (when the window has just handled its events) and hands a press on
+#one of the pictures to the handler; each flip waits for the screen to refresh, so this doesn't spin the CPU
+input_bus = InputBus(mouse=mouse, keyboard=False).install(win)
+input_bus.on_sample(mouse_tracker.record)
+clicks = []
+input_bus.on_click(targets, lambda click_event, index: clicks.append((index, np.asarray(click_event.pos), click_event.time)))
+while not clicks:
+    # draw boxes
+    for frame in frame_list:
+        frame.draw()
+
+    #draw instruction
+    instruction.draw()
+
+    # draw images
+    image_1.draw()
+    image_2.draw()
+
+    #show
+    win.flip()
+clicked_image,response,click_time = clicks[0]
+input_bus.uninstall()
+
+# save the path the mouse took to the click (written in the background)
+trajectory = mouse_tracker.end_trial()
+if not os.path.isdir(os.path.join(os.getcwd(),'data')):
+    os.makedirs(os.path.join(os.getcwd(),'data'))
+trajectory_file = TrajectoryWriter(os.path.join(os.getcwd(),'data','mouse_trajectory.csv'))
+trajectory_file.write(0, trajectory)
+print(trajectory_measures(trajectory['x'], trajectory['y']))
 
 # present feedback
-if image_1.contains(response):
+if clicked_image == 0:
      #correct
      correct_feedback.draw()
-     correct_feedback_sound.play() 
+     #the sound starts on the same flip as the text
+     feedback_sounds.play_on_flip('correct', win)
 else:
      #incorrect
      incorrect_feedback.draw()
-     incorrect_feedback_sound.play()
+     feedback_sounds.play_on_flip('incorrect', win)
 
 win.flip()
 
 #wait 2 seconds
 core.wait(2)
+print(feedback_sounds.summary())
+
+trajectory_file.close()
+feedback_sounds.close()
 
 win.close() #close the window
 core.quit() #quit out of the program
@@ -1,6 +1,9 @@
 import time
 import sys
+import os
 from psychopy import visual,event,core # import the bits of PsychoPy we'll need for this exercise
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.animation import Animator
 
 win = visual.Window([400,400],color="black", units='pix',checkTiming=False) #open a window
 
@@ -43,22 +46,22 @@ core.wait(1)
 #     core.wait(0.125) 
 
 # 7.
-value = 0
-continue_rotation = True
+# 45 degree jumps every 0.125 s, timed by the flips: the animator works out the angle from the time of the flip that
+# will show it, so the square turns at the same speed on any refresh rate (s stops it, r starts it again, q quits)
+animator = Animator(win).install()
+rotation = animator.spin([square], 360, step=45)
 while(True):
-    while(continue_rotation):
-        value += 45
-        square.setOri(value)
-        square.draw()
-        win.flip()
-        
-        keys = event.getKeys()
-        if 's' in keys:
-            continue_rotation = False
-        core.wait(0.125)
+    animator.update()
+    square.draw()
+    win.flip()
+
     keys = event.getKeys()
+    if 's' in keys:
+        animator.pause(rotation)
     if 'r' in keys:
-        continue_rotation = True
+        animator.resume(rotation)
+    if 'q' in keys:
+        break
 
 
 
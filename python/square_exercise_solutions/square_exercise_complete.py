@@ -1,25 +1,35 @@
 import time
 import sys
-from psychopy import visual,event,core # import the bits of PsychoPy we'll need for this exercise
+import os
+from psychopy import visual,core # import the bits of PsychoPy we'll need for this exercise
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.input_bus import InputBus
+from lab_utils.animation import Animator
 
 win = visual.Window([400,400],color="black", units='pix',checkTiming=False) #open a window
 left_square = visual.Rect(win,lineColor="black",fillColor="blue",size=[100,100],pos = (-100,0)) #create a Rectangle type object with certain parameters
 right_square = visual.Rect(win,lineColor="black",fillColor="blue",size=[100,100],pos = (100,0)) #create a Rectangle type object with certain parameters
 
-spinning = True
-while True:
-    if spinning:
-        left_square.ori += 6
-        left_square.draw()
-        right_square.ori += -6
-        right_square.draw()
-        win.flip()
-    if event.getKeys('s'):
-        spinning = False
-    if event.getKeys('r'):
-        spinning = True
-    if event.getKeys('q'):
-        break
+#the squares turn at 360 degrees a second (what 6 degrees a frame was at 60 Hz), whatever the refresh rate: their
+#angle comes from the time of the flip that shows them, not from how many flips there have been
+animator = Animator(win).install()
+spins = [animator.spin([left_square], 360), animator.spin([right_square], -360)]
+
+#s stops the squares, r starts them again and q quits. The keyboard is read once per flip and each key goes to its
+#handler, so no key is lost (every getKeys call empties the whole key buffer, whatever keys it asks for)
+state = {'running':True}
+input_bus = InputBus(keys=['s','r','q']).install(win)
+input_bus.on_key('s', lambda key_event: [animator.pause(spin) for spin in spins])
+input_bus.on_key('r', lambda key_event: [animator.resume(spin) for spin in spins])
+input_bus.on_key('q', lambda key_event: state.update(running=False))
+
+#the squares are drawn (standing still while stopped) and flipped every frame, so the flip paces the loop
+while state['running']:
+    animator.update()
+    left_square.draw()
+    right_square.draw()
+    win.flip()
+print(animator.summary())
 
 win.close() #close the window -- don't need this if you're running this as a separate file
 core.quit() #quit out of the program -- don't need this if you're running this as a separate file
\ No newline at end of file
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import random
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+## Benchmark of the per-trial cost of switching the Stroop stimulus: setText + setColor on one TextStim and drawing
+## it over the placeholder (the starter script) vs drawing one of the 25 prerendered textures (stroop_task_complete.py).
+## Each timing runs from the switch to the end of the draw, with glFinish so the GPU work is counted too.
+## Needs a real window, so run it on a lab machine (python -m lab_utils.headless stroop_task/bench_stroop.py only
+## checks that it runs).
+##
+##   python bench_stroop.py [num_trials]
+
+from psychopy import visual
+from stroop import colors, StroopStimuli
+
+try:
+    from pyglet.gl import glFinish
+except ImportError:
+    glFinish = lambda: None
+
+def settext_switch(win, placeholder, word_stim, trials):
+    times = []
+    for word,ink in trials:
+        start = time.perf_counter()
+        word_stim.setText(word)
+        word_stim.setColor(ink)
+        placeholder.draw()
+        word_stim.draw()
+        glFinish()
+        times.append(time.perf_counter()-start)
+        win.flip()
+    return times
+
+def prerendered_switch(win, variants, trials):
+    times = []
+    for word,ink in trials:
+        start = time.perf_counter()
+        variants[(word,ink)].draw()
+        glFinish()
+        times.append(time.perf_counter()-start)
+        win.flip()
+    return times
+
+def report(label, times):
+    times = sorted(t*1e6 for t in times)
+    print('%-40s mean %8.1f us  p99 %8.1f us  max %8.1f us' % (label, sum(times)/len(times),
+        times[int(len(times)*.99)], times[-1]))
+
+if __name__ == '__main__':
+    num_trials = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 300
+    rng = random.Random(0)
+    trials = [(rng.choice(colors), rng.choice(colors)) for _ in range(num_trials)]
+    win = visual.Window([800,600],color="gray", units='pix',checkTiming=False)
+    placeholder = visual.Rect(win,width=180,height=80, fillColor="lightgray",lineColor="black", lineWidth=6,pos=[0,0])
+    word_stim = visual.TextStim(win,text="", height=40, color="black",pos=[0,0],font='Arial')
+    start = time.perf_counter()
+    variants = StroopStimuli(win, colors, colors, size=(186,86), backdrop=[placeholder], text_kwargs={'height':40,'font':'Arial'})
+    print('prerendering %d variants: %.1f ms' % (len(variants), (time.perf_counter()-start)*1000))
+    report('setText + setColor every trial (old)', settext_switch(win, placeholder, word_stim, trials))
+    report('prerendered texture', prerendered_switch(win, variants, trials))
+    win.close()
@@ -0,0 +1,88 @@
+import os
+import sys
+from fractions import Fraction
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.design import Design, Factor, MaxRunLength, subject_rng
+
+## Stroop trials and stimuli:
+##
+##    trials = stroop_trials(seed, congruent_proportion=.5, repetitions=2)   #list of dicts, one per trial
+##    variants = StroopStimuli(win, colors, colors, size=(186,86), backdrop=[placeholder])
+##    variants[(trial['word'],trial['ink'])].draw()
+##
+## Every word x ink combination is drawn once at startup (on top of the placeholder) into its own texture, so the
+## trial loop never lays out or rasterizes text: showing a different word is drawing a different texture.
+
+colors = ['red', 'orange', 'yellow', 'green', 'blue']
+
+def congruency(columns):
+    return np.where(columns['word'] == columns['ink'], 'congruent', 'incongruent')
+
+def correct_response(columns):
+    #the first letter of the ink color (they are all different)
+    return columns['ink'].astype('U1')
+
+def congruency_weights(congruent_proportion, num_colors):
+    """Copies of each congruent and of each incongruent word/ink pair that give congruent_proportion congruent trials
+    (a crossing has num_colors congruent and num_colors*(num_colors-1) incongruent pairs)"""
+    if not 0 <= congruent_proportion < 1:
+        raise ValueError('congruent_proportion must be in [0, 1), got %s' % congruent_proportion)
+    ratio = Fraction(congruent_proportion/(1-congruent_proportion)*(num_colors-1)).limit_denominator(4*num_colors)
+    return ratio.numerator, ratio.denominator
+
+def default_max_run(congruent, incongruent):
+    """Longest run of one congruency to allow: 4, or twice an even spread of the common kind between the rare one"""
+    if not congruent or not incongruent:
+        return None
+    rare,common = sorted([congruent, incongruent])
+    return max(4, 2*-(-common//(rare+1)))
+
+def stroop_design(words=colors, inks=colors, congruent_proportion=.5, repetitions=1, max_run=None, constraints=None):
+    """word x ink, with congruent pairs repeated to get congruent_proportion of the trials; by default no more than
+    max_run (see default_max_run) congruent or incongruent trials in a row and never the same ink twice in a row"""
+    congruent_copies,incongruent_copies = congruency_weights(congruent_proportion, len(inks))
+    if constraints is None:
+        congruent = congruent_copies*len(inks)*repetitions
+        incongruent = incongruent_copies*len(inks)*(len(inks)-1)*repetitions
+        max_run = max_run or default_max_run(congruent, incongruent)
+        constraints = [MaxRunLength('ink', 1)]
+        if max_run is not None:
+            constraints.append(MaxRunLength('congruency', max_run))
+    return Design([Factor('word', words), Factor('ink', inks)], repetitions=repetitions,
+        derived={'congruency':congruency, 'correct_response':correct_response},
+        constraints=constraints,
+        column_order=['word','ink','congruency','correct_response'],
+        weights=lambda columns: np.where(columns['congruency'] == 'congruent', congruent_copies, incongruent_copies))
+
+def stroop_trials(seed, congruent_proportion=.5, repetitions=1, **kwargs):
+    """One subject's shuffled trials as a list of dicts (same seed, same list)"""
+    design = stroop_design(congruent_proportion=congruent_proportion, repetitions=repetitions, **kwargs)
+    columns = design.trials(subject_rng(seed))
+    return [dict((name, str(columns[name][row])) for name in design.names) for row in range(design.num_trials)]
+
+def _norm_rect(win, pos, size):
+    """(left, top, right, bottom) in norm units of a pix-unit box, as BufferImageStim wants it"""
+    half_width,half_height = win.size[0]/2., win.size[1]/2.
+    return ((pos[0]-size[0]/2.)/half_width, (pos[1]+size[1]/2.)/half_height,
+        (pos[0]+size[0]/2.)/half_width, (pos[1]-size[1]/2.)/half_height)
+
+class StroopStimuli(object):
+    """A BufferImageStim per (word, ink), captured from `size` pixels around pos with the backdrop stimuli drawn
+    under the word. Build it before the first trial: capturing draws into (and clears) the back buffer."""
+    def __init__(self, win, words, inks, size, backdrop=(), pos=(0,0), text_kwargs=None):
+        from psychopy import visual
+        text = visual.TextStim(win, text='', pos=pos, **(text_kwargs or {'height':40}))
+        rect = _norm_rect(win, pos, size)
+        self.variants = {}
+        for word in words:
+            for ink in inks:
+                text.text = word
+                text.color = ink
+                self.variants[(word,ink)] = visual.BufferImageStim(win, stim=list(backdrop)+[text], rect=rect)
+
+    def __getitem__(self, key):
+        return self.variants[key]
+
+    def __len__(self):
+        return len(self.variants)
@@ -0,0 +1,85 @@
+import os
+import sys
+from psychopy import visual,core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lab_utils.timeline import Timeline, Phase
+from lab_utils.frame_timing import FlipRecorder
+from lab_utils.key_response import default_key_source
+from lab_utils.data_writer import DataWriter
+from lab_utils.launcher import get_runtime_vars
+from stroop import colors, stroop_trials, StroopStimuli
+
+#get runtime variables
+runtime_vars = get_runtime_vars({'subj_code':'stroop_101','seed':1,'congruent_proportion':.5,'repetitions':2},
+    ['subj_code','seed','congruent_proportion','repetitions'], exp_version='stroop')
+if runtime_vars is None:
+    core.quit()
+
+win = visual.Window([800,600],color="gray", units='pix',checkTiming=False)
+flip_recorder = FlipRecorder(win).install()
+placeholder = visual.Rect(win,width=180,height=80, fillColor="lightgray",lineColor="black", lineWidth=6,pos=[0,0])
+instruction = visual.TextStim(win,text="Press the first letter of the ink color", height=20, color="black",pos=[0,-200])
+fixation = visual.TextStim(win,text="+", height=40, color="black",pos=[0,0])
+
+#every word in every ink, drawn on the placeholder once now; a trial just draws one of these 25 textures
+variants = StroopStimuli(win, colors, colors, size=(186,86), backdrop=[placeholder], text_kwargs={'height':40,'font':'Arial'})
+
+#congruent and incongruent trials in the requested proportion, shuffled with limits on runs (see stroop.py)
+trials = stroop_trials(runtime_vars['seed'], float(runtime_vars['congruent_proportion']), int(runtime_vars['repetitions']))
+response_keys = [color[0] for color in colors]
+
+if not os.path.isdir(os.path.join(os.getcwd(),'data')):
+    os.makedirs(os.path.join(os.getcwd(),'data'))
+header = ['subj_code','seed','trial_num','word','ink','congruency','correct_response','response','rt','correct',
+    'word_ms','dropped_frames','late_frames']
+data_file = DataWriter(os.path.join(os.getcwd(),'data',runtime_vars['subj_code']+'_stroop.csv'),header=header)
+
+def show_word(trial):
+    return [variants[(trial['word'],trial['ink'])], instruction]
+
+def start_blank(trial):
+    timeline.add_task(record_trial, trial)
+
+def record_trial(trial):
+    if trial['response'] == 'q':
+        return
+    timing = flip_recorder.trial_timing(trial['trial_num'], ['word'])
+    data_file.write([runtime_vars['subj_code'],runtime_vars['seed'],trial['trial_num'],trial['word'],trial['ink'],
+        trial['congruency'],trial['correct_response'],trial['response'],trial['rt'],trial['correct'],
+        timing['word_ms'],timing['dropped_frames'],timing['late_frames']])
+    data_file.checkpoint()
+
+def score(trial):
+    #rt runs from the flip that showed the word to the key's own timestamp
+    if 'response' not in trial:
+        trial['response'],trial['rt'],trial['correct'] = 'NA','NA','NA'
+    else:
+        trial['rt'] = round(trial['rt']*1000, 2)
+        trial['correct'] = int(trial['response'] == trial['correct_response'])
+
+#fixation, then the word until a response (at most 2 s), then a blank placeholder
+timeline = Timeline(win, [
+    Phase('fixation', duration=.5, stims=[placeholder,instruction,fixation]),
+    Phase('word', duration=2.0, stims=show_word, keys=response_keys+['q'], key_source=default_key_source(), on_end=score),
+    Phase('blank', duration=.5, stims=[placeholder,instruction], on_start=start_blank),
+], recorder=flip_recorder)
+
+rts = {'congruent':[],'incongruent':[]}
+for trial_num,trial in enumerate(trials):
+    trial['trial_num'] = trial_num
+    timeline.run(trial, trial_num)
+    if trial['response'] == 'q':
+        break
+    if trial['correct'] == 1:
+        rts[trial['congruency']].append(trial['rt'])
+
+win.flip()
+timeline.flush()
+data_file.close()
+print(timeline.summary())
+print(flip_recorder.summary())
+for congruency,times in rts.items():
+    if times:
+        print('%-12s %3d correct, mean rt %.1f ms' % (congruency, len(times), sum(times)/len(times)))
+win.close()
+core.quit()